@@ -0,0 +1,16 @@
+"""
+Benchmarks for the import, normalization, pyramid, alignment and reconstruction
+hot paths, in airspeed velocity (asv) format.
+
+Each benchmark runs on synthetic datasets of several sizes (see
+`benchmarks.common.sizes`) and reports time (time_*), peak memory (peakmem_*)
+and throughput in projections/s or GB/s (track_*).
+
+Run them in the current environment with::
+
+    asv run --python=same --launch-method=spawn
+
+or against past commits with ``asv continuous main HEAD``. Synthetic datasets
+are cached in TOMOPYUI_BENCHMARK_DIR (default: a tomopyui-benchmarks folder in
+the temporary directory).
+"""
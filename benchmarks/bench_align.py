@@ -0,0 +1,54 @@
+import numpy as np
+
+from tomopyui.backend.util.alignment import batch_cross_correlation
+from tomopyui.backend.util.array_backend import NumpyBackend
+from tomopyui.backend.util.shift import shift_stack
+from .common import sizes, size_names, phantom_projections, nbytes_gb, timed
+
+
+class CrossCorrelation:
+    """
+    Phase cross correlation of projections with shifted copies of themselves on
+    the CPU backend, as in each alignment iteration.
+    """
+
+    params = sizes
+    param_names = size_names
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, size):
+        self.backend = NumpyBackend()
+        self.prj, _ = phantom_projections(*size)
+        rng = np.random.default_rng(0)
+        sx = rng.uniform(-5, 5, self.prj.shape[0])
+        sy = rng.uniform(-5, 5, self.prj.shape[0])
+        self.sim = shift_stack(self.prj.copy(), sx, sy, backend=self.backend)
+
+    def cross_correlate(self):
+        shifts = []
+        batch_cross_correlation(
+            self.prj,
+            self.sim,
+            shifts,
+            num_batches=1,
+            upsample_factor=50,
+            backend=self.backend,
+        )
+
+    def time_batch_cross_correlation(self, size):
+        self.cross_correlate()
+
+    def peakmem_batch_cross_correlation(self, size):
+        self.cross_correlate()
+
+    def track_projections_per_second(self, size):
+        return self.prj.shape[0] / timed(self.cross_correlate)
+
+    track_projections_per_second.unit = "projections/s"
+
+    def track_gb_per_second(self, size):
+        return nbytes_gb(self.prj) / timed(self.cross_correlate)
+
+    track_gb_per_second.unit = "GB/s"
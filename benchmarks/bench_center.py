@@ -0,0 +1,36 @@
+import numpy as np
+
+from tomopyui.backend.util.center import write_center
+from .common import sizes, size_names, phantom_projections, timed
+
+
+class CenterSweep:
+    """
+    Reconstructions of the middle slice for 40 centers of rotation.
+    """
+
+    params = sizes
+    param_names = size_names
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, size):
+        self.prj, self.angles = phantom_projections(*size)
+        center = self.prj.shape[2] / 2
+        self.cen_range = (center - 10, center + 10, 0.5)
+        self.num_centers = len(np.arange(*self.cen_range))
+
+    def sweep(self):
+        write_center(self.prj, self.angles, cen_range=self.cen_range)
+
+    def time_write_center(self, size):
+        self.sweep()
+
+    def peakmem_write_center(self, size):
+        self.sweep()
+
+    def track_centers_per_second(self, size):
+        return self.num_centers / timed(self.sweep)
+
+    track_centers_per_second.unit = "centers/s"
@@ -0,0 +1,122 @@
+import shutil
+import tempfile
+import pathlib
+
+import dask.array as da
+
+from tomopyui.backend.io import Projections_Prenormalized, RawProjectionsBase
+from tomopyui.backend.util.normalize import FlatFieldNormalizer
+from .common import (
+    sizes,
+    size_names,
+    raw_projections,
+    phantom_projections,
+    nbytes_gb,
+    timed,
+)
+
+
+class Normalize:
+    """
+    Dark/flat normalization and averaging of repeated exposures.
+    """
+
+    params = sizes
+    param_names = size_names
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, size):
+        self.num_exposures = 2
+        self.projs, self.flats, self.darks, self.flat_loc = raw_projections(
+            *size, num_exposures=self.num_exposures
+        )
+
+    def normalize(self):
+        projs = da.from_array(self.projs, chunks=(self.num_exposures, -1, -1))
+        flats = da.from_array(self.flats, chunks=(len(self.flats) // 2, -1, -1))
+        RawProjectionsBase.normalize_and_average(
+            projs,
+            flats,
+            self.darks,
+            self.flat_loc,
+            self.num_exposures,
+            compute=True,
+        )
+
+    def normalize_streaming(self):
+        FlatFieldNormalizer(
+            self.flats,
+            self.darks,
+            flat_loc=self.flat_loc,
+            num_exposures_per_proj=self.num_exposures,
+            num_exposures_per_flat=len(self.flats) // 2,
+        ).normalize(self.projs)
+
+    def time_normalize_and_average(self, size):
+        self.normalize()
+
+    def peakmem_normalize_and_average(self, size):
+        self.normalize()
+
+    def time_normalize_streaming(self, size):
+        self.normalize_streaming()
+
+    def peakmem_normalize_streaming(self, size):
+        self.normalize_streaming()
+
+    def track_projections_per_second(self, size):
+        return self.projs.shape[0] / timed(self.normalize)
+
+    track_projections_per_second.unit = "projections/s"
+
+    def track_gb_per_second(self, size):
+        return nbytes_gb(self.projs) / timed(self.normalize)
+
+    track_gb_per_second.unit = "GB/s"
+
+
+class HistAndSave:
+    """
+    Histogram of the normalized data, computed while writing it to HDF5.
+    """
+
+    params = sizes
+    param_names = size_names
+    number = 1
+    repeat = 3
+    timeout = 600
+
+    def setup(self, size):
+        self.prj, _ = phantom_projections(*size)
+        self.tmpdir = pathlib.Path(tempfile.mkdtemp())
+
+    def teardown(self, size):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def hist_and_save(self):
+        savedir = pathlib.Path(tempfile.mkdtemp(dir=self.tmpdir))
+        projections = Projections_Prenormalized()
+        projections.import_savedir = savedir
+        projections.filedir = savedir
+        projections.filepath = savedir / projections.normalized_projections_hdf_key
+        projections.data = da.from_array(self.prj, chunks="auto")
+        projections._dask_hist_and_save_data()
+        projections._close_hdf_file()
+
+    def time_dask_hist_and_save_data(self, size):
+        self.hist_and_save()
+
+    def peakmem_dask_hist_and_save_data(self, size):
+        self.hist_and_save()
+
+    def track_projections_per_second(self, size):
+        return self.prj.shape[0] / timed(self.hist_and_save)
+
+    track_projections_per_second.unit = "projections/s"
+
+    def track_gb_per_second(self, size):
+        return nbytes_gb(self.prj) / timed(self.hist_and_save)
+
+    track_gb_per_second.unit = "GB/s"
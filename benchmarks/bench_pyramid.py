@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import pathlib
+
+from tomopyui.backend.io import Projections_Prenormalized
+from tomopyui.backend.util.dask_downsample import pyramid_reduce_gaussian
+from .common import sizes, size_names, normalized_dataset, nbytes_gb, timed
+
+
+class Pyramid:
+    """
+    Downsampled pyramid (3 levels) of the normalized data, written to its HDF5
+    file.
+    """
+
+    params = sizes
+    param_names = size_names
+    number = 1
+    repeat = 3
+    timeout = 900
+
+    def setup(self, size):
+        self.tmpdir = pathlib.Path(tempfile.mkdtemp())
+        source = normalized_dataset(*size)
+        self.projections = Projections_Prenormalized()
+        self.filepath = self.tmpdir / self.projections.normalized_projections_hdf_key
+        shutil.copy(
+            source / self.projections.normalized_projections_hdf_key, self.filepath
+        )
+        self.projections.filepath = self.filepath
+        self.projections._open_hdf_file_read_only()
+        data = self.projections.hdf_file[self.projections.hdf_key_norm_proj]
+        self.shape = data.shape
+        self.nbytes_gb = nbytes_gb(data)
+        self.projections._close_hdf_file()
+
+    def teardown(self, size):
+        self.projections._close_hdf_file()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def pyramid(self):
+        self.projections.filepath = self.filepath
+        pyramid_reduce_gaussian(None, io_obj=self.projections)
+        self.projections._close_hdf_file()
+
+    def pyramid_single_pass(self):
+        self.projections.filepath = self.filepath
+        self.projections._write_downsampled_data()
+
+    def time_pyramid_reduce_gaussian(self, size):
+        self.pyramid()
+
+    def peakmem_pyramid_reduce_gaussian(self, size):
+        self.pyramid()
+
+    def time_write_downsampled_data(self, size):
+        self.pyramid_single_pass()
+
+    def peakmem_write_downsampled_data(self, size):
+        self.pyramid_single_pass()
+
+    def track_projections_per_second(self, size):
+        return self.shape[0] / timed(self.pyramid)
+
+    track_projections_per_second.unit = "projections/s"
+
+    def track_gb_per_second(self, size):
+        return self.nbytes_gb / timed(self.pyramid)
+
+    track_gb_per_second.unit = "GB/s"
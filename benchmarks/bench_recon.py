@@ -0,0 +1,47 @@
+import os
+import shutil
+
+from tomopyui.backend import batch
+from .common import sizes, size_names, normalized_dataset, timed
+
+
+class Reconstruction:
+    """
+    `RunRecon` on the normalized data, including writing the reconstruction.
+    """
+
+    params = [sizes, ["gridrec", "SIRT_CUDA"]]
+    param_names = size_names + ["method"]
+    number = 1
+    repeat = 3
+    timeout = 1800
+
+    def setup(self, size, method):
+        if method == "SIRT_CUDA" and os.environ.get("cuda_enabled") != "True":
+            raise NotImplementedError("SIRT_CUDA needs cuda.")
+        self.projections = batch.load_normalized(normalized_dataset(*size))
+        self.settings = batch.analysis_settings(
+            "recon", {"methods": {method: True}, "opts": {"num_iter": 20}}
+        )
+        self.num_angles = size[0]
+        self.wds = []
+
+    def teardown(self, size, method):
+        self.projections._close_hdf_file()
+        for wd in self.wds:
+            shutil.rmtree(wd, ignore_errors=True)
+
+    def reconstruct(self):
+        analysis = batch.reconstruct(self.projections, self.settings)
+        self.wds.append(analysis.wd)
+
+    def time_run_recon(self, size, method):
+        self.reconstruct()
+
+    def peakmem_run_recon(self, size, method):
+        self.reconstruct()
+
+    def track_projections_per_second(self, size, method):
+        return self.num_angles / timed(self.reconstruct)
+
+    track_projections_per_second.unit = "projections/s"
@@ -0,0 +1,131 @@
+"""
+Synthetic datasets and helpers shared by the benchmarks.
+"""
+
+import multiprocessing
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("num_cpu_cores", str(multiprocessing.cpu_count()))
+
+# (number of angles, image width) of the synthetic datasets. Images have
+# width // 2 rows.
+sizes = [(90, 128), (180, 256), (360, 512)]
+size_names = ["angles, width"]
+
+benchmark_dir = pathlib.Path(
+    os.environ.get(
+        "TOMOPYUI_BENCHMARK_DIR",
+        pathlib.Path(tempfile.gettempdir()) / "tomopyui-benchmarks",
+    )
+)
+
+
+def dataset_dir(num_angles, width):
+    return benchmark_dir / f"{num_angles}x{width // 2}x{width}"
+
+
+def phantom_projections(num_angles, width):
+    """
+    Projections of a Shepp-Logan phantom, shaped (num_angles, width // 2, width),
+    and their angles in radians. Cached as .npy files.
+    """
+    import tomopy
+
+    filedir = dataset_dir(num_angles, width)
+    filepath = filedir / "projections.npy"
+    angles = np.linspace(0, np.pi, num_angles, endpoint=False)
+    if filepath.exists():
+        return np.load(filepath), angles
+    filedir.mkdir(parents=True, exist_ok=True)
+    obj = tomopy.shepp3d(size=(width // 2, width, width))
+    prj = tomopy.project(obj, angles, pad=False).astype(np.float32)
+    # scale to absorption values of a real sample
+    prj *= 2 / prj.max()
+    np.save(filepath, prj)
+    return prj, angles
+
+
+def raw_projections(num_angles, width, num_exposures=2, num_flats=5, seed=0):
+    """
+    Raw counts for the phantom projections, with num_exposures exposures per
+    angle, num_flats flats before and after the scan, and darks.
+
+    Returns
+    -------
+    projs, flats, darks : ndarray
+    flat_loc : list
+        Projection indices where the flats were taken.
+    """
+    prj, _ = phantom_projections(num_angles, width)
+    rng = np.random.default_rng(seed)
+    intensity = 10000
+    shape = prj.shape[1:]
+    darks = rng.normal(100, 5, (num_flats,) + shape).astype(np.float32)
+    flats = rng.normal(intensity, 100, (2 * num_flats,) + shape).astype(np.float32)
+    projs = np.repeat(intensity * np.exp(-prj), num_exposures, axis=0)
+    projs += rng.normal(100, 5, projs.shape).astype(np.float32)
+    flat_loc = [0, num_angles * num_exposures]
+    return projs.astype(np.float32), flats, darks, flat_loc
+
+
+def normalized_dataset(num_angles, width):
+    """
+    Directory with the phantom projections imported through
+    `Projections_Prenormalized`, including histograms and the downsampled
+    pyramid. Created once and cached.
+    """
+    from tomopyui.backend.batch import HeadlessUploader
+    from tomopyui.backend.io import Metadata_General_Prenorm, Projections_Prenormalized
+
+    filedir = dataset_dir(num_angles, width)
+    import_dir = filedir / "import"
+    savedirs = sorted(import_dir.glob("*eV")) if import_dir.exists() else []
+    if savedirs and (savedirs[0] / "import_metadata.json").exists():
+        return savedirs[0]
+    shutil.rmtree(import_dir, ignore_errors=True)
+    import_dir.mkdir(parents=True)
+    prj, angles = phantom_projections(num_angles, width)
+    np.save(import_dir / "projections.npy", prj)
+    projections = Projections_Prenormalized()
+    projections.tiff_folder = False
+    projections.metadata = Metadata_General_Prenorm()
+    projections.metadata.metadata.update(
+        {
+            "energy_float": 8000.0,
+            "energy_str": "08000.00",
+            "energy_units": "eV",
+            "pixel_size": 30.0,
+            "pixel_units": "nm",
+            "binning": 1,
+            "start_angle": 0.0,
+            "end_angle": 180.0,
+            "angular_resolution": 180 / num_angles,
+            "pxX": prj.shape[2],
+            "pxY": prj.shape[1],
+            "pxZ": prj.shape[0],
+            "angles_rad": list(angles),
+            "angles_deg": list(np.degrees(angles)),
+        }
+    )
+    projections.metadatas = [projections.metadata]
+    projections.import_file_projections(HeadlessUploader(import_dir, "projections.npy"))
+    return projections.import_savedir
+
+
+def nbytes_gb(arr):
+    return np.prod(arr.shape) * np.dtype(arr.dtype).itemsize / 1024**3
+
+
+def timed(func, *args, **kwargs):
+    """
+    Seconds taken by func(*args, **kwargs).
+    """
+    tic = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - tic
@@ -0,0 +1,173 @@
+import subprocess
+import sys
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from tomopyui.backend.util.frames import LazyFrames
+from tomopyui.backend.util.hdf_pool import hdf_pool
+
+
+@pytest.fixture
+def pool():
+    # the pool open_store (and so LazyFrames) uses
+    hdf_pool.close_all()
+    yield hdf_pool
+    hdf_pool.close_all()
+
+
+@pytest.fixture
+def filepath(tmp_path):
+    filepath = tmp_path / "data.hdf5"
+    with h5py.File(filepath, "w") as f:
+        f["data"] = np.arange(60, dtype=np.float32).reshape(3, 4, 5)
+    return filepath
+
+
+def _read_in_other_process(filepath):
+    code = (
+        "import sys, h5py\n"
+        "with h5py.File(sys.argv[1], 'r') as f:\n"
+        "    print(float(f['data'][0, 0, 1]))\n"
+    )
+    return subprocess.run(
+        [sys.executable, "-c", code, str(filepath)], capture_output=True, text=True
+    )
+
+
+def _entry(pool, filepath):
+    return pool._entries.get(pool._path_key(filepath))
+
+
+def test_opens_of_a_path_share_one_handle(pool, filepath):
+    a = pool.open(filepath)
+    b = pool.open(str(filepath))
+    assert a.file is b.file
+    assert _entry(pool, filepath).refs == 2
+    a.close()
+    assert not a and b
+    assert _entry(pool, filepath).refs == 1
+    b.close()
+    # kept open for the next reader
+    entry = _entry(pool, filepath)
+    assert entry.refs == 0 and entry.file
+    with pool.open(filepath) as c:
+        assert c.file is entry.file
+        assert c["data"][0, 0, 1] == 1
+
+
+def test_refcount_under_threads(pool, filepath):
+    def borrow():
+        for _ in range(50):
+            with pool.open(filepath) as f:
+                f["data"][0]
+
+    threads = [threading.Thread(target=borrow) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _entry(pool, filepath).refs == 0
+
+
+def test_max_idle(pool, tmp_path, filepath, monkeypatch):
+    monkeypatch.setattr(pool, "max_idle", 1)
+    other = tmp_path / "other.hdf5"
+    h5py.File(other, "w").close()
+    pool.open(filepath).close()
+    pool.open(other).close()
+    assert _entry(pool, filepath) is None
+    assert _entry(pool, other) is not None
+
+
+def test_read_only_file_is_reopened_writable_when_unused(pool, filepath):
+    frames = LazyFrames(filepath, "data")
+    assert frames[0][0, 1] == 1
+    reader = pool.open(filepath, "r")
+    with pytest.raises(OSError):
+        pool.open(filepath, "a")
+    reader.close()
+    # lazy frames only borrow the file while they read
+    with pool.open(filepath, "a") as writer:
+        assert writer.file.mode == "r+"
+        writer["data"][0, 0, 1] = 100
+        assert frames[1][0, 1] == 21
+        assert frames[0, 0, 1] == 100
+    assert _entry(pool, filepath) is None
+    frames.close()
+
+
+def test_lazy_frames_of_a_missing_dataset(pool, filepath):
+    with pytest.raises(KeyError):
+        LazyFrames(filepath, "missing")
+    assert _entry(pool, filepath).refs == 0
+
+
+def test_held_dataset_survives_writers(pool, filepath):
+    with pool.open(filepath, "r") as reader:
+        data = reader["data"]
+    # the file can not be reopened under the dataset
+    with pytest.raises(OSError):
+        pool.open(filepath, "a")
+    assert data[0, 0, 1] == 1
+    del data
+    with pool.open(filepath, "a") as writer:
+        data = writer["data"]
+        data[0, 0, 1] = 100
+    # the last writer is done, but the dataset still uses the file
+    assert data[0, 0, 1] == 100
+    entry = _entry(pool, filepath)
+    assert entry.writable
+    with pool.open(filepath, "r") as reader:
+        assert reader.file is entry.file
+    assert data[0, 0, 2] == 2
+    del data
+    # closed on the next open or release, to let other processes in
+    pool.open(filepath, "r").close()
+    assert entry.file.id.valid == 0
+    result = _read_in_other_process(filepath)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "100.0"
+
+
+def test_held_dataset_is_not_closed_when_idle(pool, filepath, monkeypatch):
+    monkeypatch.setattr(pool, "max_idle", 0)
+    with pool.open(filepath) as reader:
+        data = reader["data"]
+    pool.close_idle()
+    assert data[0, 0, 1] == 1
+    del data
+    pool.close_idle()
+    assert _entry(pool, filepath) is None
+
+
+def test_truncate_closes_the_file_for_everyone(pool, filepath):
+    reader = pool.open(filepath)
+    with pool.open(filepath, "w") as writer:
+        assert "data" not in writer
+    assert not reader
+    reader.close()
+
+
+def test_written_file_is_readable_from_other_processes(pool, filepath):
+    with pool.open(filepath, "a") as f:
+        f["data"][0, 0, 1] = 7
+    assert _entry(pool, filepath) is None
+    result = _read_in_other_process(filepath)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "7.0"
+
+
+def test_file_written_while_read_is_closed_when_readers_are_done(pool, filepath):
+    writer = pool.open(filepath, "a")
+    reader = pool.open(filepath, "r")
+    writer.close()
+    # still used, so still open for writing
+    assert reader.file.mode == "r+"
+    assert reader["data"][0, 0, 1] == 1
+    reader.close()
+    assert _entry(pool, filepath) is None
+    result = _read_in_other_process(filepath)
+    assert result.returncode == 0, result.stderr
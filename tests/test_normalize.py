@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from tomopyui.backend.util.normalize import (
+    FlatFieldNormalizer,
+    flat_index_table,
+    nearest_flat_table,
+)
+
+
+def _raw_stack(num_proj=12, nexp=2, num_flats=3, nexp_flat=3, shape=(6, 5)):
+    rng = np.random.default_rng(0)
+    projs = rng.uniform(200, 400, (num_proj * nexp,) + shape).astype(np.float32)
+    flats = rng.uniform(800, 1000, (num_flats * nexp_flat,) + shape).astype(np.float32)
+    darks = rng.uniform(5, 15, (4,) + shape).astype(np.float32)
+    # flat collections at the start, middle and end of the raw frames
+    flat_loc = list(np.linspace(0, num_proj * nexp, num_flats).astype(int))
+    return projs, flats, darks, flat_loc
+
+
+def _reference(projs, flats, darks, flat_loc, nexp, nexp_flat):
+    # the "nearest" procedure of RawProjectionsBase.normalize_and_average, one
+    # frame at a time
+    dark = np.median(darks, axis=0)
+    flats = flats.reshape((-1, nexp_flat) + flats.shape[1:]).mean(axis=1) - dark
+    boundaries = [
+        int(np.ceil((flat_loc[i] + flat_loc[i + 1]) / 2))
+        for i in range(len(flat_loc) - 1)
+    ]
+    frames = np.empty(projs.shape, dtype=np.float64)
+    for i, frame in enumerate(projs):
+        flat = int(np.searchsorted(boundaries, i, side="right"))
+        frames[i] = (frame - dark) / flats[flat]
+    averaged = frames.reshape((-1, nexp) + projs.shape[1:]).mean(axis=1)
+    return -np.log(averaged)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("chunk_mb", [None, 1e-4])
+def test_normalize_matches_reference(workers, chunk_mb):
+    projs, flats, darks, flat_loc = _raw_stack()
+    normalizer = FlatFieldNormalizer(
+        flats,
+        darks,
+        flat_loc=flat_loc,
+        num_exposures_per_proj=2,
+        num_exposures_per_flat=3,
+        workers=workers,
+        chunk_mb=chunk_mb,
+    )
+    result = normalizer.normalize(projs)
+    expected = _reference(projs, flats, darks, flat_loc, 2, 3)
+    assert result.dtype == np.float32
+    assert result.shape == (12, 6, 5)
+    np.testing.assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+
+
+def test_normalize_writes_into_out():
+    projs, flats, darks, flat_loc = _raw_stack()
+    normalizer = FlatFieldNormalizer(
+        flats, darks, flat_loc, num_exposures_per_proj=2, num_exposures_per_flat=3
+    )
+    out = np.zeros((12, 6, 5), dtype=np.float32)
+    assert normalizer.normalize(projs, out=out) is out
+    np.testing.assert_allclose(out, normalizer.normalize(projs))
+
+
+def test_normalize_matches_normalize_and_average():
+    da = pytest.importorskip("dask.array")
+    io = pytest.importorskip("tomopyui.backend.io")
+    projs, flats, darks, flat_loc = _raw_stack()
+    expected = io.RawProjectionsBase.normalize_and_average(
+        da.from_array(projs, chunks=(2, -1, -1)),
+        da.from_array(flats, chunks=(3, -1, -1)),
+        darks,
+        flat_loc,
+        2,
+    )
+    normalizer = FlatFieldNormalizer(
+        flats, darks, flat_loc, num_exposures_per_proj=2, num_exposures_per_flat=3
+    )
+    np.testing.assert_allclose(normalizer.normalize(projs), expected, rtol=1e-5)
+
+
+def test_flat_index_table_nearest():
+    lo, hi, weights = flat_index_table(30, [0, 10, 20], mode="nearest")
+    np.testing.assert_array_equal(lo, nearest_flat_table(30, [0, 10, 20]))
+    np.testing.assert_array_equal(lo, hi)
+    assert not weights.any()
+    # boundaries halfway between the flat collections
+    assert lo[4] == 0 and lo[5] == 1 and lo[15] == 2
+
+
+def test_flat_index_table_interpolate():
+    lo, hi, weights = flat_index_table(25, [0, 10, 20], mode="interpolate")
+    frames = np.arange(25)
+    # between two collections, weighted by the distance to each
+    np.testing.assert_array_equal(lo[:20], frames[:20] // 10)
+    np.testing.assert_array_equal(hi[:20], frames[:20] // 10 + 1)
+    np.testing.assert_allclose(weights[:20], (frames[:20] % 10) / 10)
+    # after the last collection, only the last flat
+    np.testing.assert_array_equal(hi[20:], 2)
+    np.testing.assert_allclose(weights[20:], 1)
+
+
+def test_flat_index_table_interpolate_before_first_flat():
+    lo, hi, weights = flat_index_table(12, [5, 9], mode="interpolate")
+    np.testing.assert_array_equal(lo, 0)
+    np.testing.assert_array_equal(hi, 1)
+    np.testing.assert_allclose(weights[:6], 0)
+    np.testing.assert_allclose(weights[5:10], np.arange(5) / 4)
+    np.testing.assert_allclose(weights[9:], 1)
+
+
+def test_flat_index_table_interpolate_with_positions():
+    # frames taken 1 s apart, flats at 0 s and 30 s
+    lo, hi, weights = flat_index_table(
+        4,
+        [0, 3],
+        mode="interpolate",
+        frame_positions=[0, 10, 20, 30],
+        flat_positions=[0, 30],
+    )
+    np.testing.assert_allclose(weights, [0, 1 / 3, 2 / 3, 1])
+    with pytest.raises(ValueError):
+        flat_index_table(5, [0, 3], "interpolate", frame_positions=[0, 1])
+
+
+def test_flat_index_table_single_flat_and_bad_mode():
+    for flat_loc in (None, [4]):
+        lo, hi, weights = flat_index_table(6, flat_loc, mode="interpolate")
+        assert not lo.any() and not hi.any() and not weights.any()
+    with pytest.raises(ValueError):
+        flat_index_table(6, [0, 3], mode="linear")
+
+
+def test_normalize_interpolated_flats():
+    projs, flats, darks, flat_loc = _raw_stack(nexp=1, nexp_flat=1)
+    normalizer = FlatFieldNormalizer(
+        flats, darks, flat_loc, flat_mode="interpolate", workers=2
+    )
+    dark = np.median(darks, axis=0)
+    lo, hi, weights = flat_index_table(len(projs), flat_loc, mode="interpolate")
+    w = weights[:, None, None]
+    flat = (1 - w) * (flats[lo] - dark) + w * (flats[hi] - dark)
+    expected = -np.log((projs - dark) / flat)
+    np.testing.assert_allclose(normalizer.normalize(projs), expected, rtol=1e-5)
@@ -0,0 +1,58 @@
+import h5py
+import numpy as np
+import pytest
+
+from tomopyui.backend.util.pyramid import PyramidBuilder
+
+
+class RecordingDataset:
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.reads = []
+
+    def __getitem__(self, index):
+        self.reads.append(index)
+        return self.dataset[index]
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    return rng.random((40, 16, 24), dtype=np.float32)
+
+
+def _build(tmp_path, stack, chunks):
+    builder = PyramidBuilder(levels=2, workers=2)
+    # four projections a chunk
+    builder.chunk_mb = 4 * stack[0].nbytes / 1024**2
+    with h5py.File(tmp_path / "pyramid.hdf5", "w") as f:
+        data = RecordingDataset(f.create_dataset("data", data=stack))
+        outs = [
+            f.create_dataset(
+                str(i), shape=shape, dtype=np.float32, chunks=chunks(shape)
+            )
+            for i, shape in enumerate(builder.level_shapes(stack.shape))
+        ]
+        outs, _ = builder.build(data, outs)
+        levels = [out[:] for out in outs]
+    sizes = [index.stop - index.start for index in data.reads]
+    return levels, sizes, builder.reduce_chunk(stack)
+
+
+def test_steps_align_to_small_output_chunks(tmp_path, stack):
+    levels, sizes, expected = _build(tmp_path, stack, lambda shape: (5,) + shape[1:])
+    # rounded up from 4 to whole chunks of 5 projections
+    assert sizes == [5] * 8
+    for level, expected_level in zip(levels, expected):
+        np.testing.assert_array_equal(level, expected_level)
+
+
+def test_sinogram_chunked_output_is_not_read_at_once(tmp_path, stack):
+    levels, sizes, expected = _build(
+        tmp_path, stack, lambda shape: (shape[0], 1, shape[2])
+    )
+    assert sizes == [4] * 10
+    for level, expected_level in zip(levels, expected):
+        np.testing.assert_array_equal(level, expected_level)
@@ -0,0 +1,84 @@
+import dask.array as da
+import numpy as np
+import pytest
+
+from tomopyui.backend.util.stack_stats import StackStatistics, stack_statistics
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return rng.normal(1, 0.3, (20, 32, 32)).astype(np.float32)
+
+
+def _assert_percentiles(data, percentile, q=(0.5, 99.5)):
+    # within a fine bin of the exact value; in the sparse tails that can be
+    # far from np.percentile in value, but not in rank
+    ranks = [np.mean(data <= p) * 100 for p in np.asarray(percentile)]
+    np.testing.assert_allclose(ranks, q, atol=0.01)
+
+
+@pytest.mark.parametrize("chunk_mb", [64, 0.01])
+def test_matches_numpy(data, chunk_mb):
+    (counts, edges), r, percentile, centers = stack_statistics(
+        data, bins=50, chunk_mb=chunk_mb
+    )
+    expected_counts, expected_edges = np.histogram(data, bins=50)
+    np.testing.assert_allclose(r, [data.min(), data.max()])
+    np.testing.assert_allclose(edges, expected_edges, rtol=1e-6)
+    np.testing.assert_allclose(centers, (edges[:-1] + edges[1:]) / 2)
+    assert counts.sum() == data.size
+    # values within a fine bin of a bin edge may land in the neighboring bin
+    assert np.abs(counts - expected_counts).max() <= 0.01 * data.size
+    _assert_percentiles(data, percentile)
+
+
+def test_chunked_updates_match_single_pass(data):
+    whole = StackStatistics().update(data).result(bins=30)
+    stats = StackStatistics()
+    for i in range(0, len(data), 3):
+        stats.update(data[i : i + 3])
+    chunked = stats.result(bins=30)
+    np.testing.assert_allclose(chunked[1], whole[1])
+    assert chunked[0][0].sum() == whole[0][0].sum()
+    assert np.abs(chunked[0][0] - whole[0][0]).max() <= 0.01 * data.size
+    _assert_percentiles(data, chunked[2])
+
+
+def test_merge(data):
+    a = StackStatistics().update(data[:10])
+    b = StackStatistics().update(data[10:])
+    merged = a.merge(b).result(bins=30)
+    np.testing.assert_allclose(merged[1], [data.min(), data.max()])
+    assert merged[0][0].sum() == data.size
+
+
+def test_ignores_non_finite_values(data):
+    data = data.copy()
+    data[0, 0, :3] = [np.nan, np.inf, -np.inf]
+    (counts, _), r, percentile, _ = stack_statistics(data)
+    finite = data[np.isfinite(data)]
+    assert counts.sum() == finite.size
+    np.testing.assert_allclose(r, [finite.min(), finite.max()])
+    assert np.isfinite(percentile).all()
+
+
+def test_constant_and_empty_stacks():
+    (counts, edges), r, percentile, _ = stack_statistics(np.full((2, 4, 4), 3.0))
+    assert counts.sum() == 32
+    np.testing.assert_allclose(r, [3, 3])
+    np.testing.assert_allclose(percentile, [3, 3])
+    assert edges[0] < 3 < edges[-1]
+    (counts, _), r, percentile, _ = StackStatistics().result()
+    assert counts.sum() == 0
+    assert np.isnan(r).all() and np.isnan(percentile).all()
+
+
+def test_dask_results_are_lazy(data):
+    darr = da.from_array(data, chunks=(5, -1, -1))
+    hist, r, percentile, centers = stack_statistics(darr, bins=50)
+    assert isinstance(r, da.Array)
+    expected = stack_statistics(data, bins=50)
+    np.testing.assert_allclose(r.compute(), expected[1])
+    _assert_percentiles(data, percentile.compute())
+    assert hist[0].compute().sum() == data.size
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+zarr = pytest.importorskip("zarr")
+
+from tomopyui.backend.util.padding import pad_projections, read_padded
+from tomopyui.backend.util.zarr_store import (
+    ZarrFile,
+    open_store,
+    store_exists,
+    store_path,
+    write_multiscales,
+    zarr_compressors,
+)
+
+
+@pytest.fixture
+def stack():
+    return np.arange(4 * 6 * 8, dtype=np.float32).reshape(4, 6, 8)
+
+
+@pytest.fixture
+def store(tmp_path, stack):
+    filepath = store_path(tmp_path / "normalized_projections.hdf5", "zarr")
+    with open_store(filepath, "w") as f:
+        assert isinstance(f, ZarrFile)
+        f.create_dataset(
+            "/process/normalized/data",
+            data=stack,
+            chunks=(1, 6, 8),
+            compressors=zarr_compressors("blosc"),
+        )
+        f.create_dataset("/process/normalized/image_range", data=[0.0, 1.0])
+    return filepath
+
+
+def test_round_trip(tmp_path, store, stack):
+    # found from the hdf5 file name
+    hdf_name = tmp_path / "normalized_projections.hdf5"
+    assert store_exists(hdf_name)
+    with open_store(hdf_name, "r") as f:
+        assert isinstance(f, ZarrFile)
+        assert "process/normalized/data" in f
+        assert "/process/missing" not in f
+        data = f["/process/normalized/data"]
+        assert data.chunks == (1, 6, 8)
+        np.testing.assert_array_equal(data[:], stack)
+        np.testing.assert_array_equal(f["process"]["normalized/image_range"], [0, 1])
+    assert not f
+
+
+def test_create_and_delete(store):
+    with open_store(store, "a") as f:
+        f.create_dataset("/process/downsampled/0/data", shape=(4, 3, 4), dtype="f4")
+        f["/process/downsampled/0/data"][0] = 1
+        level = f.require_dataset("process/downsampled/0/data", (4, 3, 4), "f4")
+        assert level[0, 0, 0] == 1
+        with pytest.raises(TypeError):
+            f.require_dataset("process/downsampled/0/data", (4, 3, 3), "f4")
+        del f["/process/downsampled"]
+        assert "process/downsampled" not in f
+
+
+@pytest.mark.parametrize(
+    "px_range, pad",
+    [(None, (0, 0)), (([1, 7], [2, 5]), (3, 2)), (([6, 20], [0, 6]), (1, 0))],
+)
+def test_read_padded(store, stack, px_range, pad):
+    with open_store(store, "r") as f:
+        prj = read_padded(f["/process/normalized/data"], px_range, pad)
+    if px_range is None:
+        px_range = ([0, 8], [0, 6])
+    (x0, x1), (y0, y1) = px_range
+    expected = pad_projections(stack[:, y0:y1, x0:x1], pad)
+    assert prj.dtype == np.float32
+    np.testing.assert_array_equal(prj, expected)
+
+
+def test_write_multiscales(store):
+    with open_store(store, "a") as f:
+        f.create_dataset("/process/downsampled/0/data", shape=(4, 3, 4), dtype="f4")
+        write_multiscales(
+            f["/process"],
+            [("normalized/data", (1, 1, 1)), ("downsampled/0/data", (1, 2, 2))],
+            name="projections",
+        )
+    group = zarr.open_group(str(store), mode="r")
+    ome = group["process"].attrs["ome"]
+    assert ome["version"] == "0.5"
+    multiscale = ome["multiscales"][0]
+    assert multiscale["name"] == "projections"
+    assert [axis["name"] for axis in multiscale["axes"]] == ["angle", "y", "x"]
+    for dataset, scale in zip(multiscale["datasets"], ([1, 1, 1], [1, 2, 2])):
+        assert dataset["coordinateTransformations"][0]["scale"] == scale
+        assert group["process"][dataset["path"]].ndim == 3
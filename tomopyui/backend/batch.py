@@ -0,0 +1,647 @@
+"""
+Widget-free pipeline for running import, normalization, pyramid creation,
+alignment and reconstruction on many datasets without a Jupyter frontend.
+
+The backend classes report to (and read their options from) the widgets that
+drive them. Here those widgets are replaced by small headless stand-ins, so
+`RawProjections*`, `Projections_Prenormalized`, `RunAlign` and `RunRecon` run
+exactly as they do from the dashboard, and write the same files and metadata.
+
+A config file is a JSON file like::
+
+    {
+        "datasets": [
+            {"type": "als832", "filepath": "/data/scan_0001.h5"},
+            {"type": "ssrl62c", "filedir": "/data/xanes", "energies": ["08340.00"]},
+            {"type": "normalized", "filedir": "/data/scan_0002/08340.00eV"},
+            {"type": "normalized", "filedir": "/data/scan_0003", "align": null,
+             "recon": {"opts": {"center": 612.5}}}
+        ],
+        "align": {"methods": {"SIRT_CUDA": true}, "opts": {"num_iter": 20}},
+        "recon": "/data/scan_0002/20220101-1200-recon/overall_recon_metadata.json",
+        "save_tiff_on_import": false,
+        "storage_backend": "hdf5"
+    }
+
+"align" and "recon" are either dictionaries laid out like the "opts", "methods",
+"save_opts", ... of alignment/reconstruction metadata, or paths to an existing
+`*_metadata.json` to reuse its settings. Missing settings use the defaults
+below. A dataset can override them ("align": null skips alignment).
+"storage_backend" ("hdf5" or "zarr") is the kind of store newly normalized data
+and its pyramid are written to.
+
+From the command line::
+
+    tomopyui-batch config.json
+    tomopyui-batch overall_alignment_metadata.json --data /data/scan_0003
+"""
+
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import sys
+import traceback
+
+from types import SimpleNamespace
+from tomopyui.backend.io import (
+    IOBase,
+    Metadata,
+    Metadata_Align,
+    Metadata_Recon,
+    Metadata_ALS_832_Raw,
+    Metadata_APS_Raw,
+    Projections_Prenormalized,
+    RawProjectionsHDF5_ALS832,
+    RawProjectionsHDF5_APS,
+    RawProjectionsTiff_SSRL62B,
+    RawProjectionsXRM_SSRL62C,
+)
+from tomopyui.backend.runanalysis import RunAlign, RunRecon
+from tomopyui.backend.util.zarr_store import storage_backends
+
+logger = logging.getLogger(__name__)
+
+align_defaults = {
+    "opts": {
+        "downsample": False,
+        "ds_factor": 1,
+        "pyramid_level": -1,
+        "num_iter": 10,
+        "center": None,  # defaults to the middle of the projections
+        "pad": (50, 20),
+        "extra_options": {},
+        "shift_full_dataset_after": True,
+        "upsample_factor": 50,
+        "pre_alignment_iters": 1,
+        "num_batches": 20,
+        # coarse-to-fine from pyramid_level, needs downsample
+        "multiresolution": False,
+        "refine_iters": 2,
+        "multires_finest_level": -1,
+        # early stopping, see tomopyui.backend.util.convergence.ConvergencePolicy
+        "convergence": {},
+    },
+    "methods": {},  # defaults to SIRT_CUDA with cuda, sirt without
+    "save_opts": {
+        "Projections Before Alignment": False,
+        "Projections After Alignment": True,
+        "Reconstruction": False,
+        "tiff": False,
+        "hdf": True,
+    },
+    "use_multiple_centers": False,
+    "center_slice_list": [],  # [[center, slice], ...] for multiple centers
+    "px_range_x": None,  # defaults to the full range
+    "px_range_y": None,
+    "use_subset_correlation": False,
+    "subset_x": None,
+    "subset_y": None,
+    "copy_hists_from_parent": False,
+}
+
+recon_defaults = {
+    "opts": {
+        "downsample": False,
+        "ds_factor": 1,
+        "pyramid_level": -1,
+        "num_iter": 20,
+        "center": None,
+        "pad": (50, 20),
+        "extra_options": {},
+        "streaming": False,
+        "streaming_format": "hdf5",
+    },
+    "methods": {},  # defaults to FBP_CUDA with cuda, gridrec without
+    "save_opts": {"Projections Before Alignment": False, "Reconstruction": True},
+    "use_multiple_centers": False,
+    "center_slice_list": [],
+    "px_range_x": None,
+    "px_range_y": None,
+    "copy_hists_from_parent": False,
+}
+
+
+class HeadlessWidget:
+    """
+    Stands in for the labels, checkboxes, progress bars and outputs that the
+    backend reads options from and reports progress to.
+    """
+
+    def __init__(self, value=None, **kwargs):
+        self.value = value
+        self.max = 1
+        self.min = 0
+        self.options = ()
+        self.description = ""
+        self.disabled = False
+        self.rows = 1
+        self.__dict__.update(kwargs)
+
+    def clear_output(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class HeadlessStatusLabel(HeadlessWidget):
+    """
+    Status label that sends its messages to the log.
+    """
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        if value:
+            logger.info(value)
+
+
+class HeadlessUploader:
+    """
+    Stands in for the uploader widgets in `tomopyui.widgets.imports`.
+
+    Parameters
+    ----------
+    filedir : pathlib.Path or str
+        Directory to import from.
+    filename : str, optional
+        File to import in filedir.
+    save_tiff_on_import : bool, optional
+        Also save normalized projections as .tif.
+    **kwargs
+        Any other attribute the importer reads from its uploader.
+    """
+
+    def __init__(self, filedir, filename=None, save_tiff_on_import=False, **kwargs):
+        self.filedir = pathlib.Path(filedir)
+        self.filename = filename
+        self.imported_metadata = False
+        self.images_in_dir = None
+        self.import_status_label = HeadlessStatusLabel("")
+        self.save_tiff_on_import_checkbox = HeadlessWidget(save_tiff_on_import)
+        self.upload_progress = HeadlessWidget(0)
+        self.progress_output = HeadlessWidget()
+        self.energy_select_multiple = HeadlessWidget(())
+        self.energy_overwrite_textbox = HeadlessWidget(None)
+        self.interpolate_flats_checkbox = HeadlessWidget(False)
+        self.user_overwrite_energy = False
+        self.__dict__.update(kwargs)
+
+
+class HeadlessAnalysis:
+    """
+    Stands in for the Align or Recon widget passed to `RunAlign` or `RunRecon`.
+
+    Parameters
+    ----------
+    projections : `Projections_Prenormalized`
+        Normalized projections to align or reconstruct.
+    settings : dict
+        Alignment or reconstruction metadata, see `analysis_settings`.
+    metadata_class : `Metadata_Align` or `Metadata_Recon`
+    """
+
+    def __init__(self, projections, settings, metadata_class):
+        settings = copy.deepcopy(settings)
+        center_slice_list = settings.pop("center_slice_list", [])
+        self.projections = projections
+        pxX, pxY = _image_size(projections)
+        if settings["px_range_x"] is None:
+            settings["px_range_x"] = [0, pxX]
+        if settings["px_range_y"] is None:
+            settings["px_range_y"] = [0, pxY]
+        if settings["opts"]["center"] is None:
+            settings["opts"]["center"] = pxX / 2
+        self.metadata = metadata_class()
+        self.metadata.metadata = settings
+        self.metadata.set_attributes_from_metadata(self)
+        self.padding_x, self.padding_y = self.pad
+        self.Center = SimpleNamespace(
+            center_slice_list=center_slice_list,
+            reg=None,
+            reg_centers=None,
+            current_center=self.center,
+        )
+        self.altered_viewer = SimpleNamespace(
+            px_range_x=self.px_range_x,
+            px_range_y=self.px_range_y,
+            subset_x=settings.get("subset_x"),
+            subset_y=settings.get("subset_y"),
+        )
+        if "copy_hists_from_parent" not in settings:
+            self.copy_hists = False
+        self.progress_total = HeadlessWidget(0)
+        self.progress_reprj = HeadlessWidget(0)
+        self.progress_phase_cross_corr = HeadlessWidget(0)
+        self.progress_shifting = HeadlessWidget(0)
+        # no plots without a frontend
+        self.plot_output1 = None
+        self.plot_output2 = None
+        self.run_list = []
+        self.save_after_alignment = False
+
+
+def _image_size(projections):
+    """
+    (pxX, pxY) of the projections, from their attributes or their hdf5 file.
+    """
+    if getattr(projections, "pxX", None) and getattr(projections, "pxY", None):
+        return int(projections.pxX), int(projections.pxY)
+    projections._open_hdf_file_read_only()
+    shape = projections.hdf_file[projections.hdf_key_norm_proj].shape
+    projections._close_hdf_file()
+    return shape[2], shape[1]
+
+
+def _default_methods(kind):
+    if os.environ.get("cuda_enabled") == "True":
+        return {"SIRT_CUDA": True} if kind == "align" else {"FBP_CUDA": True}
+    return {"sirt": True} if kind == "align" else {"gridrec": True}
+
+
+def analysis_settings(kind, settings=None, overrides=None):
+    """
+    Alignment or reconstruction settings with defaults filled in.
+
+    Parameters
+    ----------
+    kind : str
+        "align" or "recon".
+    settings : dict or str or pathlib.Path, optional
+        Settings laid out like alignment/reconstruction metadata, or the path to
+        an existing `*_metadata.json`.
+    overrides : dict, optional
+        Settings that take precedence over settings (e.g. a per-dataset center).
+
+    Returns
+    -------
+    settings : dict
+    """
+    defaults = align_defaults if kind == "align" else recon_defaults
+    result = copy.deepcopy(defaults)
+    for _settings in (settings, overrides):
+        if _settings is None:
+            continue
+        if isinstance(_settings, (str, pathlib.Path)):
+            with open(_settings) as f:
+                _settings = json.load(f)
+        for key, value in _settings.items():
+            if key in ("opts", "save_opts"):
+                result[key].update(value)
+            elif key in defaults:
+                result[key] = copy.deepcopy(value)
+    if not any(result["methods"].values()):
+        result["methods"] = _default_methods(kind)
+    result["metadata_type"] = "Align" if kind == "align" else "Recon"
+    return result
+
+
+def load_normalized(filedir, save_tiff_on_import=False):
+    """
+    Loads projections normalized by tomopyui (an import directory or an
+    alignment directory) the same way the "Prenormalized" import tab does,
+    creating the downsampled pyramid if it is missing.
+
+    Parameters
+    ----------
+    filedir : pathlib.Path or str
+        Directory containing normalized_projections.hdf5 and its metadata.
+
+    Returns
+    -------
+    projections : `Projections_Prenormalized`
+    """
+    filedir = pathlib.Path(filedir)
+    metadata_filepaths = sorted(
+        f for f in filedir.glob("*_metadata.json") if "overall_" not in f.name
+    )
+    if len(metadata_filepaths) == 0:
+        raise FileNotFoundError(f"No tomopyui metadata found in {filedir}.")
+    metadata_filepath = metadata_filepaths[0]
+    projections = Projections_Prenormalized()
+    projections.tiff_folder = False
+    projections.metadatas = Metadata.get_metadata_hierarchy(metadata_filepath)
+    parent = {}
+    for i, metadata in enumerate(projections.metadatas):
+        metadata.filepath = copy.copy(metadata_filepath)
+        if i == 0:
+            metadata.load_metadata()
+        else:
+            metadata.metadata = parent
+        metadata.set_attributes_from_metadata(projections)
+        if "parent_metadata" in metadata.metadata:
+            parent = metadata.metadata["parent_metadata"].copy()
+    if len(projections.metadatas) > 1:
+        if projections.metadatas[-1].metadata["metadata_type"] == "General_Normalized":
+            projections.metadata = projections.metadatas[-1]
+        else:
+            projections.metadata = projections.metadatas[-2]
+    else:
+        projections.metadata = projections.metadatas[0]
+    uploader = HeadlessUploader(
+        filedir,
+        projections.normalized_projections_hdf_key,
+        save_tiff_on_import=save_tiff_on_import,
+    )
+    uploader.imported_metadata = True
+    projections.import_file_projections(uploader)
+    projections.filedir = filedir
+    return projections
+
+
+def _import_normalized(dataset, save_tiff_on_import):
+    return [pathlib.Path(dataset["filedir"])]
+
+
+def _import_hdf5(projections, metadata_class):
+    def _import(dataset, save_tiff_on_import):
+        filepath = pathlib.Path(dataset["filepath"])
+        uploader = HeadlessUploader(
+            filepath.parent,
+            filepath.name,
+            save_tiff_on_import=save_tiff_on_import,
+            reset_metadata_to=metadata_class,
+        )
+        _projections = projections()
+        _projections.import_file_all(uploader)
+        return [_projections.import_savedir]
+
+    return _import
+
+
+def _import_ssrl62b(dataset, save_tiff_on_import):
+    uploader = HeadlessUploader(
+        pathlib.Path(dataset["projections_metadata_filepath"]).parent,
+        save_tiff_on_import=save_tiff_on_import,
+        projections_metadata_filepath=pathlib.Path(
+            dataset["projections_metadata_filepath"]
+        ),
+        references_metadata_filepath=pathlib.Path(
+            dataset["references_metadata_filepath"]
+        ),
+        energy_textbox=HeadlessWidget(dataset["energy"]),
+        energy_units_dropdown=HeadlessWidget(dataset.get("energy_units", "eV")),
+        px_size_textbox=HeadlessWidget(dataset["pixel_size"]),
+        px_units_dropdown=HeadlessWidget(dataset.get("pixel_units", "nm")),
+    )
+    projections = RawProjectionsTiff_SSRL62B()
+    projections.import_metadata_projections(uploader)
+    projections.import_metadata_references(uploader)
+    projections.import_data(uploader)
+    return [projections.import_savedir]
+
+
+def _import_ssrl62c(dataset, save_tiff_on_import):
+    """
+    Imports each selected energy ("energies", default all) of an SSRL 6-2c scan.
+    "interpolate_flats": true interpolates between reference collections.
+    """
+    uploader = HeadlessUploader(
+        dataset["filedir"], save_tiff_on_import=save_tiff_on_import
+    )
+    uploader.interpolate_flats_checkbox.value = dataset.get("interpolate_flats", False)
+    projections = RawProjectionsXRM_SSRL62C()
+    projections.import_metadata(uploader)
+    energies = dataset.get("energies") or uploader.energy_select_multiple.options
+    if "energy_overwrite" in dataset:
+        uploader.user_overwrite_energy = True
+        uploader.energy_overwrite_textbox.value = dataset["energy_overwrite"]
+    import_savedirs = []
+    for energy in energies:
+        uploader.energy_select_multiple.value = (energy,)
+        projections.import_filedir_all(uploader)
+        import_savedirs.append(projections.import_savedir)
+    return import_savedirs
+
+
+importers = {
+    "normalized": _import_normalized,
+    "als832": _import_hdf5(RawProjectionsHDF5_ALS832, Metadata_ALS_832_Raw),
+    "aps": _import_hdf5(RawProjectionsHDF5_APS, Metadata_APS_Raw),
+    "ssrl62b": _import_ssrl62b,
+    "ssrl62c": _import_ssrl62c,
+}
+
+
+def import_dataset(dataset, save_tiff_on_import=False):
+    """
+    Imports and normalizes a dataset.
+
+    Parameters
+    ----------
+    dataset : dict
+        {"type": one of `importers`, ...}. See the module docstring.
+
+    Returns
+    -------
+    filedirs : list(pathlib.Path)
+        Directories with the normalized projections (one per energy).
+    """
+    if dataset["type"] not in importers:
+        raise ValueError(
+            f"Unknown dataset type: '{dataset['type']}'. "
+            f"Choose one of {list(importers.keys())}."
+        )
+    logger.info("Importing %s dataset.", dataset["type"])
+    return importers[dataset["type"]](dataset, save_tiff_on_import)
+
+
+def align(projections, settings, keep_aligned=False):
+    """
+    Runs `RunAlign` on projections.
+
+    Parameters
+    ----------
+    projections : `Projections_Prenormalized`
+    settings : dict
+        See `analysis_settings`.
+    keep_aligned : bool, optional
+        Always save the aligned projections as hdf5, so they can be loaded with
+        `load_normalized`.
+
+    Returns
+    -------
+    analysis : `RunAlign`
+    """
+    if keep_aligned:
+        settings = copy.deepcopy(settings)
+        settings["save_opts"]["hdf"] = True
+    parent = HeadlessAnalysis(projections, settings, Metadata_Align)
+    parent.save_after_alignment = keep_aligned
+    return RunAlign(parent)
+
+
+def reconstruct(projections, settings):
+    """
+    Runs `RunRecon` on projections.
+
+    Returns
+    -------
+    analysis : `RunRecon`
+    """
+    parent = HeadlessAnalysis(projections, settings, Metadata_Recon)
+    return RunRecon(parent)
+
+
+def run_dataset(dataset, align_settings=None, recon_settings=None, **kwargs):
+    """
+    Imports one dataset, then aligns and/or reconstructs each normalized
+    projection set it produced. Reconstruction uses the aligned projections
+    of the last alignment method if there was an alignment.
+
+    Returns
+    -------
+    results : list(dict)
+        Output directories for each normalized projection set.
+    """
+    results = []
+    for filedir in import_dataset(dataset, **kwargs):
+        result = {"normalized": str(filedir)}
+        projections = load_normalized(filedir)
+        if align_settings is not None:
+            analysis = align(
+                projections, align_settings, keep_aligned=recon_settings is not None
+            )
+            result["align"] = [
+                str(analysis.wd / list(run)[0])
+                for run in analysis.analysis_parent.run_list
+            ]
+            if recon_settings is not None:
+                projections = load_normalized(analysis.wd_subdir)
+        if recon_settings is not None:
+            analysis = reconstruct(projections, recon_settings)
+            result["recon"] = [
+                str(list(run)[0]) for run in analysis.analysis_parent.run_list
+            ]
+        results.append(result)
+    return results
+
+
+def run_batch(config, stop_on_error=False):
+    """
+    Runs every dataset in config.
+
+    Parameters
+    ----------
+    config : dict or str or pathlib.Path
+        Config dictionary or path to a config file (see the module docstring).
+    stop_on_error : bool, optional
+        Raise the first error instead of logging it and going on with the next
+        dataset.
+
+    Returns
+    -------
+    results : list(dict)
+        Output directories, or the error, for each dataset.
+    """
+    if isinstance(config, (str, pathlib.Path)):
+        with open(config) as f:
+            config = json.load(f)
+    os.environ.setdefault("num_cpu_cores", str(multiprocessing.cpu_count()))
+    storage_backend = config.get("storage_backend", "hdf5")
+    if storage_backend not in storage_backends:
+        raise ValueError(
+            f"Unknown storage backend: '{storage_backend}'. "
+            f"Choose one of {storage_backends}."
+        )
+    IOBase.storage_backend = storage_backend
+    results = []
+    for i, dataset in enumerate(config["datasets"]):
+        logger.info("Dataset %d/%d.", i + 1, len(config["datasets"]))
+        settings = {}
+        for kind in ("align", "recon"):
+            settings[kind] = dataset.get(kind, config.get(kind))
+            if settings[kind] is not None:
+                settings[kind] = analysis_settings(
+                    kind, config.get(kind), dataset.get(kind)
+                )
+        try:
+            result = run_dataset(
+                dataset,
+                settings["align"],
+                settings["recon"],
+                save_tiff_on_import=config.get("save_tiff_on_import", False),
+            )
+        except Exception as e:
+            if stop_on_error:
+                raise
+            logger.error("Dataset %d failed:\n%s", i + 1, traceback.format_exc())
+            result = [{"error": repr(e)}]
+        results.append({"dataset": dataset, "results": result})
+    return results
+
+
+def _config_from_metadata(filepath, data):
+    """
+    Config that applies the settings in an alignment or reconstruction metadata
+    file to the normalized data in data (default: the data it was run on).
+    """
+    with open(filepath) as f:
+        metadata = json.load(f)
+    kind = {"Align": "align", "Recon": "recon"}.get(metadata.get("metadata_type"))
+    if kind is None:
+        raise ValueError(f"{filepath} is not alignment or reconstruction metadata.")
+    if not data:
+        data = [metadata["parent_filedir"]]
+    return {
+        "datasets": [{"type": "normalized", "filedir": d} for d in data],
+        kind: str(filepath),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="tomopyui-batch",
+        description="Run tomopyui import, alignment and reconstruction without "
+        + "a Jupyter frontend.",
+    )
+    parser.add_argument(
+        "config",
+        help="JSON config file, or an alignment/reconstruction *_metadata.json",
+    )
+    parser.add_argument(
+        "--data",
+        nargs="+",
+        default=None,
+        help="normalized data directories to apply a *_metadata.json to",
+    )
+    parser.add_argument("--num-cpu-cores", type=int, default=None)
+    parser.add_argument("--stop-on-error", action="store_true")
+    parser.add_argument("--results", default=None, help="write results to this JSON")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.WARNING if args.quiet else logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+    )
+    if args.num_cpu_cores is not None:
+        os.environ["num_cpu_cores"] = str(args.num_cpu_cores)
+    with open(args.config) as f:
+        config = json.load(f)
+    if "datasets" not in config:
+        config = _config_from_metadata(args.config, args.data)
+    elif args.data:
+        config["datasets"] += [{"type": "normalized", "filedir": d} for d in args.data]
+    results = run_batch(config, stop_on_error=args.stop_on_error)
+    if args.results is not None:
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=4, default=str)
+    failed = [r for r in results if any("error" in _r for _r in r["results"])]
+    logger.info("%d of %d datasets done.", len(results) - len(failed), len(results))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 from tomopyui.widgets.hdf_tree import HDF5_Tree
+from tomopyui.backend.util.hdf_pool import hdf_pool
 
 import h5py
 import os
@@ -43,7 +44,7 @@ class HDF5_Handler:
     # -- Initialization --
     def __init__(self, uploader, hdf_path: pathlib.Path = None, mode="r+"):
         if hdf_path is not None:
-            self.hdf_file = h5py.File(hdf_path, mode)
+            self.hdf_file = hdf_pool.open(hdf_path, mode)
             self.hdf_path = hdf_path
         else:
             self.hdf_file = h5py.File(tf.TemporaryFile(), "w")
@@ -55,7 +56,8 @@ class HDF5_Handler:
         self.selected_dataset = None
         self.viewer = uploader.viewer
         self.ds_dropdown = self.viewer.ds_dropdown
-        self.tree = HDF5_Tree(self.hdf_file, 0, self)
+        # the tree walks the h5py.File itself (.file of a pooled file)
+        self.tree = HDF5_Tree(self.hdf_file.file, 0, self)
         self.projections = uploader.projections
         self.uploader = uploader
         self.open_hdf_files = []
@@ -78,12 +80,12 @@ class HDF5_Handler:
     # -- Opening/closing --
     def new_tree(self, hdf_path):
         self.open_hdf(hdf_path)
-        self.tree.__init__(self.hdf_file, 0, self)
+        self.tree.__init__(self.hdf_file.file, 0, self)
 
     def open_hdf(self, hdf_path: pathlib.Path, mode: str = "r+"):
         self.hdf_path = hdf_path
         try:
-            self.hdf_file = h5py.File(hdf_path, mode)
+            self.hdf_file = hdf_pool.open(hdf_path, mode)
             self.open_hdf_files.append(self.hdf_file)
         except OSError as e:
             print(e)
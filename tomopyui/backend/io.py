@@ -22,8 +22,26 @@ import scipy.ndimage as ndi
 
 from abc import ABC, abstractmethod
 from tomopy.sim.project import angles as angle_maker
-from tomopyui.backend.util.dxchange.reader import read_ole_metadata, read_xrm, read_txrm
-from tomopyui.backend.util.dask_downsample import pyramid_reduce_gaussian
+from tomopyui.backend.util.dxchange.reader import (
+    read_ole_metadata,
+    read_xrm,
+    read_txrm,
+    read_xrms_parallel,
+    read_txrm_parallel,
+)
+from tomopyui.backend.util.frames import LazyFrames
+from tomopyui.backend.util.hdf_layout import HDF5Layout, to_hdf5
+from tomopyui.backend.util.normalize import FlatFieldNormalizer
+from tomopyui.backend.util.padding import read_padded
+from tomopyui.backend.util.pyramid import PyramidBuilder
+from tomopyui.backend.util.stack_stats import stack_statistics
+from tomopyui.backend.util.zarr_store import (
+    ZarrGroup,
+    open_store,
+    store_exists,
+    store_path,
+    write_multiscales,
+)
 from skimage.transform import rescale
 from joblib import Parallel, delayed
 from ipywidgets import *
@@ -50,6 +68,8 @@ class IOBase:
     normalized_projections_hdf_key = "normalized_projections.hdf5"
     normalized_projections_tif_key = "normalized_projections.tif"
     normalized_projections_npy_key = "normalized_projections.npy"
+    recon_hdf_key = "recon.hdf5"
+    recon_tif_key = "recon.tif"
 
     # hdf keys
     hdf_key_raw_proj = "/exchange/data"
@@ -70,6 +90,7 @@ class IOBase:
     hdf_key_percentile = "percentile"
     hdf_key_ds_factor = "ds_factor"
     hdf_key_process = "/process"
+    hdf_key_recon = "/process/recon/data"
 
     hdf_keys_ds_hist = [
         hdf_key_bin_frequency,
@@ -79,6 +100,19 @@ class IOBase:
     ]
     hdf_keys_ds_hist_scalar = [hdf_key_ds_factor]
 
+    # chunking/compression of image stacks written to hdf5. Can be changed for all
+    # objects (IOBase.hdf_layout = HDF5Layout(...)) or for one object.
+    hdf_layout = HDF5Layout()
+
+    # how the downsampled pyramid is made, changed the same way as hdf_layout
+    pyramid_builder = PyramidBuilder()
+
+    # "hdf5" or "zarr" (see zarr_store.storage_backends): kind of store new
+    # normalized data is written to. Existing stores are read and appended to
+    # whatever their kind, under the same file name (normalized_projections.hdf5
+    # finds normalized_projections.zarr).
+    storage_backend = "hdf5"
+
     def __init__(self):
 
         self._data = np.random.rand(10, 100, 100)
@@ -155,19 +189,19 @@ class IOBase:
         if filepath is None:
             filepath = self.filepath
         self._close_hdf_file()
-        self.hdf_file = h5py.File(filepath, "r")
+        self.hdf_file = open_store(filepath, "r")
 
     def _open_hdf_file_read_write(self, filepath=None):
         if filepath is None:
             filepath = self.filepath
         self._close_hdf_file()
-        self.hdf_file = h5py.File(filepath, "r+")
+        self.hdf_file = open_store(filepath, "r+")
 
     def _open_hdf_file_append(self, filepath=None):
         if filepath is None:
             filepath = self.filepath
         self._close_hdf_file()
-        self.hdf_file = h5py.File(filepath, "a")
+        self.hdf_file = open_store(filepath, "a")
 
     @_check_and_open_hdf
     def _load_hdf_normalized_data_into_memory(self):
@@ -213,30 +247,57 @@ class IOBase:
         self.data = self._data
 
     @_check_and_open_hdf
-    def _return_ds_data(self, pyramid_level=0, px_range=None):
+    def _load_hdf_hist(self, pyramid_level=-1):
+        """
+        Loads only the histogram of the normalized data (pyramid_level -1) or of
+        a downsampled level into self.hist.
+        """
+        ds_level = self.hdf_key_ds + str(max(pyramid_level, 0)) + "/"
+        norm_hist_key = self.hdf_key_norm + self.hdf_key_bin_frequency
+        if pyramid_level == -1 and norm_hist_key in self.hdf_file:
+            self.hist = {
+                key: self.hdf_file[self.hdf_key_norm + key][:]
+                for key in self.hdf_keys_ds_hist
+            }
+            return
+        self.hist = {
+            key: self.hdf_file[ds_level + key][:] for key in self.hdf_keys_ds_hist
+        }
+        for key in self.hdf_keys_ds_hist_scalar:
+            self.hist[key] = self.hdf_file[ds_level + key][()]
+
+    def _lazy_frames(self, pyramid_level=-1):
+        """
+        Frames of the normalized data (pyramid_level -1) or of a downsampled
+        level, read from the hdf5 file on demand (see `LazyFrames`).
+        """
+        if pyramid_level == -1:
+            key = self.hdf_key_norm_proj
+        else:
+            key = self.hdf_key_ds + str(pyramid_level) + "/" + self.hdf_key_data
+        return LazyFrames(self.filedir / self.filename, key)
 
+    @_check_and_open_hdf
+    def _return_ds_data(self, pyramid_level=0, px_range=None, pad=(0, 0), dtype=None):
+        """
+        Reads a crop of a downsampled level into self.data_returned, padded
+        with pad zeros on each side (see `read_padded`).
+        """
         pyramid_level = self.hdf_key_ds + str(pyramid_level) + "/"
         ds_data_key = pyramid_level + self.hdf_key_data
-        if px_range is None:
-            self.data_returned = self.hdf_file[ds_data_key][:]
-        else:
-            x = px_range[0]
-            y = px_range[1]
-            self.data_returned = self.hdf_file[ds_data_key]
-            self.data_returned = copy.deepcopy(
-                self.data_returned[:, y[0] : y[1], x[0] : x[1]]
-            )
+        self.data_returned = read_padded(
+            self.hdf_file[ds_data_key], px_range, pad, dtype
+        )
 
     @_check_and_open_hdf
-    def _return_data(self, px_range=None):
-        if px_range is None:
-            self.data_returned = self.hdf_file[self.hdf_key_norm_proj][:]
-        else:
-            x = px_range[0]
-            y = px_range[1]
-            self.data_returned = self.hdf_file[self.hdf_key_norm_proj][
-                :, y[0] : y[1], x[0] : x[1]
-            ]
+    def _return_data(self, px_range=None, pad=(0, 0), dtype=None):
+        """
+        Reads a crop of the normalized data into self.data_returned, padded
+        with pad zeros on each side (see `read_padded`).
+        """
+        self.data_returned = read_padded(
+            self.hdf_file[self.hdf_key_norm_proj], px_range, pad, dtype
+        )
 
     @_check_and_open_hdf
     def _return_hist(self, pyramid_level=0):
@@ -253,24 +314,77 @@ class IOBase:
         if self.hdf_key_ds in self.hdf_file:
             del self.hdf_file[self.hdf_key_ds]
 
+    def _write_downsampled_data(self, progress=None):
+        """
+        Writes the downsampled pyramid of the normalized data, with the
+        histogram of each level, in a single read of the normalized data (see
+        `PyramidBuilder`).
+
+        Parameters
+        ----------
+        progress : ipywidgets.IntProgress, optional
+            Incremented after each chunk of projections.
+        """
+        self._open_hdf_file_append()
+        self._delete_downsampled_data()
+        data = self.hdf_file[self.hdf_key_norm_proj]
+        outs = []
+        for i, shape in enumerate(self.pyramid_builder.level_shapes(data.shape)):
+            outs.append(
+                self.hdf_file.create_dataset(
+                    self.hdf_key_ds + str(i) + "/" + self.hdf_key_data,
+                    shape=shape,
+                    dtype=np.float32,
+                    **self.hdf_layout.store_kwargs(self.hdf_file, shape, np.float32),
+                )
+            )
+        _, stats = self.pyramid_builder.build(data, outs, progress=progress)
+        for i, (hist, r, percentile, bin_centers) in enumerate(stats):
+            grp = self.hdf_key_ds + str(i) + "/"
+            savedict = {
+                grp + self.hdf_key_bin_frequency: hist[0],
+                grp + self.hdf_key_bin_edges: hist[1],
+                grp + self.hdf_key_bin_centers: bin_centers,
+                grp + self.hdf_key_image_range: r,
+                grp + self.hdf_key_percentile: percentile,
+                grp + self.hdf_key_ds_factor: np.power(2, i + 1),
+            }
+            for key, value in savedict.items():
+                self.hdf_file.create_dataset(key, data=value)
+        if isinstance(self.hdf_file, ZarrGroup):
+            self._write_multiscales_metadata(len(stats))
+        self._close_hdf_file()
+
+    def _write_multiscales_metadata(self, num_levels):
+        """
+        Describes the normalized data and its pyramid as one OME-Zarr
+        multi-resolution image, in the attributes of the /process group.
+        """
+        process = self.hdf_key_process + "/"
+
+        def relative(key):
+            return key[len(process) :].strip("/")
+
+        datasets = [(relative(self.hdf_key_norm_proj), (1, 1, 1))]
+        for i in range(num_levels):
+            factor = 2 ** (i + 1)
+            key = self.hdf_key_ds + str(i) + "/" + self.hdf_key_data
+            datasets.append((relative(key), (1, factor, factor)))
+        write_multiscales(self.hdf_file[process], datasets, name="projections")
+
     def _close_hdf_file(self):
         if self.hdf_file:
             self.hdf_file.close()
 
     def _np_hist(self):
-        r = [np.min(self.data), np.max(self.data)]
         bins = 200 if self.data.size > 200 else self.data.size
-        hist = np.histogram(self.data, range=r, bins=bins)
-        percentile = np.percentile(self.data.flatten(), q=(0.5, 99.5))
-        bin_edges = hist[1]
+        hist, r, percentile, _ = stack_statistics(self.data, bins=bins)
         return hist, r, bins, percentile
 
     def _dask_hist(self):
-        r = [da.min(self.data), da.max(self.data)]
+        # lazy, computed in the same pass as self.data when stored together
         bins = 200 if self.data.size > 200 else self.data.size
-        hist = da.histogram(self.data, range=r, bins=bins)
-        percentile = da.percentile(self.data.flatten(), q=(0.5, 99.5))
-        bin_edges = hist[1]
+        hist, r, percentile, _ = stack_statistics(da.asarray(self.data), bins=bins)
         return hist, r, bins, percentile
 
     def _dask_bin_centers(self, grp, write=False, savedir=None):
@@ -334,19 +448,20 @@ class IOBase:
             This is a label that will update in the frontend.
         """
         filedir = self.filedir
-        files = [pathlib.Path(f).name for f in os.scandir(filedir) if not f.is_dir()]
-        if self.normalized_projections_hdf_key in files:
+        if store_exists(filedir / self.normalized_projections_hdf_key):
             self._filepath = filedir / self.normalized_projections_hdf_key
             self.filepath = self._filepath
-            self._open_hdf_file_read_write()
-            if self.hdf_key_ds in self.hdf_file:
-                self._load_hdf_ds_data_into_memory()
-            else:
-                pyramid_reduce_gaussian(
-                    self.data,
-                    io_obj=self,
-                )
-                self._load_hdf_ds_data_into_memory()
+            self._open_hdf_file_read_only()
+            if self.hdf_key_ds not in self.hdf_file:
+                if label is not None:
+                    label.value = "Downsampling data in a pyramid"
+                self._write_downsampled_data()
+                self._open_hdf_file_read_only()
+            # The viewers read frames from the file as they are shown. The
+            # datasets are taken from a read-only handle, so holding them does
+            # not keep the file open for writing (see HDF5FilePool).
+            self._unload_hdf_normalized_and_ds()
+            self._load_hdf_hist(pyramid_level=0)
 
     def _file_finder(self, filedir, filetypes: list):
         """
@@ -447,11 +562,22 @@ class ProjectionsBase(IOBase, ABC):
         for key in data_dict:
             if not isinstance(data_dict[key], da.Array):
                 data_dict[key] = da.from_array(data_dict[key])
-        da.to_hdf5(
-            filedir / self.normalized_projections_hdf_key,
+        to_hdf5(
+            self._store_filepath(filedir),
             data_dict,
+            layout=self.hdf_layout,
         )
 
+    def _store_filepath(self, filedir):
+        """
+        Store for the normalized data in filedir: the existing one, if there is
+        one, or else a new one of kind storage_backend.
+        """
+        filepath = filedir / self.normalized_projections_hdf_key
+        if store_exists(filepath):
+            return filepath
+        return store_path(filepath, self.storage_backend)
+
     def make_import_savedir(self, folder_name):
         """
         Creates a save directory to put projections into.
@@ -502,24 +628,28 @@ class Projections_Child(ProjectionsBase):
         self._data = copy.deepcopy(self.parent_projections.data[:])
         self.data = self._data
 
-    def get_parent_data_from_hdf(self, px_range=None):
+    def get_parent_data_from_hdf(self, px_range=None, pad=(0, 0), dtype=None):
         """
         Gets data from hdf file and stores it in self.data.
         Parameters
         ----------
         px_range: tuple
             tuple of two two-element lists - (px_range_x, px_range_y)
+        pad: tuple
+            (pad_x, pad_y) zeros added on each side while reading
+        dtype: numpy dtype
+            dtype the data is read as. Defaults to the dtype in the file.
         """
         self.data_ds = None
-        self.parent_projections._unload_hdf_normalized_and_ds()
-        self.parent_projections._return_data(px_range)
+        self.parent_projections._return_data(px_range, pad, dtype)
         self._data = self.parent_projections.data_returned
         self.data = self._data
         self.parent_projections._close_hdf_file()
 
-    def get_parent_data_ds_from_hdf(self, pyramid_level, px_range=None):
-        self.parent_projections._unload_hdf_normalized_and_ds()
-        self.parent_projections._return_ds_data(pyramid_level, px_range)
+    def get_parent_data_ds_from_hdf(
+        self, pyramid_level, px_range=None, pad=(0, 0), dtype=None
+    ):
+        self.parent_projections._return_ds_data(pyramid_level, px_range, pad, dtype)
         self.data_ds = self.parent_projections.data_returned
         self.parent_projections._close_hdf_file()
 
@@ -593,7 +723,7 @@ class Projections_Prenormalized(ProjectionsBase):
         self._check_downsampled_data()
         os.chdir(cwd)
         self.filepath = self.import_savedir / self.normalized_projections_hdf_key
-        self.hdf_file = h5py.File(self.filepath)
+        self._open_hdf_file_read_only()
         self._close_hdf_file()
 
     def import_file_projections(self, Uploader):
@@ -632,7 +762,7 @@ class Projections_Prenormalized(ProjectionsBase):
             files = [
                 pathlib.Path(f).name for f in os.scandir(self.filedir) if not f.is_dir()
             ]
-            if self.normalized_projections_hdf_key in files:
+            if store_exists(self.filedir / self.normalized_projections_hdf_key):
                 Uploader.import_status_label.value = (
                     "Detected metadata and hdf5 file in this directory,"
                     + " uploading normalized_projections.hdf5"
@@ -725,6 +855,8 @@ class RawProjectionsBase(ProjectionsBase, ABC):
         self.flats_ind = None
         self.darks = None
         self.normalized = False
+        # "nearest" or "interpolate", see tomopyui.backend.util.normalize
+        self.flat_mode = "nearest"
 
     def normalize_nf(self):
         """
@@ -754,7 +886,43 @@ class RawProjectionsBase(ProjectionsBase, ABC):
         self.raw = False
         self.normalized = True
 
-    # For dask-based normalization (should be faster)
+    def normalize_streaming(
+        self,
+        num_exposures_per_proj=1,
+        num_exposures_per_flat=1,
+        progress=None,
+    ):
+        """
+        Normalizes the raw frames in self._data by self.flats and self.darks,
+        averaging the exposures of each projection, in one pass over the raw
+        data (see `FlatFieldNormalizer`). Flats are picked, or interpolated if
+        self.flat_mode is "interpolate", using self.flats_ind.
+
+        Parameters
+        ----------
+        num_exposures_per_proj : int, optional
+            Number of consecutive raw frames per projection.
+        num_exposures_per_flat : int, optional
+            Number of consecutive raw flat frames per flat collection.
+        progress : ipywidgets.IntProgress, optional
+            Progress bar, advanced per chunk.
+        """
+        normalizer = FlatFieldNormalizer(
+            self.flats,
+            self.darks,
+            flat_loc=self.flats_ind,
+            num_exposures_per_proj=num_exposures_per_proj,
+            num_exposures_per_flat=num_exposures_per_flat,
+            flat_mode=self.flat_mode,
+        )
+        self._data = normalizer.normalize(self._data, progress=progress)
+        self.data = self._data
+        self.raw = False
+        self.normalized = True
+
+    # Dask-based normalization, replaced by FlatFieldNormalizer. Kept as the
+    # reference implementation that tests/test_normalize.py and
+    # benchmarks/bench_import.py compare FlatFieldNormalizer against.
     def average_chunks(chunked_da):
         """
         Method required for averaging within the normalize_and_average method. Takes
@@ -802,6 +970,10 @@ class RawProjectionsBase(ProjectionsBase, ABC):
         compute=True,
     ):
         """
+        Legacy reference implementation of the "nearest" flat mode of
+        `FlatFieldNormalizer`, which normalize_streaming uses instead. Only the
+        tests and benchmarks call it.
+
         Function takes pre-chunked dask arrays of projections, flats, darks, along
         with flat locations within the projection images.
 
@@ -910,31 +1082,6 @@ class RawProjectionsBase(ProjectionsBase, ABC):
 
         return arr
 
-    @staticmethod
-    def normalize_no_locations_no_average(
-        projs,
-        flats,
-        dark,
-        status_label=None,
-        compute=True,
-    ):
-        """
-        Normalize using dask arrays. Only averages references and normalizes.
-        """
-        if status_label is not None:
-            status_label.value = "Averaging flatfields."
-        flat_mean = np.mean(flats, axis=0)
-        dark = np.median(dark, axis=0)
-        denominator = flat_mean - dark
-        if status_label is not None:
-            status_label.value = f"Dividing by flatfields and taking -log."
-        projs = projs.rechunk({0: "auto", 1: -1, 2: -1})
-        projs = projs / denominator
-        projs = -da.log(projs)
-        if compute:
-            projs = projs.compute()
-        return projs
-
     @abstractmethod
     def import_metadata(self, filedir):
         """
@@ -1340,20 +1487,20 @@ class RawProjectionsXRM_SSRL62C(RawProjectionsBase):
         metadatas: list(dict)
             List of metadata dicts for files in xrm_list
         """
-        data_stack = None
-        metadatas = []
-        for i, filename in enumerate(xrm_list):
-            data, metadata = read_xrm(str(filename))
-            if data_stack is None:
-                data_stack = np.zeros((len(xrm_list),) + data.shape, data.dtype)
-            data_stack[i] = data
-            metadatas.append(metadata)
-            Uploader.upload_progress.value += 1
+
+        def update_progress(num_read):
+            Uploader.upload_progress.value += num_read
+
+        # full metadata is parsed for the first file only, the rest only get their
+        # own angles and positions
+        data_stack, metadatas = read_xrms_parallel(
+            [str(filename) for filename in xrm_list], progress=update_progress
+        )
         data_stack = np.flip(data_stack, axis=1)
         return data_stack, metadatas
 
     def load_txrm(self, txrm_filepath):
-        data, metadata = read_txrm(str(txrm_filepath))
+        data, metadata = read_txrm_parallel(str(txrm_filepath))
         # rescale -- camera saturates at 4k -- can double check this number later.
         # should not impact reconstruction
         data = rescale_intensity(data, in_range=(0, 4096), out_range="dtype")
@@ -1536,24 +1683,25 @@ class RawProjectionsXRM_SSRL62C(RawProjectionsBase):
                 )
                 self.darks = np.zeros_like(self.flats[0])[np.newaxis, ...]
                 self.make_import_savedir(str(energy + "eV"))
-                projs, flats, darks = self.setup_normalize()
+                self.filepath = (
+                    self.import_savedir / self.normalized_projections_hdf_key
+                )
                 self.status_label.value = "Calculating flat positions."
                 self.flats_ind_from_collect(collect)
+                if Uploader.interpolate_flats_checkbox.value:
+                    self.flat_mode = "interpolate"
+                else:
+                    self.flat_mode = "nearest"
                 self.status_label.value = "Normalizing."
-                self._data = RawProjectionsBase.normalize_and_average(
-                    projs,
-                    flats,
-                    darks,
-                    self.flats_ind,
+                self.normalize_streaming(
                     self.scan_info["NEXPOSURES"],
-                    status_label=self.status_label,
-                    compute=False,
+                    self.scan_info["REFNEXPOSURES"],
+                    progress=Uploader.upload_progress,
                 )
-                self.data = self._data
                 self.status_label.value = (
                     "Calculating histogram of raw data and saving."
                 )
-                self._dask_hist_and_save_data()
+                self._np_hist_and_save_data()
                 self.saved_as_tiff = False
                 self.filedir = self.import_savedir
                 if Uploader.save_tiff_on_import_checkbox.value:
@@ -1571,47 +1719,6 @@ class RawProjectionsXRM_SSRL62C(RawProjectionsBase):
                 self.filedir = _tmp_filedir
                 self._close_hdf_file()
 
-    def setup_normalize(self):
-        """
-        Function to lazy load flats and projections as npy, convert to chunked dask
-        arrays for normalization.
-
-        Returns
-        -------
-        projs: dask array
-            Projections chunked by scan_info["NEXPOSURES"]
-        flats: dask array
-            References chunked by scan_info["REFNEXPOSURES"]
-        darks: dask array
-            Zeros array with the same image dimensions as flats
-        """
-        data_dict = {
-            self.hdf_key_raw_flats: self.flats,
-            self.hdf_key_raw_proj: self._data,
-        }
-        self.dask_data_to_h5(data_dict, savedir=self.import_savedir)
-        self.filepath = self.import_savedir / self.normalized_projections_hdf_key
-        self._open_hdf_file_read_write()
-        z_chunks_proj = self.scan_info["NEXPOSURES"]
-        z_chunks_flats = self.scan_info["REFNEXPOSURES"]
-        self.flats = None
-        self._data = None
-
-        self.flats = da.from_array(
-            self.hdf_file[self.hdf_key_raw_flats],
-            chunks=(z_chunks_flats, -1, -1),
-        ).astype(np.float32)
-
-        self._data = da.from_array(
-            self.hdf_file[self.hdf_key_raw_proj],
-            chunks=(z_chunks_proj, -1, -1),
-        ).astype(np.float32)
-        darks = da.from_array(self.darks, chunks=(-1, -1, -1)).astype(np.float32)
-        projs = self._data
-        flats = self.flats
-
-        return projs, flats, darks
-
     def flats_ind_from_collect(self, collect):
         """
         Calculates where the flats indexes are based on the current "collect", which
@@ -1680,12 +1787,13 @@ class RawProjectionsTiff_SSRL62B(RawProjectionsBase):
         self.import_filedir_projections(Uploader)
         self.import_filedir_flats(Uploader)
         self.filedir = self.import_savedir
-        projs, flats, darks = self.setup_normalize(Uploader)
+        self.darks = None
         Uploader.import_status_label.value = "Normalizing projections"
-        self._data = self.normalize_no_locations_no_average(
-            projs, flats, darks, compute=False
+        # one collection of references for the whole scan
+        self.normalize_streaming(
+            num_exposures_per_flat=self.flats.shape[0],
+            progress=Uploader.upload_progress,
         )
-        self.data = self._data
         hist, r, bins, percentile = self._dask_hist()
         grp = self.hdf_key_norm
         data_dict = {
@@ -1765,13 +1873,7 @@ class RawProjectionsTiff_SSRL62B(RawProjectionsBase):
             arr.append(tf.imread(file))
             Uploader.upload_progress.value += 1
         Uploader.import_status_label.value = "Converting to numpy array"
-        arr = np.array(arr)
-        arr = np.rot90(arr, axes=(1, 2))
-        Uploader.import_status_label.value = "Converting to dask array"
-        arr = da.from_array(arr, chunks={0: "auto", 1: -1, 2: -1})
-        Uploader.import_status_label.value = "Saving in normalized_projections.hdf5"
-        data_dict = {self.hdf_key_raw_proj: arr}
-        da.to_hdf5(self.import_savedir / self.normalized_projections_hdf_key, data_dict)
+        self._data = np.rot90(np.array(arr), axes=(1, 2))
 
     def import_filedir_flats(self, Uploader):
         tifffiles = self.metadata_references.metadata["filenames"]
@@ -1784,13 +1886,7 @@ class RawProjectionsTiff_SSRL62B(RawProjectionsBase):
             arr.append(tf.imread(file))
             Uploader.upload_progress.value += 1
         Uploader.import_status_label.value = "Converting to numpy array"
-        arr = np.array(arr)
-        arr = np.rot90(arr, axes=(1, 2))
-        Uploader.import_status_label.value = "Converting to dask array"
-        arr = da.from_array(arr, chunks={0: "auto", 1: -1, 2: -1})
-        Uploader.import_status_label.value = "Saving in normalized_projections.hdf5"
-        data_dict = {self.hdf_key_raw_flats: arr}
-        da.to_hdf5(self.import_savedir / self.normalized_projections_hdf_key, data_dict)
+        self.flats = np.rot90(np.array(arr), axes=(1, 2))
 
     def import_filedir_darks(self, filedir):
         pass
@@ -1807,33 +1903,6 @@ class RawProjectionsTiff_SSRL62B(RawProjectionsBase):
     def import_file_darks(self, filepath):
         pass
 
-    def setup_normalize(self, Uploader):
-        """
-        Function to lazy load flats and projections as npy, convert to chunked dask
-        arrays for normalization.
-
-        Returns
-        -------
-        projs: dask array
-            Projections chunked by scan_info["NEXPOSURES"]
-        flats: dask array
-            References chunked by scan_info["REFNEXPOSURES"]
-        darks: dask array
-            Zeros array with the same image dimensions as flats
-        """
-        self.flats = None
-        self._data = None
-        self.hdf_file = h5py.File(
-            self.import_savedir / self.normalized_projections_hdf_key, "a"
-        )
-        self.flats = self.hdf_file[self.hdf_key_raw_flats]
-        self._data = self.hdf_file[self.hdf_key_raw_proj]
-        self.darks = np.zeros_like(self.flats[0])[np.newaxis, ...]
-        projs = da.from_array(self._data).astype(np.float32)
-        flats = da.from_array(self.flats).astype(np.float32)
-        darks = da.from_array(self.darks).astype(np.float32)
-        return projs, flats, darks
-
 
 class RawProjectionsHDF5_ALS832(RawProjectionsBase):
     """
@@ -2635,6 +2704,7 @@ class Metadata_SSRL62C_Prenorm(Metadata_SSRL62C_Raw):
             if name in self.metadata
         ]
         self.metadata["flats_ind"] = projections.flats_ind
+        self.metadata["flat_mode"] = projections.flat_mode
         self.metadata["user_overwrite_energy"] = projections.user_overwrite_energy
         self.metadata["energy_str"] = projections.energy_str
         self.metadata["energy_float"] = projections.energy_float
@@ -2781,6 +2851,8 @@ class Metadata_SSRL62C_Prenorm(Metadata_SSRL62C_Raw):
             )
         if "flats_ind" in self.metadata:
             projections.flats_ind = self.metadata["flats_ind"]
+        if "flat_mode" in self.metadata:
+            projections.flat_mode = self.metadata["flat_mode"]
         projections.saved_as_tiff = self.metadata["saved_as_tiff"]
 
 
@@ -3816,6 +3888,10 @@ class Metadata_Align(Metadata):
         self.metadata["subset_x"] = Align.altered_viewer.subset_x
         self.metadata["subset_y"] = Align.altered_viewer.subset_y
         self.metadata["opts"]["num_batches"] = Align.num_batches
+        self.metadata["opts"]["multiresolution"] = Align.multiresolution
+        self.metadata["opts"]["refine_iters"] = Align.refine_iters
+        self.metadata["opts"]["multires_finest_level"] = Align.multires_finest_level
+        self.metadata["opts"]["convergence"] = Align.convergence_opts
 
     def metadata_to_DataFrame(self):
         metadata_frame = {}
@@ -3915,6 +3991,14 @@ class Metadata_Align(Metadata):
         Align.subset_y = self.metadata["subset_y"]
         Align.use_subset_correlation = self.metadata["use_subset_correlation"]
         Align.num_batches = self.metadata["opts"]["num_batches"]
+        if "multiresolution" in self.metadata["opts"]:
+            Align.multiresolution = self.metadata["opts"]["multiresolution"]
+            Align.refine_iters = self.metadata["opts"]["refine_iters"]
+            Align.multires_finest_level = self.metadata["opts"][
+                "multires_finest_level"
+            ]
+        if "convergence" in self.metadata["opts"]:
+            Align.convergence_opts = self.metadata["opts"]["convergence"]
 
 
 class Metadata_Recon(Metadata_Align):
@@ -3925,13 +4009,16 @@ class Metadata_Recon(Metadata_Align):
         self.table_label.value = "Reconstruction Metadata"
 
     def set_metadata_obj_specific(self, Recon):
-        pass
+        self.metadata["opts"]["streaming"] = Recon.streaming
+        self.metadata["opts"]["streaming_format"] = Recon.streaming_format
 
     def set_attributes_from_metadata(self, Recon):
         super().set_attributes_from_metadata(Recon)
 
     def set_attributes_object_specific(self, Recon):
-        pass
+        if "streaming" in self.metadata["opts"]:
+            Recon.streaming = self.metadata["opts"]["streaming"]
+            Recon.streaming_format = self.metadata["opts"]["streaming_format"]
 
 
 # https://stackoverflow.com/questions/
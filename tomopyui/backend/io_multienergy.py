@@ -9,18 +9,131 @@ from tomopyui.widgets.helpers import import_module_set_env
 
 cuda_import_dict = {"cupy": "cuda_enabled"}
 import_module_set_env(cuda_import_dict)
-if os.environ["cuda_enabled"] == "True":
-    from tomopyui.tomocupy.prep.alignment import shift_prj_cp, batch_cross_correlation
-    from tomopyui.tomocupy.prep.sampling import shrink_and_pad_projections
-    from tomopyui.widgets.prep import shift_projections
+
+from tomopyui.backend.util.alignment import shift_projections
+from tomopyui.backend.util.array_backend import get_backend
+from tomopyui.backend.util.scheduler import run_jobs
+from tomopyui.backend.util.zarr_store import open_store
 
 import numpy as np
 
 import pathlib
-import h5py
 import os
 
 
+def shrink_and_pad_projections(
+    images_low, ref_shape, low_energy, high_energy, num_batches=5, order=3, backend=None
+):
+    """
+    Zooms images by low_energy / high_energy (the change in pixel size with
+    energy) and pads them to the image size of ref_shape.
+
+    Parameters
+    ----------
+    images_low : ndarray
+        Projections at low_energy.
+    ref_shape : tuple
+        Shape of the projections at high_energy.
+    num_batches : int, optional
+        Number of batches sent to the GPU with the cupy backend.
+    backend : `NumpyBackend` or `CupyBackend`, optional
+        Defaults to `get_backend()`. The numpy backend zooms one image per thread.
+    """
+    if backend is None:
+        backend = get_backend()
+    shrink_ratio = low_energy / high_energy
+    # same output size as ndimage.zoom
+    zoomed_shape = tuple(int(round(n * shrink_ratio)) for n in images_low.shape[1:])
+    diffshape = [y - x for x, y in zip(zoomed_shape, ref_shape[1:])]
+    pad = ((0, 0),) + tuple(
+        (int(np.ceil(x / 2)), int(np.floor(x / 2))) for x in diffshape
+    )
+    out = np.empty((images_low.shape[0],) + tuple(ref_shape[1:]), dtype=np.float32)
+    if backend.name == "cupy":
+        bounds = np.linspace(0, images_low.shape[0], num_batches + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            batch = backend.asarray(images_low[start:stop])
+            batch = backend.ndi.zoom(
+                batch, (1, shrink_ratio, shrink_ratio), order=order
+            )
+            out[start:stop] = backend.asnumpy(backend.xp.pad(batch, pad))
+        backend.free_memory()
+        return out
+    # zooming single images gives the same result as zooming the stack with a
+    # factor of 1 along axis 0, without the spline prefilter along axis 0
+    zoomed = np.zeros((images_low.shape[0],) + zoomed_shape, dtype=np.float32)
+
+    def _zoom(i):
+        backend.ndi.zoom(
+            np.asarray(images_low[i], dtype=np.float32),
+            shrink_ratio,
+            output=zoomed[i],
+            order=order,
+        )
+
+    backend.map_indices(_zoom, images_low.shape[0])
+    out[...] = np.pad(zoomed, pad)
+    return out
+
+
+def _shrink_and_shift_energy(job):
+    """
+    Shrinks, pads and shifts the normalized projections in one energy folder
+    and in each level of its pyramid. Runs in a worker process of
+    `MultiEnergyProjections.compile_energies`.
+
+    Parameters
+    ----------
+    job : dict
+        "folder", "ref_energy", "ref_shapes" (normalized data first, then each
+        pyramid level), "sx", "sy", "backend" and "threads".
+
+    Returns
+    -------
+    result : dict
+        Energy and angles of the folder, and a list of (data, hist, sx, sy) for
+        the normalized data and each pyramid level.
+    """
+    backend = get_backend(job["backend"], workers=job["threads"])
+    moving = Projections_Prenormalized()
+    moving.filepath = job["folder"] / moving.normalized_projections_hdf_key
+    moving.metadatas = Metadata.get_metadata_hierarchy(
+        moving.filedir / "import_metadata.json"
+    )
+    moving.metadata = moving.metadatas[0]
+    moving.metadata.set_attributes_from_metadata(moving)
+    sx = np.array(job["sx"])
+    sy = np.array(job["sy"])
+    levels = []
+    for i, ref_shape in enumerate(job["ref_shapes"]):
+        if i == 0:
+            moving._load_hdf_normalized_data_into_memory()
+            data = moving.data
+        else:
+            # pyramid levels are downsampled by 2 ** (i + 1)
+            sx = sx / 2
+            sy = sy / 2
+            moving._load_hdf_ds_data_into_memory(pyramid_level=i - 1)
+            data = moving.data_ds
+        data = shrink_and_pad_projections(
+            data,
+            ref_shape,
+            moving.energy_float,
+            job["ref_energy"],
+            backend=backend,
+        )
+        data = shift_projections(data, sx, sy, backend=backend)
+        levels.append((data, dict(moving.hist), sx, sy))
+        del data
+    moving._close_hdf_file()
+    return {
+        "energy_float": moving.energy_float,
+        "energy_str": moving.energy_str,
+        "angles_deg": moving.metadata.metadata["angles_deg"],
+        "levels": levels,
+    }
+
+
 class MultiEnergyProjections(IOBase):
     def __init__(self):
         self.energies: list[float] = []
@@ -33,12 +146,20 @@ class MultiEnergyProjections(IOBase):
         folders: list,
         hdf_for_alignment: pathlib.Path,
         write_location: pathlib.Path,
+        num_workers: int = None,
+        max_memory_gb: float = None,
+        pyramid_levels: int = 3,
+        backend: str = None,
+        progress=None,
     ):
         """
         Compiles energies into one HDF5 file and aligns all data to a pre-aligned upper
         dataset. This should account for a significant amount of the "wobble" in the
         data. This also rescales to the upper-most energy
 
+        Energies are shrunk and shifted in a pool of worker processes. Only this
+        process writes to the compiled file, in the order the energies finish.
+
         Parameters
         ----------
         folders: list of pathlib.Path
@@ -52,104 +173,130 @@ class MultiEnergyProjections(IOBase):
         write_location: pathlib.Path
             Location where compiled energy hdf5 file will be written.
 
+        num_workers: int, optional
+            Number of worker processes. Defaults to os.environ["num_cpu_cores"].
+
+        max_memory_gb: float, optional
+            Approximate memory that energies being processed or waiting to be
+            written may use. Limits the number of energies in flight. Defaults to
+            no limit other than num_workers.
+
+        pyramid_levels: int, optional
+            Number of downsampled pyramid levels to shrink, shift and write.
+
+        backend: str, optional
+            Array backend for the workers ("numpy" or "cupy"). Defaults to the
+            GPU with a single worker, and to the CPU with more than one, so
+            workers do not compete for GPU memory.
+
+        progress: ipywidgets.IntProgress, optional
+            Incremented after each energy is written.
+
         """
+        folders = [pathlib.Path(folder) for folder in folders]
+        if num_workers is None:
+            num_workers = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+        num_workers = max(min(num_workers, len(folders)), 1)
+        if backend is None and num_workers > 1:
+            backend = "numpy"
+        threads = max(
+            int(os.environ.get("num_cpu_cores", os.cpu_count())) // num_workers, 1
+        )
 
         # Setting the shift values
         ref = Projections_Prenormalized()
-        ref.filepath = hdf_for_alignment
+        ref.filepath = pathlib.Path(hdf_for_alignment)
         ref.metadatas = Metadata.get_metadata_hierarchy(
             ref.filedir / "alignment_metadata.json"
         )
         for metadata in ref.metadatas:
             metadata.set_attributes_from_metadata(ref)
-        ref._unload_hdf_normalized_and_ds()
-        ref_shape = ref.data.shape
+        ref._open_hdf_file_read_only()
+        ref_shapes = [ref.hdf_file[ref.hdf_key_norm_proj].shape]
+        for i in range(pyramid_levels):
+            ref_shapes.append(
+                ref.hdf_file[ref.hdf_key_ds + str(i) + "/" + ref.hdf_key_data].shape
+            )
+        ref._close_hdf_file()
 
-        sx = np.zeros((ref_shape[0]))
-        sy = np.zeros((ref_shape[0]))
+        sx = np.zeros((ref_shapes[0][0]))
+        sy = np.zeros((ref_shapes[0][0]))
         for metadata in ref.metadatas:
             if metadata.metadata["metadata_type"] == "Align":
                 sx += np.array(metadata.metadata["sx"])
                 sy += np.array(metadata.metadata["sy"])
+
+        max_in_flight = None
+        if max_memory_gb is not None:
+            # input, zoomed and shifted copies of each level, as float32
+            job_nbytes = 3 * 4 * sum(np.prod(shape) for shape in ref_shapes)
+            max_in_flight = max(int(max_memory_gb * 1024**3 // job_nbytes), 1)
+            num_workers = min(num_workers, max_in_flight)
+        jobs = [
+            {
+                "folder": folder,
+                "ref_energy": ref.energy_float,
+                "ref_shapes": ref_shapes,
+                "sx": sx,
+                "sy": sy,
+                "backend": backend,
+                "threads": threads,
+            }
+            for folder in folders
+        ]
+
         # Shifting all of the lower energies and writing
-        hdf_file = h5py.File(write_location, "a")
-
-        self.energies = []
-        self.energies_str = []
-        for folder in folders:
-            sx = np.zeros((ref_shape[0]))
-            sy = np.zeros((ref_shape[0]))
-            for metadata in ref.metadatas:
-                if metadata.metadata["metadata_type"] == "Align":
-                    sx += np.array(metadata.metadata["sx"])
-                    sy += np.array(metadata.metadata["sy"])
-            moving = Projections_Prenormalized()
-            moving.filepath = folder / "normalized_projections.hdf5"
-            moving._load_hdf_normalized_data_into_memory()
-            moving.metadatas = Metadata.get_metadata_hierarchy(
-                moving.filedir / "import_metadata.json"
-            )
-            moving.metadata = moving.metadatas[0]
-            moving.metadata.set_attributes_from_metadata(moving)
-            moving.data = shrink_and_pad_projections(
-                moving.data, ref.data, moving.energy_float, ref.energy_float, 5
-            )
-            moving.data = shift_projections(moving.data, sx, sy)
-            group: str = self.hdf_key_energies + "/" + moving.energy_str
-            if group + self.hdf_key_norm not in hdf_file:
-                grp = hdf_file.create_group(group + self.hdf_key_norm)
-                ds = grp.create_dataset(self.hdf_key_data, data=moving.data)
-            else:
-                grp = hdf_file[group + self.hdf_key_norm]
-                ds = grp[self.hdf_key_data]
-                ds[...] = moving.data
-            grp.attrs["energy"] = moving.energy_float
-            grp.attrs["sx"] = sx
-            grp.attrs["sy"] = sy
-            grp.attrs["angles_deg"] = moving.metadata.metadata["angles_deg"]
-            for key in self.hdf_keys_ds_hist:
-                ds = grp.create_dataset(key, data=moving.hist[key])
-            self.energies.append(moving.energy_float)
-            self.energies_str.append(moving.energy_str)
-
-            # Padding, shifting, saving downsampled + histograms
-            for i in range(3):
-                sx = [x / 2 for x in sx]
-                sy = [y / 2 for y in sy]
-                moving._load_hdf_ds_data_into_memory(pyramid_level=i)
-                ref._load_hdf_ds_data_into_memory(pyramid_level=i)
-                moving.data_ds = shrink_and_pad_projections(
-                    moving.data_ds,
-                    ref.data_ds,
-                    moving.energy_float,
-                    ref.energy_float,
-                    5,
-                )
-                moving.data_ds = shift_projections(moving.data_ds, sx, sy)
-                if group + self.hdf_key_ds + "/" + str(i) + "/" not in hdf_file:
-                    grp = hdf_file.create_group(
-                        group + self.hdf_key_ds + "/" + str(i) + "/"
+        results = {}
+        with open_store(write_location, "a") as hdf_file:
+
+            def write(job, result):
+                group: str = self.hdf_key_energies + "/" + result["energy_str"]
+                keys = [group + self.hdf_key_norm] + [
+                    group + self.hdf_key_ds + "/" + str(i) + "/"
+                    for i in range(pyramid_levels)
+                ]
+                for i, (key, level) in enumerate(zip(keys, result["levels"])):
+                    data, hist, _sx, _sy = level
+                    hist_keys = self.hdf_keys_ds_hist
+                    if i > 0:
+                        hist_keys = hist_keys + self.hdf_keys_ds_hist_scalar
+                    self._write_energy_group(
+                        hdf_file, key, data, hist, hist_keys, _sx, _sy, result
                     )
-                    ds = grp.create_dataset(self.hdf_key_data, data=moving.data_ds)
-                else:
-                    grp = hdf_file[group + self.hdf_key_ds + "/" + str(i) + "/"]
-                    ds = grp[self.hdf_key_data]
-                    ds[...] = moving.data_ds
-                grp.attrs["energy"] = moving.energy_float
-                grp.attrs["sx"] = sx
-                grp.attrs["sy"] = sy
-                grp.attrs["angles_deg"] = moving.metadata.metadata["angles_deg"]
-                for key in self.hdf_keys_ds_hist:
-                    ds = grp.create_dataset(key, data=moving.hist[key])
-                for key in self.hdf_keys_ds_hist_scalar:
-                    ds = grp.create_dataset(key, data=moving.hist[key])
-
-            moving._close_hdf_file()
+                results[job["folder"]] = result["energy_float"], result["energy_str"]
 
-        ref._close_hdf_file()
-        hdf_file[self.hdf_key_energies].attrs["energies_float"] = self.energies
-        hdf_file[self.hdf_key_energies].attrs["energies_str"] = self.energies_str
-        hdf_file.close()
+            run_jobs(
+                jobs,
+                _shrink_and_shift_energy,
+                write,
+                num_workers=num_workers,
+                max_in_flight=max_in_flight,
+                progress=progress,
+            )
+            self.energies = [results[folder][0] for folder in folders]
+            self.energies_str = [results[folder][1] for folder in folders]
+            hdf_file[self.hdf_key_energies].attrs["energies_float"] = self.energies
+            hdf_file[self.hdf_key_energies].attrs["energies_str"] = self.energies_str
+
+    def _write_energy_group(self, hdf_file, key, data, hist, hist_keys, sx, sy, result):
+        """
+        Writes one level of one energy, overwriting what is there.
+        """
+        grp = hdf_file.require_group(key)
+        if self.hdf_key_data in grp and grp[self.hdf_key_data].shape != data.shape:
+            del grp[self.hdf_key_data]
+        if self.hdf_key_data in grp:
+            grp[self.hdf_key_data][...] = data
+        else:
+            grp.create_dataset(self.hdf_key_data, data=data)
+        grp.attrs["energy"] = result["energy_float"]
+        grp.attrs["sx"] = sx
+        grp.attrs["sy"] = sy
+        grp.attrs["angles_deg"] = result["angles_deg"]
+        for hist_key in hist_keys:
+            if hist_key in grp:
+                del grp[hist_key]
+            grp.create_dataset(hist_key, data=hist[hist_key])
 
     def get_folders(self, filedir: pathlib.Path):
         """
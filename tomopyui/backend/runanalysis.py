@@ -7,13 +7,18 @@ import pathlib
 import tomopy
 import matplotlib.pyplot as plt
 import time
+import h5py
 
 from abc import ABC, abstractmethod
 from copy import copy, deepcopy
 from time import perf_counter
 from skimage.transform import rescale  # look for better option
-from tomopy.prep.alignment import align_joint as align_joint_tomopy
 from tomopyui.backend.util.padding import *
+from tomopyui.backend.util.pipeline import run_pipeline
+from tomopyui.backend.util.recon_engines import get_engine
+from tomopyui.backend.util.zarr_store import open_store, store_path
+from tomopyui.backend.util.alignment import align_joint as align_joint_cpu
+from tomopyui.backend.util.alignment import shift_projections as shift_projections_cpu
 from tomopyui._sharedvars import *
 from tomopyui.backend.io import Metadata_Align, Metadata_Recon, Projections_Child
 from tomopy.recon import algorithm as tomopy_algorithm
@@ -28,7 +33,6 @@ cuda_import_dict = {"cupy": "cuda_enabled"}
 import_module_set_env(cuda_import_dict)
 if os.environ["cuda_enabled"] == "True":
     import astra
-    import tomopyui.tomocupy.recon.algorithm as tomocupy_algorithm
     import cupy as cp
     from ..tomocupy.prep.alignment import align_joint as align_joint_cupy
     from ..tomocupy.prep.alignment import shift_prj_cp
@@ -117,7 +121,7 @@ class RunAnalysisBase(ABC):
 
         return metadata_list
 
-    def init_projections(self):
+    def init_projections(self, load_data=True):
         self.px_range = (self.px_range_x, self.px_range_y)
         if not self.downsample:
             self.pyramid_level = -1
@@ -129,18 +133,19 @@ class RunAnalysisBase(ABC):
             int(np.around(y / self.ds_factor)) for y in self.px_range_y
         ]
         self.px_range_ds = (self.px_range_x_ds, self.px_range_y_ds)
-        if self.pyramid_level == -1:
-            self.projections.get_parent_data_from_hdf(self.px_range_ds)
-            self.prjs = self.projections.data
-        else:
-            self.projections.get_parent_data_ds_from_hdf(
-                self.pyramid_level, self.px_range_ds
-            )
-            self.prjs = self.projections.data_ds
-
-        # Pad
         self.pad_ds = tuple([int(np.around(x / self.ds_factor)) for x in self.pad])
-        self.prjs = pad_projections(self.prjs, self.pad_ds)
+        if load_data:
+            # read the crop straight into the padded float32 array
+            if self.pyramid_level == -1:
+                self.projections.get_parent_data_from_hdf(
+                    self.px_range_ds, self.pad_ds, np.float32
+                )
+                self.prjs = self.projections.data
+            else:
+                self.projections.get_parent_data_ds_from_hdf(
+                    self.pyramid_level, self.px_range_ds, self.pad_ds, np.float32
+                )
+                self.prjs = self.projections.data_ds
 
         # center of rotation change to fit new range
         if not self.use_multiple_centers:
@@ -200,8 +205,14 @@ class RunAnalysisBase(ABC):
 class RunRecon(RunAnalysisBase):
     """ """
 
+    # approximate memory (MB) for one slab of projections + reconstruction when
+    # streaming.
+    slab_mb = 2048
+
     def __init__(self, Recon):
         self.recon = None
+        self.streaming = False
+        self.streaming_format = "hdf5"
         self.metadata_class = Metadata_Recon
         self.metadata = self.metadata_class()
         self.savedir_suffix = "recon"
@@ -209,96 +220,158 @@ class RunRecon(RunAnalysisBase):
 
     def save_data_after(self):
         super()._save_data_after()
-        if self.metadata.metadata["save_opts"]["Reconstruction"]:
+        if self.metadata.metadata["save_opts"]["Reconstruction"] and not self.streaming:
             tf.imwrite(self.wd_subdir / "recon.tif", self.recon)
         self.analysis_parent.run_list.append({self.wd_subdir: self.metadata})
         self.metadata.save_metadata()
 
     def reconstruct(self):
-        # ensure it only runs on 1 thread for CUDA
-        os.environ["TOMOPY_PYTHON_THREADS"] = "1"
+        self.recon = self._reconstruct(self.prjs, self.center)
+        self.recon = unpad_rec_with_pad(self.recon, self.pad_ds)
+        self.recon = circ_mask(self.recon, axis=0)
+        return self
+
+    def _reconstruct(self, prjs, center):
+        """
+        Reconstructs prjs with the method in the current metadata.
+
+        Returns
+        -------
+        recon : ndarray
+            Reconstruction of the padded projections.
+        """
         method_str = list(self.metadata.metadata["methods"].keys())[0]
-        if (
-            method_str in astra_cuda_recon_algorithm_underscores
-            and os.environ["cuda_enabled"] == "True"
-        ):
-            self.current_recon_is_cuda = True
+        engine = get_engine(method_str)
+        self.current_recon_is_cuda = engine.cuda
+        if engine.cuda:
+            # ensure it only runs on 1 thread for CUDA
+            os.environ["TOMOPY_PYTHON_THREADS"] = "1"
+            ncore = 1
+        else:
+            os.environ["TOMOPY_PYTHON_THREADS"] = str(os.environ["num_cpu_cores"])
+            ncore = int(os.environ["num_cpu_cores"])
+        context = engine.create(prjs, self.angles_rad, center=center, ncore=ncore)
+        with context:
+            context.reconstruct(int(self.num_iter))
+            recon = context.get_recon()
+        return recon
+
+    def save_data_before_analysis(self):
+        pass
+
+    def reconstruct_streaming(self):
+        """
+        Reconstructs slabs of sinograms read straight from the hdf5 file, and writes
+        each reconstructed slab into a preallocated hdf5 or tiff file in
+        self.wd_subdir. Reading, reconstruction and writing overlap, and only a few
+        slabs are in memory at any time. self.recon is set to a preview of every
+        self.preview_step-th reconstructed slice.
+        """
+        if self.pyramid_level == -1:
+            hdf_key = self.projections.hdf_key_norm_proj
         else:
-            self.current_recon_is_cuda = False
-
-        if method_str == "MLEM_CUDA":
-            method_str = "EM_CUDA"
-
-        # TODO: parsing recon method could be done in an Align method
-        if method_str == "SIRT_Plugin":
-            self.recon = tomocupy_algorithm.recon_sirt_plugin(
-                self.prjs,
-                self.angles_rad,
-                num_iter=self.num_iter,
-                center=self.center,
+            hdf_key = (
+                self.projections.hdf_key_ds
+                + str(self.pyramid_level)
+                + "/"
+                + self.projections.hdf_key_data
             )
-        elif method_str == "SIRT_3D":
-            self.recon = tomocupy_algorithm.recon_sirt_3D(
-                self.prjs,
-                self.angles_rad,
-                num_iter=self.num_iter,
-                center=self.center,
+        x0, x1 = self.px_range_x_ds
+        y0, y1 = self.px_range_y_ds
+        pad_x = self.pad_ds[0]
+        self.parent_projections._close_hdf_file()
+        source = open_store(self.parent_projections.filepath, "r")
+        prj_dataset = source[hdf_key]
+        num_angles = prj_dataset.shape[0]
+        num_cols = x1 - x0
+        num_slices = y1 - y0
+
+        # slab size from memory budget: projections + recon of padded slab
+        padded_cols = num_cols + 2 * pad_x
+        row_mb = 4 * (num_angles * padded_cols + padded_cols**2) / 1024**2
+        slab_rows = int(np.clip(self.slab_mb / row_mb, 1, num_slices))
+        out_shape = (num_slices, num_cols, num_cols)
+        if self.streaming_format == "tiff":
+            self.recon_filepath = self.wd_subdir / self.projections.recon_tif_key
+            out = tf.memmap(
+                self.recon_filepath, shape=out_shape, dtype=np.float32, bigtiff=True
             )
-        elif method_str == "CGLS_3D":
-            self.recon = tomocupy_algorithm.recon_cgls_3D_allgpu(
-                self.prjs,
-                self.angles_rad,
-                num_iter=self.num_iter,
-                center=self.center,
+        else:
+            # "hdf5" or "zarr"
+            self.recon_filepath = store_path(
+                self.wd_subdir / self.projections.recon_hdf_key, self.streaming_format
             )
-        elif self.current_recon_is_cuda:
-            # Options go into kwargs which go into recon()
-            kwargs = {}
-            options = {
-                "proj_type": "cuda",
-                "method": method_str,
-                "num_iter": int(self.num_iter),
-            }
-            kwargs["options"] = options
-            self.recon = tomopy_algorithm.recon(
-                self.prjs,
-                self.angles_rad,
-                algorithm=wrappers.astra,
-                center=self.center,
-                ncore=1,
-                **kwargs,
+            out_file = open_store(self.recon_filepath, "w")
+            layout = self.projections.hdf_layout
+            out = out_file.create_dataset(
+                self.projections.hdf_key_recon,
+                shape=out_shape,
+                dtype=np.float32,
+                **layout.store_kwargs(out_file, out_shape, np.float32),
             )
-        else:
-            os.environ["TOMOPY_PYTHON_THREADS"] = str(os.environ["num_cpu_cores"])
-            if method_str == "gridrec" or method_str == "fbp":
-                self.recon = tomopy_algorithm.recon(
-                    self.prjs,
-                    self.angles_rad,
-                    algorithm=method_str,
-                    center=self.center,
-                )
+            # align slabs with hdf5/zarr chunks, so no chunk is written twice
+            if out.chunks is not None and slab_rows > out.chunks[0]:
+                slab_rows -= slab_rows % out.chunks[0]
+        slabs = [(r, min(r + slab_rows, y1)) for r in range(y0, y1, slab_rows)]
+
+        # keep at most ~1 GB of slices to show in the viewer
+        self.preview_step = int(np.ceil(4 * np.prod(out_shape) / 1024**3))
+        self.recon = np.empty(
+            (len(range(0, num_slices, self.preview_step)), num_cols, num_cols),
+            dtype=np.float32,
+        )
+
+        def read(slab):
+            prjs = prj_dataset[:, slab[0] : slab[1], x0:x1]
+            return pad_projections(prjs, (pad_x, 0))
+
+        def process(slab, prjs):
+            center = self.center
+            if self.use_multiple_centers:
+                # self.center has one center per slice of the y-padded data
+                start = slab[0] - y0 + self.pad_ds[1]
+                center = center[start : start + slab[1] - slab[0]]
+            recon = self._reconstruct(prjs, center)
+            recon = unpad_rec_with_pad(recon, (pad_x, 0))
+            return circ_mask(recon, axis=0)
+
+        def write(slab, recon):
+            out[slab[0] - y0 : slab[1] - y0] = recon
+            preview_ind = [
+                i
+                for i in range(slab[0] - y0, slab[1] - y0)
+                if i % self.preview_step == 0
+            ]
+            for i in preview_ind:
+                self.recon[i // self.preview_step] = recon[i - (slab[0] - y0)]
+
+        progress = self.analysis_parent.progress_total
+        progress.value = 0
+        progress.max = len(slabs)
+        try:
+            run_pipeline(slabs, read, process, write, progress=progress)
+        finally:
+            source.close()
+            if self.streaming_format == "tiff":
+                out.flush()
             else:
-                self.recon = tomopy_algorithm.recon(
-                    self.prjs,
-                    self.angles_rad,
-                    algorithm=method_str,
-                    center=self.center,
-                    num_iter=self.num_iter,
-                )
-        self.recon = unpad_rec_with_pad(self.recon, self.pad_ds)
-        self.recon = circ_mask(self.recon, axis=0)
+                out_file.close()
+        self.metadata.metadata["recon_filepath"] = str(self.recon_filepath)
+        self.metadata.metadata["preview_step"] = self.preview_step
         return self
 
-    def save_data_before_analysis(self):
-        pass
-
     def run(self):
-        super().init_projections()
+        super().init_projections(load_data=not self.streaming)
         metadata_list = super().make_metadata_list()
         for i in range(len(metadata_list)):
             self.metadata = metadata_list[i]
             tic = time.perf_counter()
-            self.reconstruct()
+            if self.streaming:
+                self.make_wd_subdir()
+                self.skip_mk_wd_subdir = True
+                self.reconstruct_streaming()
+            else:
+                self.reconstruct()
             self.projections.data = self.recon
             toc = time.perf_counter()
             self.metadata.metadata["analysis_time"] = {
@@ -317,6 +390,13 @@ class RunAlign(RunAnalysisBase):
         self.sx = None
         self.sy = None
         self.conv = None
+        self.multiresolution = False
+        self.refine_iters = 2
+        self.multires_finest_level = -1
+        self.warm_start = None
+        self.convergence_opts = None
+        self.stop_reason = None
+        self.num_frozen = 0
         self.metadata_class = Metadata_Align
         self.metadata = self.metadata_class()
         self.savedir_suffix = "alignment"
@@ -338,35 +418,75 @@ class RunAlign(RunAnalysisBase):
         Aligns projections using options in GUI.
         """
         for method in self.metadata.metadata["methods"]:
-            if (
-                method in astra_cuda_recon_algorithm_underscores
-                and os.environ["cuda_enabled"] == "True"
-            ):
-                self.current_align_is_cuda = True
-                align_joint_cupy(self)
+            engine = get_engine(method)
+            self.current_align_is_cuda = engine.cuda and engine.available
+            if self.multiresolution and self.downsample:
+                self.align_multiresolution()
             else:
-                self.current_align_is_cuda = False
-                os.environ["TOMOPY_PYTHON_THREADS"] = str(os.environ["num_cpu_cores"])
-                import scipy.fft as fft
-
-                fft.set_backend("scipy")
-                if method == "gridrec" or method == "fbp":
-                    self.prjs, self.sx, self.sy, self.conv = align_joint_tomopy(
-                        self.prjs,
-                        self.angles_rad,
-                        upsample_factor=self.upsample_factor,
-                        center=self.center,
-                        algorithm=method,
-                    )
-                else:
-                    self.prjs, self.sx, self.sy, self.conv = align_joint_tomopy(
-                        self.prjs,
-                        self.angles_rad,
-                        upsample_factor=self.upsample_factor,
-                        center=self.center,
-                        algorithm=method,
-                        iters=self.num_iter,
-                    )
+                self._align_joint()
+
+    def _align_joint(self):
+        if self.current_align_is_cuda:
+            align_joint_cupy(self)
+        else:
+            align_joint_cpu(self)
+
+    def align_multiresolution(self):
+        """
+        Coarse-to-fine alignment over the downsampled pyramid.
+
+        Runs num_iter iterations at the chosen pyramid level, then moves one
+        level finer at a time down to multires_finest_level (-1 is the original
+        data). Each finer level starts from the shifts and reconstruction of the
+        level before it, so it only runs refine_iters iterations. The
+        convergence of all levels is concatenated in self.conv.
+        """
+        num_iter = self.num_iter
+        coarsest_level = self.pyramid_level
+        levels = range(coarsest_level, self.multires_finest_level - 1, -1)
+        convergence = []
+        level_metadata = []
+        for level in levels:
+            if level != coarsest_level:
+                self.warm_start = {
+                    "sx": self.sx,
+                    "sy": self.sy,
+                    "recon": self.recon,
+                    "scl": self.scl,
+                    "ds_factor": self.ds_factor,
+                }
+                self.prjs = None
+                self.recon = None
+                self.pyramid_level = level
+                self.num_iter = self.refine_iters
+                self._reset_full_resolution_attributes()
+                self.init_projections()
+            self._align_joint()
+            self.warm_start = None
+            convergence.append(self.conv)
+            level_metadata.append(
+                {
+                    "pyramid_level": level,
+                    "num_iter": self.num_iter,
+                    "convergence": list(self.conv),
+                    "stop_reason": self.stop_reason,
+                }
+            )
+        self.num_iter = num_iter
+        self.pyramid_level = coarsest_level
+        self.conv = np.concatenate(convergence)
+        self.metadata.metadata["multiresolution_levels"] = level_metadata
+
+    def _reset_full_resolution_attributes(self):
+        """
+        Undoes the downsampling of center, pad and subsets done for the last
+        pyramid level by init_projections and align_joint.
+        """
+        self.center = self.metadata.metadata["opts"]["center"]
+        self.pad = tuple(self.metadata.metadata["opts"]["pad"])
+        if self.use_subset_correlation:
+            self.subset_x = self.metadata.metadata["subset_x"]
+            self.subset_y = self.metadata.metadata["subset_y"]
 
     def _shift_prjs_after_alignment(self):
         if self.shift_full_dataset_after:
@@ -377,8 +497,10 @@ class RunAlign(RunAnalysisBase):
                 )
                 self.projections.data = self.projections._data
             else:
-                # TODO: make shift projections without cupy
-                pass
+                self.projections._data = shift_projections_cpu(
+                    self.projections.data, self.sx, self.sy
+                )
+                self.projections.data = self.projections._data
         else:
             self.projections._data = self.prjs
             self.projections.data = self.projections._data
@@ -392,6 +514,8 @@ class RunAlign(RunAnalysisBase):
         self.metadata.metadata["sx"] = list(self.sx)
         self.metadata.metadata["sy"] = list(self.sy)
         self.metadata.metadata["convergence"] = list(self.conv)
+        self.metadata.metadata["stop_reason"] = self.stop_reason
+        self.metadata.metadata["num_frozen_projections"] = self.num_frozen
         self.saved_as_hdf = False
         if self.metadata.metadata["save_opts"]["Projections After Alignment"] or self.analysis_parent.save_after_alignment:
             if self.metadata.metadata["save_opts"]["hdf"]:
@@ -412,7 +536,7 @@ class RunAlign(RunAnalysisBase):
                 )
                 data_dict = {self.projections.hdf_key_norm_proj: self.projections.data}
                 self.projections.dask_data_to_h5(data_dict)    
-        if self.metadata.metadata["save_opts"]["Reconstruction"] and self.current_align_is_cuda:
+        if self.metadata.metadata["save_opts"]["Reconstruction"]:
             if self.metadata.metadata["save_opts"]["tiff"]:
                 tf.imwrite(self.wd_subdir / "recon.tif", self.recon)
 
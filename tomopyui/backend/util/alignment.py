@@ -0,0 +1,533 @@
+"""
+Joint alignment on pluggable array backends.
+
+This is the same batched algorithm as `tomopyui.tomocupy.prep.alignment`, but
+the array operations go through an array backend (see
+`tomopyui.backend.util.array_backend`), so it runs on CPU-only nodes with
+NumPy/SciPy. Reconstruction and re-projection go through the CPU engines in
+`tomopyui.backend.util.recon_engines` (tomopy's algorithms, or the SIRT/CGLS
+solvers in `tomopyui.backend.util.projector`), whose context lives for the whole
+alignment.
+"""
+
+import os
+import bqplot as bq
+import numpy as np
+
+from scipy import ndimage as ndi
+from tomopy.misc.corr import circ_mask
+from tomopy.prep.alignment import scale as scale_tomo
+from bqplot_image_gl import ImageGL
+from ipywidgets import *
+from tomopyui.backend.util.array_backend import get_backend
+from tomopyui.backend.util.convergence import ConvergencePolicy
+from tomopyui.backend.util.padding import *
+from tomopyui.backend.util.recon_engines import get_engine
+from tomopyui.backend.util.shift import shift_stack
+from tomopyui.backend.util.registration._phase_cross_correlation_batch import (
+    phase_cross_correlation,
+)
+
+
+def align_joint(RunAlign, backend=None):
+    """
+    Joint reconstruction/re-projection alignment using tomopy CPU
+    reconstruction algorithms.
+
+    Parameters
+    ----------
+    RunAlign : `RunAlign`
+        Alignment object holding prjs, angles_rad, center and the options
+        set in the Align widget.
+    backend : `NumpyBackend`, optional
+        Array backend. Defaults to `NumpyBackend` with os.environ["num_cpu_cores"]
+        workers.
+
+    Returns
+    -------
+    RunAlign : `RunAlign`
+        With prjs, sx, sy, shift, conv, recon and pad updated.
+    """
+    if backend is None:
+        backend = get_backend("numpy")
+    os.environ["TOMOPY_PYTHON_THREADS"] = str(backend.workers)
+
+    # Initialize variables from metadata for ease of reading:
+    num_iter = RunAlign.num_iter
+    downsample = RunAlign.downsample
+    method_str = list(RunAlign.metadata.metadata["methods"].keys())[0]
+    upsample_factor = RunAlign.upsample_factor
+    num_batches = RunAlign.num_batches
+    center = RunAlign.center
+    pre_alignment_iters = RunAlign.pre_alignment_iters
+
+    # Needs scaling for skimage float operations
+    RunAlign.prjs, scl = scale_tomo(RunAlign.prjs)
+
+    # Initialization of reconstruction dataset
+    tomo_shape = RunAlign.prjs.shape
+    RunAlign.recon = 1e-12 * np.ones(
+        (tomo_shape[1], tomo_shape[2], tomo_shape[2]), dtype=np.float32
+    )
+
+    # Initialize shift/convergence
+    RunAlign.sx = np.zeros((tomo_shape[0]))
+    RunAlign.sy = np.zeros((tomo_shape[0]))
+    RunAlign.conv = np.zeros((num_iter))
+    warm = warm_start_alignment(RunAlign, scl, backend=backend)
+    RunAlign.scl = scl
+    policy = ConvergencePolicy.from_opts(RunAlign.convergence_opts)
+    policy.reset(tomo_shape[0])
+    context = get_engine(method_str).create(
+        RunAlign.prjs,
+        RunAlign.angles_rad,
+        center=center,
+        recon=RunAlign.recon,
+        ncore=backend.workers,
+    )
+
+    plots = init_alignment_plots(RunAlign)
+
+    # Start alignment
+    for n in range(num_iter):
+        if n == 0 and not warm:
+            recon_iterations = pre_alignment_iters
+        else:
+            recon_iterations = 1
+
+        # for progress bars
+        RunAlign.analysis_parent.progress_shifting.value = 0
+        RunAlign.analysis_parent.progress_reprj.value = 0
+        RunAlign.analysis_parent.progress_phase_cross_corr.value = 0
+        RunAlign.recon = context.reconstruct(recon_iterations)
+        RunAlign.analysis_parent.progress_total.value = n + 1
+
+        sim = context.forward_project(progress=RunAlign.analysis_parent.progress_reprj)
+
+        # Cross correlation, skipping frozen projections
+        shift_cpu = []
+        _prjs, _sim = policy.select(RunAlign.prjs, sim)
+        batch_cross_correlation(
+            _prjs,
+            _sim,
+            shift_cpu,
+            min(num_batches, _prjs.shape[0]),
+            upsample_factor,
+            subset_correlation=RunAlign.use_subset_correlation,
+            subset_x=RunAlign.subset_x,
+            subset_y=RunAlign.subset_y,
+            blur=True,
+            pad=RunAlign.pad_ds,
+            progress=RunAlign.analysis_parent.progress_phase_cross_corr,
+            backend=backend,
+        )
+        RunAlign.shift = policy.expand(np.concatenate(shift_cpu, axis=1))
+
+        # Shifting
+        sx_prev, sy_prev = RunAlign.sx, RunAlign.sy
+        (
+            RunAlign.prjs,
+            RunAlign.sx,
+            RunAlign.sy,
+            RunAlign.shift,
+            err,
+            RunAlign.pad_ds,
+            center,
+        ) = shift_prj_update_shift(
+            RunAlign.prjs,
+            RunAlign.sx,
+            RunAlign.sy,
+            RunAlign.shift,
+            num_batches,
+            RunAlign.pad_ds,
+            center,
+            progress=RunAlign.analysis_parent.progress_shifting,
+            backend=backend,
+        )
+        moved = np.flatnonzero((RunAlign.sx != sx_prev) | (RunAlign.sy != sy_prev))
+        context.update_projections(RunAlign.prjs, moved)
+        stop = policy.update(err)
+        RunAlign.conv[n] = policy.conv[-1]
+        update_alignment_plots(RunAlign, plots, sim, n)
+        backend.free_memory()
+        if stop:
+            break
+
+    RunAlign.conv = RunAlign.conv[: len(policy.conv)]
+    RunAlign.stop_reason = policy.stop_reason
+    RunAlign.num_frozen = int(np.count_nonzero(~policy.active))
+    RunAlign.recon = context.get_recon()
+    context.close()
+
+    # Re-normalize data
+    RunAlign.prjs *= scl
+    RunAlign.recon = circ_mask(RunAlign.recon, 0)
+    if downsample:
+        RunAlign.sx *= RunAlign.ds_factor
+        RunAlign.sy *= RunAlign.ds_factor
+        RunAlign.shift *= RunAlign.ds_factor
+
+    RunAlign.pad = tuple([int(x * RunAlign.ds_factor) for x in RunAlign.pad_ds])
+    return RunAlign
+
+
+def warm_start_alignment(RunAlign, scl, backend=None):
+    """
+    Starts an alignment from the result of a coarser pyramid level, stored in
+    RunAlign.warm_start by `RunAlign.align_multiresolution`.
+
+    The shifts (in full resolution pixels) are brought to this level and applied
+    to RunAlign.prjs, and the coarse reconstruction is resampled onto this
+    level's grid.
+
+    Parameters
+    ----------
+    RunAlign : `RunAlign`
+        With prjs already scaled by `scale_tomo` and padded.
+    scl : float
+        Scaling factor returned by `scale_tomo` for RunAlign.prjs.
+    backend : `NumpyBackend` or `CupyBackend`, optional
+        Array backend used to shift the projections.
+
+    Returns
+    -------
+    warm : bool
+        True if RunAlign.warm_start was applied.
+    """
+    warm_start = getattr(RunAlign, "warm_start", None)
+    if warm_start is None:
+        return False
+    if backend is None:
+        backend = get_backend()
+    RunAlign.sx = np.asarray(warm_start["sx"], dtype=float) / RunAlign.ds_factor
+    RunAlign.sy = np.asarray(warm_start["sy"], dtype=float) / RunAlign.ds_factor
+    RunAlign.prjs = shift_stack(
+        RunAlign.prjs,
+        RunAlign.sx,
+        RunAlign.sy,
+        num_batches=RunAlign.num_batches,
+        backend=backend,
+        out=RunAlign.prjs,
+    )
+    recon = warm_start["recon"]
+    tomo_shape = RunAlign.prjs.shape
+    shape = (tomo_shape[1], tomo_shape[2], tomo_shape[2])
+    zoom = [new / old for new, old in zip(shape, recon.shape)]
+    recon = ndi.zoom(recon, zoom, output=np.float32, order=1)
+    # Reconstructed values are per pixel, and each level is scaled separately.
+    ratio = warm_start["ds_factor"] / RunAlign.ds_factor
+    recon *= warm_start["scl"] / scl / ratio
+    RunAlign.recon = recon
+    return True
+
+
+def init_alignment_plots(RunAlign, projection_num=50):
+    """
+    Displays the projection/re-projection images, the shift plot and the
+    convergence plot in RunAlign's plot outputs.
+
+    Returns
+    -------
+    plots : dict or None
+        Marks to update every iteration with `update_alignment_plots`. None when
+        there are no plot outputs (headless runs).
+    """
+    if RunAlign.plot_output1 is None:
+        return None
+    projection_num = min(projection_num, RunAlign.prjs.shape[0] - 1)
+
+    # Initialize projection images plot
+    scale_x = bq.LinearScale(min=0, max=1)
+    scale_y = bq.LinearScale(min=1, max=0)
+    scales = {"x": scale_x, "y": scale_y}
+
+    projection_fig = bq.Figure(scales=scales)
+    simulated_fig = bq.Figure(scales=scales)
+
+    scales_image = {
+        "x": scale_x,
+        "y": scale_y,
+        "image": bq.ColorScale(
+            min=float(np.min(RunAlign.prjs[projection_num])),
+            max=float(np.max(RunAlign.prjs[projection_num])),
+            scheme="viridis",
+        ),
+    }
+
+    image_projection = ImageGL(
+        image=RunAlign.prjs[projection_num],
+        scales=scales_image,
+    )
+    image_simulated = ImageGL(
+        image=np.zeros_like(RunAlign.prjs[projection_num]),
+        scales=scales_image,
+    )
+
+    projection_fig.marks = (image_projection,)
+    projection_fig.layout.width = "600px"
+    projection_fig.layout.height = "600px"
+    projection_fig.title = f"Projection Number {projection_num}"
+    simulated_fig.marks = (image_simulated,)
+    simulated_fig.layout.width = "600px"
+    simulated_fig.layout.height = "600px"
+    simulated_fig.title = f"Re-projected Image {projection_num}"
+    with RunAlign.plot_output1:
+        RunAlign.plot_output1.clear_output(wait=True)
+        display(
+            HBox(
+                [projection_fig, simulated_fig],
+                layout=Layout(
+                    flex_flow="row wrap",
+                    justify_content="center",
+                    align_items="stretch",
+                ),
+            )
+        )
+
+    # Initialize Sx, Sy plot
+    xs = bq.LinearScale()
+    ys = bq.LinearScale()
+    x = range(RunAlign.prjs.shape[0])
+    y = [RunAlign.sx, RunAlign.sy]
+    line = bq.Lines(
+        x=x,
+        y=y,
+        scales={"x": xs, "y": ys},
+        colors=["dodgerblue", "red"],
+        stroke_width=3,
+        labels=["Shift in X (px)", "Shift in Y (px)"],
+        display_legend=True,
+    )
+    xax = bq.Axis(scale=xs, label="Projection Number", grid_lines="none")
+    yax = bq.Axis(
+        scale=ys,
+        orientation="vertical",
+        tick_format="0.1f",
+        label="Shift",
+        grid_lines="none",
+    )
+    fig_SxSy = bq.Figure(marks=[line], axes=[xax, yax], animation_duration=1000)
+    fig_SxSy.layout.width = "600px"
+    # Initialize convergence plot
+    xs_conv = bq.LinearScale(min=0)
+    ys_conv = bq.LinearScale()
+    x_conv = [0]
+    y_conv = [RunAlign.conv[0]]
+    line_conv = bq.Lines(
+        x=x_conv,
+        y=y_conv,
+        scales={"x": xs_conv, "y": ys_conv},
+        colors=["dodgerblue"],
+        stroke_width=3,
+        labels=["Convergence"],
+        display_legend=True,
+    )
+    xax_conv = bq.Axis(scale=xs_conv, label="Iteration", grid_lines="none")
+    yax_conv = bq.Axis(
+        scale=ys_conv,
+        orientation="vertical",
+        tick_format="0.1f",
+        label="Convergence",
+        grid_lines="none",
+    )
+    fig_conv = bq.Figure(
+        marks=[line_conv], axes=[xax_conv, yax_conv], animation_duration=1000
+    )
+    fig_conv.layout.width = "600px"
+    with RunAlign.plot_output2:
+        RunAlign.plot_output2.clear_output()
+        display(
+            HBox(
+                [fig_SxSy, fig_conv],
+                layout=Layout(
+                    flex_flow="row wrap",
+                    justify_content="center",
+                    align_items="stretch",
+                    width="95%",
+                ),
+            )
+        )
+    plots = {
+        "projection_num": projection_num,
+        "image_projection": image_projection,
+        "image_simulated": image_simulated,
+        "line": line,
+        "line_conv": line_conv,
+    }
+    return plots
+
+
+def update_alignment_plots(RunAlign, plots, sim, n):
+    if plots is None:
+        return
+    projection_num = plots["projection_num"]
+    # update images
+    plots["image_projection"].image = RunAlign.prjs[projection_num]
+    plots["image_simulated"].image = sim[projection_num]
+    # update plot lines
+    plots["line_conv"].x = np.arange(0, n + 1)
+    plots["line_conv"].y = RunAlign.conv[range(n + 1)]
+    plots["line"].y = [
+        RunAlign.sx * RunAlign.ds_factor,
+        RunAlign.sy * RunAlign.ds_factor,
+    ]
+
+
+def batch_cross_correlation(
+    prj,
+    sim,
+    shift_cpu,
+    num_batches,
+    upsample_factor,
+    blur=True,
+    rin=0.5,
+    rout=0.8,
+    subset_correlation=False,
+    subset_x=None,
+    subset_y=None,
+    mask_sim=True,
+    pad=(0, 0),
+    progress=None,
+    median_filter=True,
+    backend=None,
+):
+    """
+    Backend-agnostic version of
+    `tomopyui.tomocupy.prep.alignment.batch_cross_correlation`. Shifts for each
+    batch are appended to shift_cpu as (2, N) arrays of (y, x) shifts that
+    register prj with sim.
+    """
+    if backend is None:
+        backend = get_backend()
+    xp = backend.xp
+    _prj = np.array_split(prj, num_batches, axis=0)
+    _sim = np.array_split(sim, num_batches, axis=0)
+    for batch in range(len(_prj)):
+        if subset_correlation:
+            _prj_batch = backend.asarray(
+                _prj[batch][:, subset_y[0] : subset_y[1], subset_x[0] : subset_x[1]]
+            )
+            _sim_batch = backend.asarray(
+                _sim[batch][:, subset_y[0] : subset_y[1], subset_x[0] : subset_x[1]]
+            )
+        else:
+            _prj_batch = backend.asarray(_prj[batch])
+            _sim_batch = backend.asarray(_sim[batch])
+
+        if median_filter:
+            _median = lambda x: backend.ndi.median_filter(x, size=(1, 5, 5))
+            _prj_batch = backend.map_chunks(_median, _prj_batch)
+            _sim_batch = backend.map_chunks(_median, _sim_batch)
+        if mask_sim:
+            _sim_batch = xp.where(_prj_batch < 1e-7, 0, _sim_batch)
+
+        if blur:
+            _prj_batch = blur_edges(_prj_batch, rin, rout, backend=backend)
+            _sim_batch = blur_edges(_sim_batch, rin, rout, backend=backend)
+        shift = phase_cross_correlation(
+            _sim_batch,
+            _prj_batch,
+            upsample_factor=upsample_factor,
+            return_error=False,
+            backend=backend,
+        )
+        shift_cpu.append(backend.asnumpy(shift))
+        if progress is not None:
+            progress.value += 1
+
+
+def blur_edges(prj, low=0, high=0.8, backend=None):
+    """
+    Blurs the edge of the projection images.
+
+    Parameters
+    ----------
+    prj : ndarray
+        3D stack of projection images. The first dimension
+        is projection axis, second and third dimensions are
+        the x- and y-axes of the projection image, respectively.
+    low : scalar, optional
+        Min ratio of the blurring frame to the image size.
+    high : scalar, optional
+        Max ratio of the blurring frame to the image size.
+    backend : `NumpyBackend` or `CupyBackend`, optional
+
+    Returns
+    -------
+    ndarray
+        Edge-blurred 3D stack of projection images.
+    """
+    if backend is None:
+        backend = get_backend()
+    xp = backend.xp
+    prj = backend.asarray(prj)
+    dx, dy, dz = prj.shape
+    rows, cols = xp.mgrid[:dy, :dz]
+    rad = xp.sqrt((rows - dy / 2) ** 2 + (cols - dz / 2) ** 2)
+    mask = xp.zeros((dy, dz), dtype=prj.dtype)
+    rmin, rmax = low * rad.max(), high * rad.max()
+    mask[rad < rmin] = 1
+    mask[rad > rmax] = 0
+    zone = xp.logical_and(rad >= rmin, rad <= rmax)
+    mask[zone] = (rmax - rad[zone]) / (rmax - rmin)
+    prj *= mask
+    return prj
+
+
+def shift_prj_update_shift(
+    prj,
+    sx,
+    sy,
+    shift,
+    num_batches,
+    pad,
+    center,
+    progress=None,
+    backend=None,
+):
+    """
+    Backend-agnostic version of
+    `tomopyui.tomocupy.prep.alignment.shift_prj_update_shift_cp`. Projections
+    are only shifted (and sx, sy only updated) if the total shift stays within
+    the padding.
+    """
+    if backend is None:
+        backend = get_backend()
+    err = np.sqrt(shift[0] * shift[0] + shift[1] * shift[1])
+    shifted_bool = np.logical_and(
+        np.absolute(sx + shift[1]) < pad[0], np.absolute(sy + shift[0]) < pad[1]
+    )
+    sx = np.where(shifted_bool, sx + shift[1], sx)
+    sy = np.where(shifted_bool, sy + shift[0], sy)
+
+    prj = shift_stack(
+        prj,
+        np.where(shifted_bool, shift[1], 0),
+        np.where(shifted_bool, shift[0], 0),
+        num_batches=num_batches,
+        backend=backend,
+        out=prj,
+    )
+    if progress is not None:
+        progress.value = progress.max
+    return prj, sx, sy, shift, err, pad, center
+
+
+def shift_projections(projections, sx, sy, num_batches=5, backend=None):
+    """
+    Pads projections by the largest shift and shifts each image by (sy, sx).
+    """
+    if backend is None:
+        backend = get_backend()
+    pad_x = int(np.ceil(np.max(np.abs(sx))))
+    pad_y = int(np.ceil(np.max(np.abs(sy))))
+    pad = (pad_x, pad_y)
+    new_prj_imgs = pad_projections(projections, pad)
+    return shift_stack(
+        new_prj_imgs,
+        sx,
+        sy,
+        num_batches=num_batches,
+        backend=backend,
+        out=new_prj_imgs,
+    )
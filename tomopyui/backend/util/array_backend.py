@@ -0,0 +1,184 @@
+"""
+Array backends for the alignment loop.
+
+The joint alignment algorithm only needs a handful of array operations: n-dimensional
+FFTs, a few `scipy.ndimage` filters and host/device transfers. Wrapping these in a
+small backend object lets the same algorithm run with cupy on GPU workstations or
+with NumPy/SciPy (multi-threaded through ``workers=``) on CPU-only nodes.
+"""
+
+import os
+import numpy as np
+import scipy.fft
+import scipy.ndimage
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NumpyBackend:
+    """
+    CPU array backend built on NumPy, `scipy.fft` and `scipy.ndimage`.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of threads used for FFTs and for functions mapped over image stacks.
+        Defaults to os.environ["num_cpu_cores"], or to the number of CPUs if that is
+        not set.
+    """
+
+    name = "numpy"
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+        self.workers = max(int(workers), 1)
+        self.xp = np
+        self.fft = scipy.fft
+        self.ndi = scipy.ndimage
+
+    def asarray(self, arr, dtype=np.float32):
+        return np.asarray(arr, dtype=dtype)
+
+    def asnumpy(self, arr):
+        return np.asarray(arr)
+
+    def fftn(self, arr, axes=(-2, -1)):
+        return self.fft.fftn(arr, axes=axes, workers=self.workers)
+
+    def ifftn(self, arr, axes=(-2, -1)):
+        return self.fft.ifftn(arr, axes=axes, workers=self.workers)
+
+    def rfftn(self, arr, axes=(-2, -1)):
+        return self.fft.rfftn(arr, axes=axes, workers=self.workers)
+
+    def irfftn(self, arr, s, axes=(-2, -1)):
+        return self.fft.irfftn(arr, s=s, axes=axes, workers=self.workers)
+
+    def map_chunks(self, func, arr, out=None):
+        """
+        Applies func to chunks of arr along axis 0, using self.workers threads.
+
+        Parameters
+        ----------
+        func : callable
+            Function taking a 3D chunk of arr and returning an array of the same
+            shape. Most `scipy.ndimage` functions release the GIL, so they scale
+            with the number of threads.
+        arr : ndarray
+            3D stack of images.
+        out : ndarray, optional
+            Output array. Can be arr itself to work in place. Defaults to a new
+            array like arr.
+
+        Returns
+        -------
+        out : ndarray
+        """
+        if out is None:
+            out = np.empty_like(arr)
+        num_chunks = min(self.workers, arr.shape[0])
+        if num_chunks <= 1:
+            out[...] = func(arr)
+            return out
+        bounds = np.linspace(0, arr.shape[0], num_chunks + 1).astype(int)
+
+        def _run(i):
+            out[bounds[i] : bounds[i + 1]] = func(arr[bounds[i] : bounds[i + 1]])
+
+        with ThreadPoolExecutor(max_workers=num_chunks) as executor:
+            list(executor.map(_run, range(num_chunks)))
+        return out
+
+    def map_indices(self, func, num):
+        """
+        Calls func(i) for i in range(num), using self.workers threads. Used for
+        per-image operations that cannot be expressed on the whole stack.
+        """
+        if self.workers <= 1 or num <= 1:
+            for i in range(num):
+                func(i)
+            return
+        with ThreadPoolExecutor(max_workers=min(self.workers, num)) as executor:
+            list(executor.map(func, range(num)))
+
+    def free_memory(self):
+        pass
+
+
+class CupyBackend(NumpyBackend):
+    """
+    GPU array backend built on cupy, `cupyx.scipy.fft` and `cupyx.scipy.ndimage`.
+    The workers argument is accepted for compatibility, but is not used.
+    """
+
+    name = "cupy"
+
+    def __init__(self, workers=None):
+        import cupy as cp
+        import cupyx.scipy.fft as cufft
+        from cupyx.scipy import ndimage as ndi_cp
+
+        self.workers = 1
+        self.xp = cp
+        self.fft = cufft
+        self.ndi = ndi_cp
+
+    def asarray(self, arr, dtype=np.float32):
+        return self.xp.asarray(arr, dtype=dtype)
+
+    def asnumpy(self, arr):
+        return self.xp.asnumpy(arr)
+
+    def fftn(self, arr, axes=(-2, -1)):
+        return self.fft.fftn(arr, axes=axes)
+
+    def ifftn(self, arr, axes=(-2, -1)):
+        return self.fft.ifftn(arr, axes=axes)
+
+    def rfftn(self, arr, axes=(-2, -1)):
+        return self.fft.rfftn(arr, axes=axes)
+
+    def irfftn(self, arr, s, axes=(-2, -1)):
+        return self.fft.irfftn(arr, s=s, axes=axes)
+
+    def map_chunks(self, func, arr, out=None):
+        if out is None:
+            return func(arr)
+        out[...] = func(arr)
+        return out
+
+    def map_indices(self, func, num):
+        for i in range(num):
+            func(i)
+
+    def free_memory(self):
+        self.xp.get_default_memory_pool().free_all_blocks()
+
+
+array_backends = {
+    "numpy": NumpyBackend,
+    "cupy": CupyBackend,
+}
+
+
+def get_backend(name=None, workers=None):
+    """
+    Returns an array backend instance.
+
+    Parameters
+    ----------
+    name : str, optional
+        One of the keys in array_backends. Defaults to "cupy" if
+        os.environ["cuda_enabled"] is "True", and "numpy" otherwise.
+    workers : int, optional
+        Number of CPU threads (see `NumpyBackend`).
+    """
+    if name is None:
+        name = "cupy" if os.environ.get("cuda_enabled") == "True" else "numpy"
+    if name not in array_backends:
+        raise ValueError(
+            f"Unknown array backend: '{name}'. "
+            f"Choose one of {list(array_backends.keys())}."
+        )
+    return array_backends[name](workers=workers)
@@ -2,13 +2,15 @@
 
 # edited from tomopy v. 1.11
 
-import os.path
+import os
+
+from collections import OrderedDict
+from scipy.stats import linregress
 
 import numpy as np
 
 from tomopy.misc.corr import circ_mask
 from tomopy.recon.algorithm import recon as recon_tomo
-import tomopy.util.dtype as dtype
 
 # includes astra_cuda_recon_algorithm_kwargs, tomopy_recon_algorithm_kwargs,
 # and tomopy_filter_names, extend_description_style
@@ -29,51 +31,430 @@ def write_center(
 ):
     if theta is None:
         return None, cen_range
+    return CenterSweep(max_sinograms=0).sweep(
+        tomo,
+        theta,
+        cen_range=cen_range,
+        ind=ind,
+        num_iter=num_iter,
+        mask=mask,
+        ratio=ratio,
+        algorithm=algorithm,
+        sinogram_order=sinogram_order,
+        filter_name=filter_name,
+    )
 
-    tomo = dtype.as_float32(tomo)
-    theta = dtype.as_float32(theta)
 
-    dt, dy, dx = tomo.shape
-    if ind is None:
-        ind = dy // 2
-    if cen_range is None:
-        center = np.arange(dx / 2 - 5, dx / 2 + 5, 0.5)
+def _reconstruct_centers(sinos, theta, centers, algorithm, num_iter, filter_name):
+    """
+    Reconstructs each sinogram in sinos (angles, columns) at the center with the
+    same index. They are reconstructed as separate slices of one tomopy call,
+    so they are spread over os.environ["num_cpu_cores"] cores.
+    """
+    stack = np.empty((len(centers),) + sinos[0].shape, dtype=np.float32)
+    for i, sino in enumerate(sinos):
+        stack[i] = sino
+    ncore = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+    os.environ["TOMOPY_PYTHON_THREADS"] = str(ncore)
+    kwargs = {}
+    if algorithm == "gridrec" or algorithm == "fbp":
+        kwargs["filter_name"] = filter_name
     else:
-        center = np.arange(*cen_range)
+        kwargs["num_iter"] = num_iter
+    return recon_tomo(
+        stack,
+        theta,
+        center=np.asarray(centers, dtype=np.float32),
+        sinogram_order=True,
+        algorithm=algorithm,
+        ncore=min(ncore, len(centers)),
+        nchunk=max(int(np.ceil(len(centers) / ncore)), 1),
+        **kwargs,
+    )
+
+
+class CenterSweep:
+    """
+    Reconstructs slices at a range of centers of rotation. The sinogram of each
+    (dataset, pyramid level, slice) is only read once, and reconstructions are
+    kept, so changing the search range or step only reconstructs the centers
+    that were not done yet.
+
+    Parameters
+    ----------
+    max_sinograms : int, optional
+        Number of sinograms to keep. 0 turns off caching.
+    max_recs_mb : float, optional
+        Reconstructions of the least recently used slices are dropped when the
+        kept reconstructions take more than this.
+    """
+
+    def __init__(self, max_sinograms=8, max_recs_mb=1024):
+        self.max_sinograms = max_sinograms
+        self.max_recs_mb = max_recs_mb
+        self.sinograms = OrderedDict()
+        self.recs = OrderedDict()
+
+    def clear(self):
+        self.sinograms.clear()
+        self.recs.clear()
 
-    stack = dtype.empty_shared_array((len(center), dt, dx))
+    def sinogram(self, tomo, ind, sinogram_order=False, key=None):
+        """
+        Sinogram ind of tomo as a float32 (angles, columns) array. Only that
+        sinogram is read, so tomo can be an h5py dataset.
+        """
+        if key is not None and key in self.sinograms:
+            self.sinograms.move_to_end(key)
+            return self.sinograms[key]
+        sino = tomo[ind] if sinogram_order else tomo[:, ind, :]
+        sino = np.ascontiguousarray(sino, dtype=np.float32)
+        if key is not None and self.max_sinograms > 0:
+            self.sinograms[key] = sino
+            while len(self.sinograms) > self.max_sinograms:
+                self.sinograms.popitem(last=False)
+        return sino
 
-    for m in range(center.size):
-        if sinogram_order:
-            stack[m] = tomo[ind]
+    def sweep(
+        self,
+        tomo,
+        theta,
+        cen_range=None,
+        ind=None,
+        key=None,
+        num_iter=1,
+        mask=False,
+        ratio=1.0,
+        algorithm="gridrec",
+        sinogram_order=False,
+        filter_name="parzen",
+    ):
+        """
+        Reconstructs slice ind of tomo at each center in np.arange(*cen_range).
+
+        Parameters
+        ----------
+        tomo : ndarray or h5py.Dataset
+            Projections (angles, rows, columns), or sinograms if sinogram_order.
+        theta : array
+            Angles in radians.
+        cen_range : list, optional
+            [start, stop, step] of the centers. Defaults to 5 px around the middle
+            of the images, in steps of 0.5 px.
+        ind : int, optional
+            Slice to reconstruct. Defaults to the middle slice.
+        key : hashable, optional
+            Identifies the dataset and pyramid level of tomo, e.g.
+            (filepath, pyramid_level). Sinograms and reconstructions are only
+            reused for the same key.
+        mask : bool, optional
+            Applies a circular mask with ratio to the reconstructions.
+        algorithm, num_iter, filter_name
+            See `tomopy.recon`.
+
+        Returns
+        -------
+        rec : ndarray
+            Reconstructions, one per center.
+        center : ndarray
+            Centers.
+        """
+        if theta is None:
+            return None, cen_range
+        dx = tomo.shape[2]
+        if ind is None:
+            ind = tomo.shape[0 if sinogram_order else 1] // 2
+        if cen_range is None:
+            center = np.arange(dx / 2 - 5, dx / 2 + 5, 0.5)
         else:
-            stack[m] = tomo[:, ind, :]
-    os.environ["TOMOPY_PYTHON_THREADS"] = str(os.environ["num_cpu_cores"])
-    # Reconstruct the same slice with a range of centers.
-    if algorithm == "gridrec" or algorithm == "fbp":
-        rec = recon_tomo(
-            stack,
+            center = np.arange(*cen_range)
+        rec = self.sweep_slices(
+            tomo,
             theta,
-            center=center,
-            sinogram_order=True,
+            {ind: center},
+            key=key,
+            num_iter=num_iter,
             algorithm=algorithm,
+            sinogram_order=sinogram_order,
             filter_name=filter_name,
-            # nchunk=1,
+        )[ind]
+        # Apply circular mask.
+        if mask is True:
+            rec = circ_mask(rec, axis=0, ratio=ratio)
+        return rec, center
+
+    def sweep_slices(
+        self,
+        tomo,
+        theta,
+        centers,
+        key=None,
+        num_iter=1,
+        algorithm="gridrec",
+        sinogram_order=False,
+        filter_name="parzen",
+    ):
+        """
+        Reconstructs several slices, each at its own centers, in one parallel
+        reconstruction.
+
+        Parameters
+        ----------
+        centers : dict
+            {slice index: array of centers}.
+
+        See `sweep` for the other parameters.
+
+        Returns
+        -------
+        recs : dict
+            {slice index: reconstructions, one per center}.
+        """
+        theta = np.asarray(theta, dtype=np.float32)
+        sinos = []
+        todo_sinos = []
+        todo_centers = []
+        todo_keys = []
+        center_keys = {}
+        for ind, _centers in centers.items():
+            sino_key = None if key is None else (key, ind, sinogram_order)
+            sino = self.sinogram(tomo, ind, sinogram_order=sinogram_order, key=sino_key)
+            recs_key = (sino_key, ind, algorithm, filter_name, num_iter)
+            if sino_key is None:
+                self.recs.pop(recs_key, None)
+            recs = self.recs.setdefault(recs_key, {})
+            self.recs.move_to_end(recs_key)
+            center_keys[ind] = (recs_key, [round(float(c), 4) for c in _centers])
+            for c in sorted(set(center_keys[ind][1]) - set(recs)):
+                todo_sinos.append(sino)
+                todo_centers.append(c)
+                todo_keys.append(recs_key)
+        if todo_centers:
+            recs = _reconstruct_centers(
+                todo_sinos, theta, todo_centers, algorithm, num_iter, filter_name
+            )
+            for recs_key, c, rec in zip(todo_keys, todo_centers, recs):
+                self.recs[recs_key][c] = rec
+        result = {
+            ind: np.stack([self.recs[recs_key][c] for c in _center_keys])
+            for ind, (recs_key, _center_keys) in center_keys.items()
+        }
+        if key is None:
+            for recs_key, _ in center_keys.values():
+                self.recs.pop(recs_key, None)
+        self._trim_recs(current=[recs_key for recs_key, _ in center_keys.values()])
+        return result
+
+    def _trim_recs(self, current):
+        def _nbytes():
+            return sum(
+                rec.nbytes for recs in self.recs.values() for rec in recs.values()
+            )
+
+        max_nbytes = self.max_recs_mb * 1024**2
+        for recs_key in list(self.recs):
+            if _nbytes() <= max_nbytes:
+                return
+            if recs_key not in current:
+                del self.recs[recs_key]
+
+
+def _entropy(recs, mask):
+    values = recs[:, mask]
+    lo, hi = np.percentile(values, [0.5, 99.5])
+    scores = []
+    for v in values:
+        hist, _ = np.histogram(v, bins=256, range=(lo, hi))
+        p = hist[hist > 0] / v.size
+        scores.append(-np.sum(p * np.log2(p)))
+    return np.array(scores)
+
+
+def _gradient_energy(recs, mask):
+    gy, gx = np.gradient(recs, axis=(1, 2))
+    return -np.mean((gx**2 + gy**2)[:, mask], axis=1)
+
+
+def _total_variation(recs, mask):
+    # relative to the integral of absolute values, which also drops at the
+    # right center
+    gy, gx = np.gradient(recs, axis=(1, 2))
+    tv = np.sum(np.sqrt(gx**2 + gy**2)[:, mask], axis=1)
+    return tv / np.sum(np.abs(recs[:, mask]), axis=1)
+
+
+# Costs of reconstructions at different centers. The lowest cost is the best
+# center.
+sharpness_metrics = {
+    "entropy": _entropy,
+    "gradient": _gradient_energy,
+    "tv": _total_variation,
+}
+
+
+def score_reconstructions(recs, metric="entropy", ratio=0.9):
+    """
+    Scores reconstructions of one slice at different centers of rotation.
+
+    Parameters
+    ----------
+    recs : ndarray
+        Reconstructions (centers, rows, columns).
+    metric : str, optional
+        "entropy" (histogram entropy), "tv" (total variation over the integral
+        of absolute values) or "gradient" (negative gradient energy). Entropy is
+        the most robust over wide search ranges; tv and gradient energy are
+        only reliable close to the center.
+    ratio : float, optional
+        Only the inside of a circle with this ratio of the image size is scored,
+        which leaves out the corners outside the field of view.
+
+    Returns
+    -------
+    costs : ndarray
+        One per reconstruction. Lower is better.
+    """
+    if metric not in sharpness_metrics:
+        raise ValueError(
+            f"Unknown metric: '{metric}'. "
+            f"Choose one of {list(sharpness_metrics.keys())}."
         )
-    else:
-        rec = recon_tomo(
-            stack,
+    recs = np.asarray(recs, dtype=np.float32)
+    ny, nx = recs.shape[1:]
+    y, x = np.ogrid[:ny, :nx]
+    radius = ratio * min(ny, nx) / 2
+    mask = (y - (ny - 1) / 2) ** 2 + (x - (nx - 1) / 2) ** 2 <= radius**2
+    costs = sharpness_metrics[metric](recs, mask)
+    return np.nan_to_num(costs, nan=np.inf)
+
+
+def _best_center(centers, costs):
+    """
+    Center with the lowest cost, refined between the grid points with a
+    parabola through its neighbors.
+    """
+    i = int(np.argmin(costs))
+    if 0 < i < len(costs) - 1:
+        c0, c1, c2 = costs[i - 1 : i + 2]
+        denominator = c0 - 2 * c1 + c2
+        if denominator > 0:
+            offset = 0.5 * (c0 - c2) / denominator
+            return centers[i] + offset * (centers[i + 1] - centers[i])
+    return centers[i]
+
+
+def _to_level(center, ds_factor):
+    # Pixel j of a level downsampled by ds_factor (by binning) covers full
+    # resolution pixels ds_factor * j to ds_factor * (j + 1) - 1, so its center
+    # is at ds_factor * j + (ds_factor - 1) / 2.
+    return (np.asarray(center) - (ds_factor - 1) / 2) / ds_factor
+
+
+def _from_level(center, ds_factor):
+    return center * ds_factor + (ds_factor - 1) / 2
+
+
+def find_centers_multislice(
+    levels,
+    theta,
+    slices,
+    center_guess,
+    search_range=50,
+    num_centers=21,
+    metric="entropy",
+    algorithm="gridrec",
+    filter_name="parzen",
+    num_iter=1,
+    sweep=None,
+    key=None,
+):
+    """
+    Finds the center of rotation of several slices automatically, going from
+    coarse to fine pyramid levels, and fits a line through them for tilted
+    rotation axes.
+
+    At each level, every slice is reconstructed at num_centers centers around
+    its current estimate, and the center with the lowest cost
+    (`score_reconstructions`) becomes the estimate for the next level. The search
+    range of the next level is two steps of the current one, so only the
+    coarsest level covers the full search_range.
+
+    Parameters
+    ----------
+    levels : list of tuple
+        (projections, ds_factor) from the coarsest to the finest pyramid level,
+        e.g. [(ds_level_1, 4), (ds_level_0, 2), (data, 1)]. Projections can be
+        h5py datasets; only the sinograms of slices are read. Downsampled levels
+        are binned, as built by `PyramidBuilder`.
+    theta : array
+        Angles in radians.
+    slices : list of int
+        Slices to find the center of, in full resolution pixels.
+    center_guess : float
+        Starting center in full resolution pixels.
+    search_range : float, optional
+        Searches center_guess +/- search_range (full resolution pixels) at the
+        coarsest level.
+    num_centers : int, optional
+        Centers reconstructed per slice and level.
+    metric : str, optional
+        See `score_reconstructions`.
+    sweep : `CenterSweep`, optional
+        Keeps the sinograms and reconstructions for later sweeps. Defaults to a
+        new one.
+    key : hashable, optional
+        Identifies the dataset (see `CenterSweep.sweep`).
+
+    Returns
+    -------
+    center_slice_list : list of tuple
+        (center, slice) for each slice, in full resolution pixels.
+    reg : scipy.stats._stats_py.LinregressResult or None
+        Line through the centers (center = reg.slope * slice + reg.intercept),
+        or None for a single slice.
+    """
+    if sweep is None:
+        sweep = CenterSweep()
+    centers = {s: float(center_guess) for s in slices}
+    half_range = float(search_range)
+    for level, (tomo, ds_factor) in enumerate(levels):
+        # Nearby slices can fall in the same downsampled row. They share its
+        # sinogram and are reconstructed at the union of their candidates, but
+        # each slice is scored on its own grid only.
+        slice_inds = {}
+        slice_centers = {}
+        for s in slices:
+            slice_inds[s] = min(int(s / ds_factor), tomo.shape[1] - 1)
+            slice_centers[s] = _to_level(
+                np.linspace(
+                    centers[s] - half_range, centers[s] + half_range, num_centers
+                ),
+                ds_factor,
+            )
+        level_centers = {}
+        for s, ind in slice_inds.items():
+            level_centers.setdefault(ind, []).append(slice_centers[s])
+        level_centers = {
+            ind: np.unique(np.concatenate(grids))
+            for ind, grids in level_centers.items()
+        }
+        recs = sweep.sweep_slices(
+            tomo,
             theta,
-            center=center,
-            sinogram_order=True,
-            algorithm=algorithm,
+            level_centers,
+            key=None if key is None else (key, level, ds_factor),
             num_iter=num_iter,
-            # ncore=None,
-            # nchunk=1,
+            algorithm=algorithm,
+            filter_name=filter_name,
         )
-
-    # Apply circular mask.
-    if mask is True:
-        rec = circ_mask(rec, axis=0)
-
-    return rec, center
+        for s, ind in slice_inds.items():
+            own = np.searchsorted(level_centers[ind], slice_centers[s])
+            costs = score_reconstructions(recs[ind][own], metric=metric)
+            centers[s] = _from_level(_best_center(slice_centers[s], costs), ds_factor)
+        step = 2 * half_range / (num_centers - 1)
+        half_range = 2 * step
+    center_slice_list = [(centers[s], s) for s in slices]
+    reg = None
+    if len(slices) > 1:
+        reg = linregress(list(slices), [centers[s] for s in slices])
+    return center_slice_list, reg
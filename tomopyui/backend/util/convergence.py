@@ -0,0 +1,182 @@
+"""
+Early stopping for the joint alignment loop.
+"""
+
+import numpy as np
+
+
+def _rms(err):
+    return float(np.sqrt(np.mean(np.square(err))))
+
+
+class ConvergencePolicy:
+    """
+    Decides when `align_joint` can stop iterating, and which projections still
+    need to be cross-correlated.
+
+    Each criterion is off when its option is None or 0. With every criterion
+    off, the alignment runs for all num_iter iterations, as before.
+
+    Parameters
+    ----------
+    tol : float, optional
+        Stop once the root-mean-square shift of the projections that are not
+        frozen (px, on the aligned pyramid level) falls below tol.
+    rel_tol : float, optional
+        Stop once the shift norm falls below rel_tol times the shift norm of the
+        first iteration.
+    plateau_window : int, optional
+        Stop once the shift norm has changed by less than plateau_tol (relative
+        to its largest value) over the last plateau_window iterations.
+    plateau_tol : float, optional
+        See plateau_window.
+    freeze_tol : float, optional
+        Freeze projections whose shift stays below freeze_tol (px) for
+        freeze_window consecutive iterations. Frozen projections are still
+        reconstructed, but are no longer cross-correlated or shifted. Stops once
+        all projections are frozen.
+    freeze_window : int, optional
+        See freeze_tol.
+    min_iter : int, optional
+        Never stop before this many iterations.
+
+    Attributes
+    ----------
+    stop_reason : str
+        One of stop_reasons. "num_iter" if the alignment ran for all of its
+        iterations.
+    active : ndarray
+        Boolean mask of the projections that are not frozen.
+    conv : list
+        Shift norm of every iteration so far.
+    """
+
+    stop_reasons = ["num_iter", "tol", "rel_tol", "plateau", "frozen"]
+    options = [
+        "tol",
+        "rel_tol",
+        "plateau_window",
+        "plateau_tol",
+        "freeze_tol",
+        "freeze_window",
+        "min_iter",
+    ]
+    plateau_tol = 0.01
+    freeze_window = 2
+    min_iter = 1
+
+    def __init__(
+        self,
+        tol=None,
+        rel_tol=None,
+        plateau_window=None,
+        plateau_tol=None,
+        freeze_tol=None,
+        freeze_window=None,
+        min_iter=None,
+    ):
+        self.tol = tol
+        self.rel_tol = rel_tol
+        self.plateau_window = plateau_window
+        if plateau_tol is not None:
+            self.plateau_tol = plateau_tol
+        self.freeze_tol = freeze_tol
+        if freeze_window is not None:
+            self.freeze_window = freeze_window
+        if min_iter is not None:
+            self.min_iter = min_iter
+        self.reset(0)
+
+    @classmethod
+    def from_opts(cls, opts):
+        """
+        Policy from a dictionary of options (e.g. `RunAlign.convergence_opts`).
+        Unknown keys raise a ValueError.
+        """
+        if opts is None:
+            return cls()
+        for key in opts:
+            if key not in cls.options:
+                raise ValueError(
+                    f"Unknown convergence option: '{key}'. "
+                    f"Choose one of {cls.options}."
+                )
+        return cls(**opts)
+
+    def reset(self, num_prj):
+        """
+        Starts a new alignment of num_prj projections.
+        """
+        self.active = np.ones(num_prj, dtype=bool)
+        self._still = np.zeros(num_prj, dtype=int)
+        self.conv = []
+        self.stop_reason = "num_iter"
+
+    def select(self, *arrays):
+        """
+        The active projections of each array (along axis 0). Returns the arrays
+        themselves when nothing is frozen.
+        """
+        if self.active.all():
+            return arrays
+        return tuple(arr[self.active] for arr in arrays)
+
+    def expand(self, shift):
+        """
+        Fills in zero shifts for the frozen projections.
+
+        Parameters
+        ----------
+        shift : ndarray
+            (2, number of active projections) shifts from the cross correlation
+            of the arrays returned by `select`.
+
+        Returns
+        -------
+        shift : ndarray
+            (2, number of projections) shifts.
+        """
+        if self.active.all():
+            return shift
+        full_shift = np.zeros((2, self.active.size), dtype=shift.dtype)
+        full_shift[:, self.active] = shift
+        return full_shift
+
+    def update(self, err):
+        """
+        Records the shift magnitude of each projection in an iteration, freezes
+        converged projections and checks the stopping criteria.
+
+        Parameters
+        ----------
+        err : ndarray
+            Shift magnitude (px) of each projection in this iteration.
+
+        Returns
+        -------
+        stop : bool
+            True if the alignment should stop after this iteration.
+        """
+        err = np.asarray(err)
+        norm = float(np.linalg.norm(err))
+        self.conv.append(norm)
+        # frozen projections were not cross-correlated, so their zero shifts
+        # say nothing about whether the others have converged
+        active_err = err[self.active] if err.size == self.active.size else err
+        if self.freeze_tol:
+            self._still = np.where(err < self.freeze_tol, self._still + 1, 0)
+            self.active &= self._still < self.freeze_window
+        if len(self.conv) < self.min_iter:
+            return False
+        if self.tol and active_err.size and _rms(active_err) < self.tol:
+            self.stop_reason = "tol"
+        elif self.rel_tol and self.conv[0] > 0 and norm < self.rel_tol * self.conv[0]:
+            self.stop_reason = "rel_tol"
+        elif self.plateau_window and len(self.conv) > self.plateau_window:
+            window = self.conv[-self.plateau_window - 1 :]
+            if max(window) - min(window) <= self.plateau_tol * max(window):
+                self.stop_reason = "plateau"
+        if self.stop_reason == "num_iter" and self.freeze_tol:
+            if not self.active.any():
+                self.stop_reason = "frozen"
+        return self.stop_reason != "num_iter"
@@ -2,23 +2,25 @@
 ## uses dask. Pretty disorganized, but it works for my use case. Could be expanded
 ## eventually.
 
-# TODO: currently, spline filter does not work properly - it is also splining the z axis
-# USE multiple 1d splines
+# Filtering and resampling only happen along y and x, one frame at a time (see
+# map_frames), so chunks of projections are independent: no halo along axis 0.
 
 import dask
 import dask.array as da
-import dask_image
 import math
 import numpy as np
 import scipy.ndimage as ndi
-import dask_image.ndfilters
-import dask_image.ndinterp
-import h5py
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from numpy.lib import NumpyVersion
 from scipy import __version__ as scipy_version
 from collections.abc import Iterable
+from tomopyui.backend.util.hdf_layout import to_hdf5
+from tomopyui.backend.util.pyramid import reduce_2x
+from tomopyui.backend.util.stack_stats import stack_statistics
+from tomopyui.backend.util.zarr_store import open_store
 
 
 def pyramid_reduce_gaussian(
@@ -37,28 +39,29 @@ def pyramid_reduce_gaussian(
 ):
 
     """
-    Wrapper for skimage.transform.pyramid_reduce_gaussian.
+    Legacy dask version of the downsampled pyramid. IOBase builds it with
+    `PyramidBuilder` instead, in a single pass over the data.
+
+    Each level is the level above it, Gaussian smoothed along y and x and then
+    averaged over 2x2 blocks, as always. That is the "gaussian" method of
+    `PyramidBuilder` (see `reduce_2x`), which is used here one frame at a time.
 
     Parameters
     ----------
     image: dask.array
         Time series images that you want to reduce into pyramid form.
     downscale: int
-        Factor by which you would like to downscale the image (along "X" and "Y" pixels)
+        Must be 2. Kept for compatibility.
     sigma
-        Gaussian standard deviation. Will apply equally on x and y, but not on the channel
-        axis (which defaults to 0).
-    order: int
-        Found in pyramid_reduce order description.
-    mode: str
-        Check pyramid_reduce for description.
-    cval
-        Defines constant value added to borders.
+        Gaussian standard deviation along y and x. Defaults to 2 / 3.
+    order, mode, cval, preserve_range, channel_axis
+        Not used. Kept for compatibility.
     pyramid_levels: int
         Number of levels to downscale by 2.
     """
     from tomopyui.backend.io import IOBase
 
+    layout = IOBase.hdf_layout
     coarseneds = []
     hists = []
     return_da = True
@@ -66,7 +69,7 @@ def pyramid_reduce_gaussian(
     if h5_filepath is not None:
         compute = False
         return_da = False
-        open_file = h5py.File(h5_filepath, "r+")
+        open_file = open_store(h5_filepath, "r+")
         if IOBase.hdf_key_ds in open_file:
             del open_file[IOBase.hdf_key_ds]
     if io_obj is not None:
@@ -77,6 +80,7 @@ def pyramid_reduce_gaussian(
         image = io_obj.hdf_file[io_obj.hdf_key_norm_proj]
         open_file = io_obj.hdf_file
         h5_filepath = io_obj.filepath
+        layout = io_obj.hdf_layout
 
     if compute:
         return_da = False
@@ -84,52 +88,34 @@ def pyramid_reduce_gaussian(
         image = da.from_array(image, chunks = "auto")
     else:
         image = image.rechunk(chunks="auto")
+    if downscale != 2:
+        raise ValueError("Pyramid levels are downsampled by 2.")
     for i in range(pyramid_levels):
-        pad_on_levels = _check_divisible(image, 2)
-        if pad_on_levels is not None:
-            image = da.pad(image, pad_on_levels)
-        filtered = pyramid_reduce(
+        if min(image.shape[1:]) < 2:
+            break
+        coarsened = map_frames(
             image,
-            downscale=downscale,
-            sigma=sigma,
-            order=order,
-            mode=mode,
-            cval=cval,
-            preserve_range=preserve_range,
-            channel_axis=channel_axis,
+            lambda frame, out: reduce_2x(frame[None], "gaussian", sigma, out[None]),
+            frame_shape=[-(-n // 2) for n in image.shape[1:]],
         )
-
-        if filtered is None:
-            break
-        coarsened = da.coarsen(np.mean, filtered, {0: 1, 1: 2, 2: 2}).astype(np.float32)
-        r = [da.min(coarsened), da.max(coarsened)]
         bins = 200 if coarsened.size > 200 else coarsened.size
-        hist = da.histogram(coarsened, range=r, bins=bins)
-        percentile = da.percentile(coarsened.flatten(), q=(0.5, 99.5))
+        hist, r, percentile, bin_centers = stack_statistics(coarsened, bins=bins)
         downsample_factor = da.from_array(np.power(2, i + 1))
 
         if h5_filepath is not None:
 
             subgrp = IOBase.hdf_key_ds + str(i) + "/"
-            r = da.from_array(r)
-            downsample_factor = downsample_factor
+            # data and its statistics are computed in one pass over the chunks
             savedict = {
                 subgrp + IOBase.hdf_key_data: coarsened,
                 subgrp + IOBase.hdf_key_bin_frequency: hist[0],
                 subgrp + IOBase.hdf_key_bin_edges: hist[1],
+                subgrp + IOBase.hdf_key_bin_centers: bin_centers,
                 subgrp + IOBase.hdf_key_image_range: r,
                 subgrp + IOBase.hdf_key_percentile: percentile,
                 subgrp + IOBase.hdf_key_ds_factor: downsample_factor,
             }
-            da.to_hdf5(h5_filepath, savedict)
-            bin_edges = da.from_array(open_file[subgrp + IOBase.hdf_key_bin_edges])
-            bin_centers = da.from_array(
-                [
-                    (bin_edges[i] + bin_edges[i + 1]) / 2
-                    for i in range(len(bin_edges) - 1)
-                ]
-            )
-            da.to_hdf5(h5_filepath, subgrp + IOBase.hdf_key_bin_centers, bin_centers)
+            to_hdf5(h5_filepath, savedict, layout=layout)
             image = da.from_array(open_file[subgrp + IOBase.hdf_key_data])
         else:
             coarseneds.append(coarsened)
@@ -137,7 +123,7 @@ def pyramid_reduce_gaussian(
     open_file.close()
 
     if compute:
-        computed_coarseneds = [coarsened.compute() for coarsened in coarsened]
+        computed_coarseneds = [coarsened.compute() for coarsened in coarseneds]
         computed_hists = [hist.compute() for hist in hists]
         return computed_coarseneds, computed_hists
     elif return_da:
@@ -200,23 +186,62 @@ def pyramid_reduce(
         return filtered
 
 
-def _check_divisible(arr, factor):
-    shape = arr.shape
-    shape_mod = [dim % 2 for dim in shape]
-    if any(x != 0 for x in shape_mod):
-        pad = [0 if mod == 0 else 1 for mod in shape_mod]
-        pad[0] = 0
-        pad = [(0, p) for p in pad]
-        return pad
-    else:
-        return None
-
-
 def _check_factor(factor):
     if factor <= 1:
         raise ValueError("scale factor must be greater than 1")
 
 
+def map_frames(image, func, frame_shape=None, dtype=np.float32, workers=None):
+    """
+    Applies func to each 2D frame (along axis 0) of a dask array.
+
+    Chunks span whole frames and are processed independently (no overlap along
+    axis 0), each one by workers threads over its frames.
+
+    Parameters
+    ----------
+    image : dask.array
+        (frames, rows, cols) images.
+    func : callable
+        func(frame, out) writes the result for one frame into out.
+    frame_shape : tuple, optional
+        Shape of the result for one frame. Defaults to the input frame shape.
+    dtype : optional
+        Result dtype.
+    workers : int, optional
+        Threads per chunk. Defaults to the num_cpu_cores environment variable,
+        or all cores.
+
+    Returns
+    -------
+    result : dask.array
+    """
+    if workers is None:
+        workers = int(os.environ.get("num_cpu_cores", os.cpu_count() or 1))
+    if frame_shape is None:
+        frame_shape = image.shape[1:]
+    frame_shape = tuple(int(n) for n in frame_shape)
+    image = image.rechunk({0: "auto", 1: -1, 2: -1})
+
+    def process_chunk(chunk):
+        out = np.empty((chunk.shape[0],) + frame_shape, dtype=dtype)
+
+        def process_frame(i):
+            func(chunk[i], out[i])
+
+        num_workers = min(workers, chunk.shape[0])
+        if num_workers <= 1:
+            for i in range(chunk.shape[0]):
+                process_frame(i)
+        else:
+            with ThreadPoolExecutor(max_workers=num_workers) as ex:
+                list(ex.map(process_frame, range(chunk.shape[0])))
+        return out
+
+    chunks = (image.chunks[0], (frame_shape[0],), (frame_shape[1],))
+    return image.map_blocks(process_chunk, chunks=chunks, dtype=dtype)
+
+
 def _smooth(image, sigma, mode, cval, channel_axis):
     """Return image with each channel smoothed by the Gaussian filter."""
     # apply Gaussian filter to all channels independently
@@ -231,14 +256,26 @@ def _smooth(image, sigma, mode, cval, channel_axis):
 
 
 def gaussian(image, sigma=1, mode="nearest", cval=0.0, truncate=4.0, channel_axis=0):
-    if channel_axis is not None:
-        # do not filter across channels
-        if len(sigma) == image.ndim - 1:
-            sigma = list(sigma)
-            sigma.insert(channel_axis % image.ndim, 0)
-    return dask_image.ndfilters.gaussian_filter(
-        image, sigma, mode=mode, cval=cval, truncate=truncate
-    )
+    """
+    Gaussian filter along y and x of each frame, as two 1D filters.
+    """
+    if np.isscalar(sigma):
+        sigma = (sigma,) * (image.ndim - 1)
+    if len(sigma) == image.ndim:
+        # frames are never filtered together
+        sigma = [s for ax, s in enumerate(sigma) if ax != 0]
+    sigma_y, sigma_x = sigma
+
+    def filter_frame(frame, out):
+        ndi.gaussian_filter1d(
+            frame, sigma_y, axis=0, output=out, mode=mode, cval=cval, truncate=truncate
+        )
+        ndi.gaussian_filter1d(
+            out, sigma_x, axis=1, output=out, mode=mode, cval=cval, truncate=truncate
+        )
+
+    dtype = np.float64 if image.dtype == np.float64 else np.float32
+    return map_frames(image, filter_frame, dtype=dtype)
 
 
 def resize(
@@ -328,17 +365,35 @@ def _fix_ndimage_mode(mode):
 def zoom(
     input, zoom, order=3, mode="constant", cval=0.0, prefilter=True, grid_mode=False
 ):
+    """
+    Spline resampling of each frame along y and x, like scipy.ndimage.zoom on
+    each frame (the zoom along axis 0 must be 1).
+    """
     if order < 0 or order > 5:
         raise RuntimeError("spline order not supported")
     if input.ndim < 1:
         raise RuntimeError("input and output rank must be > 0")
     zoom = _normalize_sequence(zoom, input.ndim)
+    if zoom[0] != 1:
+        raise ValueError("Frames can only be zoomed along y and x.")
     output_shape = tuple([int(round(ii * jj)) for ii, jj in zip(input.shape, zoom)])
-    if prefilter and order > 1:
-        padded, npad = _prepad_for_spline_filter(input, mode, cval)
-        filtered = dask_image.ndinterp.spline_filter1d(padded, order, axis=1, mode=mode)
-        filtered = dask_image.ndinterp.spline_filter1d(padded, order, axis=2, mode=mode)
-    return filtered
+    if any(n < 1 for n in output_shape):
+        raise ValueError("Zoomed frames would be empty.")
+
+    def zoom_frame(frame, out):
+        # the spline prefilter is applied along y, then x, of this frame only
+        ndi.zoom(
+            frame,
+            zoom[1:],
+            output=out,
+            order=order,
+            mode=mode,
+            cval=cval,
+            prefilter=prefilter,
+            grid_mode=grid_mode,
+        )
+
+    return map_frames(input, zoom_frame, frame_shape=output_shape[1:])
 
 
 def _normalize_sequence(input, rank):
@@ -355,18 +410,3 @@ def _normalize_sequence(input, rank):
     else:
         normalized = [input] * rank
     return normalized
-
-
-def _prepad_for_spline_filter(input, mode, cval):
-    if mode in ["nearest", "grid-constant"]:
-        npad = 12
-    if mode == "grid-constant":
-        padded = da.pad(input, npad, mode="constant", constant_values=cval)
-    elif mode == "nearest":
-        padded = da.pad(input, npad, mode="edge")
-    else:
-        # other modes have exact boundary conditions implemented so
-        # no prepadding is needed
-        npad = 0
-        padded = input
-    return padded, npad
@@ -69,6 +69,7 @@ import tifffile
 import scipy.misc as sm
 import pandas as pd
 from itertools import cycle
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import StringIO
 
 __author__ = "Doga Gursoy, Francesco De Carlo"
@@ -89,6 +90,8 @@ __all__ = [
     "read_xrm_stack",
     "read_aps_1id_metafile",
     "read_txrm",
+    "read_xrms_parallel",
+    "read_txrm_parallel",
     "read_hdf5_stack",
     "read_file_list",
 ]
@@ -236,7 +239,7 @@ def read_xrm(fname, slice_range=None):
     data_type = data_type.newbyteorder("<")
 
     arr = np.reshape(
-        np.fromstring(data, data_type),
+        np.frombuffer(data, data_type),
         (metadata["image_width"], metadata["image_height"]),
     )[slice_range]
 
@@ -477,6 +480,137 @@ def read_txrm(file_name, slice_range=None):
     return array_of_images, metadata
 
 
+def read_xrms_parallel(
+    fnames, out=None, metadata="first", num_workers=None, progress=None
+):
+    """
+    Read a list of .xrm files with the same image size and data type in parallel.
+
+    Image streams are read straight from the files into the output array,
+    without going through olefile's in-memory stream copies.
+
+    Parameters
+    ----------
+    fnames : list of str
+        Paths of the .xrm files, in the order they should be stacked.
+    out : ndarray, optional
+        Preallocated output array of shape (len(fnames), image_width,
+        image_height), the same layout as `read_xrm`.
+    metadata : str, optional
+        "first" (default) parses the full metadata of the first file only. The
+        other files get a copy of it with their own angles and positions.
+        "all" parses the full metadata of every file.
+    num_workers : int, optional
+        Number of reader threads. Defaults to the ThreadPoolExecutor default.
+    progress : callable, optional
+        Called with the number of newly read files, e.g. progress(1).
+
+    Returns
+    -------
+    ndarray
+        Output 3D image stack.
+
+    list of dict
+        Metadata for each file.
+    """
+    fnames = [_check_read(fname) for fname in fnames]
+    ole = olefile.OleFileIO(fnames[0])
+    first_metadata = read_ole_metadata(ole)
+    ole.close()
+    data_type = _get_ole_data_type(first_metadata).newbyteorder("<")
+    shape = (first_metadata["image_width"], first_metadata["image_height"])
+    if out is None:
+        out = np.empty((len(fnames),) + shape, dtype=data_type)
+    metadatas = [None] * len(fnames)
+
+    def _read_one(i):
+        ole = olefile.OleFileIO(fnames[i])
+        try:
+            if metadata == "all" or i == 0:
+                metadatas[i] = read_ole_metadata(ole) if i != 0 else first_metadata
+            else:
+                metadatas[i] = dict(first_metadata, **_read_ole_positions(ole))
+            _read_ole_image_into(ole, "ImageData1/Image1", out[i], data_type)
+        finally:
+            ole.close()
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(_read_one, i) for i in range(len(fnames))]
+        for future in as_completed(futures):
+            future.result()
+            if progress is not None:
+                progress(1)
+
+    _log_imported_data(fnames[0], out)
+    return out, metadatas
+
+
+def read_txrm_parallel(file_name, out=None, num_workers=None, progress=None):
+    """
+    Read all images of a .txrm file in parallel.
+
+    Metadata and stream locations are parsed once, then images are read straight
+    from the file into the output array by a pool of threads.
+
+    Parameters
+    ----------
+    file_name : str
+        String defining the path of file or file name.
+    out : ndarray, optional
+        Preallocated output array of shape (number_of_images, image_height,
+        image_width).
+    num_workers : int, optional
+        Number of reader threads. Defaults to the ThreadPoolExecutor default.
+    progress : callable, optional
+        Called with the number of newly read images, e.g. progress(1).
+
+    Returns
+    -------
+    ndarray
+        Array of 2D images.
+
+    dictionary
+        Dictionary of metadata.
+    """
+    file_name = _check_read(file_name)
+    ole = olefile.OleFileIO(file_name)
+    metadata = read_ole_metadata(ole)
+    data_type = _get_ole_data_type(metadata).newbyteorder("<")
+    num_images = metadata["number_of_images"]
+    if out is None:
+        out = np.empty(
+            (num_images, metadata["image_height"], metadata["image_width"]),
+            dtype=data_type,
+        )
+    labels = [
+        "ImageData{}/Image{}".format(int(np.ceil((idx + 1) / 100.0)), int(idx + 1))
+        for idx in range(num_images)
+    ]
+    extents = [_ole_stream_extents(ole, label) for label in labels]
+    if any(extent is None for extent in extents):
+        # images in the ministream (tiny images): read them through olefile
+        for i, label in enumerate(labels):
+            _read_ole_image_into(ole, label, out[i], data_type)
+        ole.close()
+        _log_imported_data(file_name, out)
+        return out, metadata
+    ole.close()
+
+    def _read_one(i):
+        with open(file_name, "rb") as fp:
+            _read_extents(fp, extents[i], out[i])
+
+    with ThreadPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(_read_one, i) for i in range(num_images)]
+        for future in as_completed(futures):
+            future.result()
+            if progress is not None:
+                progress(1)
+
+    _log_imported_data(file_name, out)
+    return out, metadata
+
+
 def read_txm(file_name, slice_range=None):
     """
     Read data from a .txm file, the reconstruction file output
@@ -1192,6 +1326,71 @@ def _read_ole_image(ole, label, metadata, datatype=None):
     return image
 
 
+def _read_ole_positions(ole):
+    """
+    Reads only the angle and stage positions of a single-image xradia OLE file.
+    """
+    positions = {
+        "thetas": _read_ole_arr(ole, "ImageInfo/Angles", "<1f") * np.pi / 180.0,
+        "x_positions": _read_ole_arr(ole, "ImageInfo/XPosition", "<1f"),
+        "y_positions": _read_ole_arr(ole, "ImageInfo/YPosition", "<1f"),
+        "z_positions": _read_ole_arr(ole, "ImageInfo/ZPosition", "<1f"),
+    }
+    return {key: [float(x) for x in value] for key, value in positions.items()}
+
+
+def _ole_stream_extents(ole, label):
+    """
+    Byte ranges [offset, size] of the file that hold the stream, with contiguous
+    sectors merged. Returns None for streams stored in the ministream.
+    """
+    entry = ole.direntries[ole._find(label)]
+    if entry.size < ole.minisectorcutoff:
+        return None
+    extents = []
+    sect = entry.isectStart
+    remaining = entry.size
+    while remaining > 0:
+        offset = ole.sectorsize * (sect + 1)
+        size = min(ole.sectorsize, remaining)
+        if extents and extents[-1][0] + extents[-1][1] == offset:
+            extents[-1][1] += size
+        else:
+            extents.append([offset, size])
+        remaining -= size
+        sect = ole.fat[sect]
+    return extents
+
+
+def _read_extents(fp, extents, out):
+    """
+    Reads the byte ranges of an open file into the contiguous array out.
+    """
+    buffer = memoryview(out).cast("B")
+    if sum(size for _, size in extents) != buffer.nbytes:
+        raise ValueError(
+            "Image stream is %d bytes, expected %d."
+            % (sum(size for _, size in extents), buffer.nbytes)
+        )
+    position = 0
+    for offset, size in extents:
+        fp.seek(offset)
+        fp.readinto(buffer[position : position + size])
+        position += size
+
+
+def _read_ole_image_into(ole, label, out, data_type):
+    """
+    Reads the image stream label of an OLE file into out.
+    """
+    extents = _ole_stream_extents(ole, label)
+    if extents is None:
+        data = ole.openstream(label).read()
+        out[:] = np.frombuffer(data, data_type).reshape(out.shape)
+    else:
+        _read_extents(ole.fp, extents, out)
+
+
 def read_hdf5_stack(h5group, dname, ind, digit=4, slc=None, out_ind=None):
     """
     Read data from stacked datasets in a hdf5 file
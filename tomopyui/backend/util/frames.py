@@ -0,0 +1,211 @@
+"""
+Lazy, cached access to single frames of large image stacks.
+
+The viewers only ever show one projection (or one sinogram row, with axes
+swapped) at a time. `LazyFrames` reads just that frame from the hdf5 file,
+keeps recently viewed frames in an LRU cache, and reads the next frames in a
+background thread while the viewer plays through the stack.
+"""
+
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tomopyui.backend.util.zarr_store import open_store
+
+
+class LazyFrames:
+    """
+    Array-like view of a (frames, rows, cols) stack that reads frames on demand.
+
+    Indexing with an integer returns one frame (cached). Any other index is
+    passed on to the underlying dataset, so crops such as [:, y0:y1, x0:x1]
+    read only that hyperslab.
+
+    Parameters
+    ----------
+    source : pathlib.Path, str or array-like
+        hdf5 file or Zarr store, or anything sliceable with a shape (h5py
+        dataset, zarr array, ndarray).
+    key : str, optional
+        Dataset in the hdf5 file. Required if source is a path.
+    axis : int, optional
+        Axis that frames are taken along: 0 for projections, 1 for sinograms.
+    cache_mb : float, optional
+        Memory for cached frames.
+
+    Notes
+    -----
+    When source is a path, the file is opened read-only for each read and given
+    back right after (see `HDF5FilePool`, which keeps it open in between), so a
+    viewer never keeps the file from being opened for writing.
+    """
+
+    cache_mb = 512
+    # frames read ahead in the direction of travel
+    prefetch_count = 8
+
+    def __init__(self, source, key=None, axis=0, cache_mb=None):
+        self._path = None
+        if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+            if key is None:
+                raise ValueError("A dataset key is needed to read frames from a file.")
+            self._path = source
+            source = None
+        self._source = source
+        self.key = key
+        if self._path is not None:
+            # KeyError now, rather than on the first read, if there is no such
+            # dataset
+            self._get(lambda source: None)
+        self.axis = axis
+        if cache_mb is not None:
+            self.cache_mb = cache_mb
+        self._cache = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get(self, func):
+        """
+        func(dataset), with the file borrowed only for as long as it runs.
+        """
+        if self._path is None:
+            return func(self._source)
+        with open_store(self._path, "r") as f:
+            return func(f[self.key])
+
+    def _slice(self, index):
+        return self._get(lambda source: source[index])
+
+    @property
+    def shape(self):
+        shape = self._get(lambda source: tuple(source.shape))
+        if self.axis == 1:
+            shape = (shape[1], shape[0], shape[2])
+        return shape
+
+    @property
+    def dtype(self):
+        return self._get(lambda source: source.dtype)
+
+    @property
+    def ndim(self):
+        return 3
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * np.dtype(self.dtype).itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _max_cached(self):
+        frame_mb = np.prod(self.shape[1:]) * np.dtype(self.dtype).itemsize / 1024**2
+        return max(int(self.cache_mb // max(frame_mb, 1e-9)), 1)
+
+    def _read(self, index):
+        if self.axis == 1:
+            return np.asarray(self._slice(np.s_[:, index, :]))
+        return np.asarray(self._slice(index))
+
+    def frame(self, index):
+        """
+        Frame index, from the cache if it is there.
+        """
+        index = int(index)
+        if index < 0:
+            index += len(self)
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+        frame = self._read(index)
+        self._store(index, frame)
+        return frame
+
+    def _store(self, index, frame):
+        with self._lock:
+            self._cache[index] = frame
+            self._cache.move_to_end(index)
+            while len(self._cache) > self._max_cached():
+                self._cache.popitem(last=False)
+
+    def _prefetch_one(self, index):
+        try:
+            with self._lock:
+                cached = index in self._cache
+            if not cached:
+                self._store(index, self._read(index))
+        finally:
+            with self._lock:
+                self._pending.discard(index)
+
+    def prefetch(self, index, step=1, count=None):
+        """
+        Reads the count frames after index (in steps of step) into the cache in a
+        background thread. Frames already cached or queued are skipped.
+        """
+        if count is None:
+            count = self.prefetch_count
+        count = min(count, self._max_cached() - 1)
+        step = int(np.sign(step)) or 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        for i in range(1, count + 1):
+            _index = (int(index) + i * step) % len(self)
+            with self._lock:
+                if _index in self._cache or _index in self._pending:
+                    continue
+                self._pending.add(_index)
+            self._executor.submit(self._prefetch_one, _index)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.frame(index)
+        if self.axis == 0:
+            return self._slice(index)
+        if not isinstance(index, tuple):
+            index = (index,)
+        index = index + (slice(None),) * (3 - len(index))
+        if isinstance(index[1], slice):
+            if isinstance(index[0], (int, np.integer)):
+                return self._slice((index[1], int(index[0]), index[2]))
+            if isinstance(index[0], slice):
+                return np.swapaxes(self._slice((index[1], index[0], index[2])), 0, 1)
+        return np.asarray(self)[index]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.frame(i)
+
+    def __array__(self, dtype=None):
+        arr = np.asarray(self._slice(np.s_[:]))
+        if self.axis == 1:
+            arr = np.swapaxes(arr, 0, 1)
+        return arr if dtype is None else arr.astype(dtype)
+
+    def swapaxes(self, axis1, axis2):
+        """
+        Frames along the other axis (projections <-> sinograms), sharing the
+        source. Only swapping axes 0 and 1 is supported.
+        """
+        if sorted((axis1, axis2)) != [0, 1]:
+            raise ValueError("Only axes 0 and 1 can be swapped.")
+        source = self._source if self._path is None else self._path
+        return LazyFrames(source, self.key, 1 - self.axis, self.cache_mb)
+
+    def close(self):
+        """
+        Stops prefetching and empties the cache.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,217 @@
+"""
+Chunking and compression policy for image stacks written to HDF5 (or Zarr).
+"""
+
+import warnings
+import dask.array as da
+import numpy as np
+
+from tomopyui.backend.util.zarr_store import ZarrGroup, open_store, zarr_compressors
+
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+class HDF5Layout:
+    """
+    Decides how 3D image stacks (projections or reconstructions, shaped like
+    (angles, rows, cols)) are chunked and compressed when written to HDF5.
+
+    Parameters
+    ----------
+    chunking : str, optional
+        "projection" : one chunk per image (1, rows, cols). Fastest for the
+            viewers and the alignment, which read whole projections.
+        "sinogram" : one chunk per detector row (angles, 1, cols). Fastest for
+            reconstruction, which reads a few rows of every projection.
+        "auto" (default) : (n, n, cols) chunks of about chunk_mb, so that
+            reading either a projection or a sinogram only reads a few extra
+            rows/projections.
+        "dask" : use the chunks of the dask array being written (old behavior).
+    compression : str or None, optional
+        None (default), "gzip", "lzf", "blosc" or "zstd". "blosc" and "zstd" need
+        hdf5plugin, and fall back to "gzip" if it is not installed.
+    compression_opts : int, optional
+        Compression level for "gzip" (0-9, default 4), "blosc" (0-9, default 5)
+        or "zstd" (1-22, default 3).
+    shuffle : bool, optional
+        Byte-shuffle filter before compression. Helps a lot with floating point
+        data. Defaults to True when compressing.
+    chunk_mb : float, optional
+        Target chunk size in MB for "auto" chunking.
+    """
+
+    chunking_options = ["auto", "projection", "sinogram", "dask"]
+    compression_options = [None, "gzip", "lzf", "blosc", "zstd"]
+
+    def __init__(
+        self,
+        chunking="auto",
+        compression=None,
+        compression_opts=None,
+        shuffle=None,
+        chunk_mb=1.0,
+    ):
+        if chunking not in self.chunking_options:
+            raise ValueError(
+                f"Unknown chunking: '{chunking}'. "
+                f"Choose one of {self.chunking_options}."
+            )
+        if compression not in self.compression_options:
+            raise ValueError(
+                f"Unknown compression: '{compression}'. "
+                f"Choose one of {self.compression_options}."
+            )
+        if compression in ("blosc", "zstd") and hdf5plugin is None:
+            warnings.warn(
+                f"hdf5plugin is not installed, so '{compression}' compression is "
+                "not available. Using 'gzip' instead."
+            )
+            compression = "gzip"
+            compression_opts = None
+        self.chunking = chunking
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = compression is not None if shuffle is None else shuffle
+        self.chunk_mb = chunk_mb
+
+    def chunks(self, shape, dtype):
+        """
+        HDF5 chunk shape for a 3D dataset, or None for "dask" chunking.
+        """
+        num_angles, num_rows, num_cols = shape
+        if self.chunking == "dask":
+            return None
+        if self.chunking == "projection":
+            return (1, num_rows, num_cols)
+        if self.chunking == "sinogram":
+            return (num_angles, 1, num_cols)
+        row_nbytes = num_cols * np.dtype(dtype).itemsize
+        n = int(np.sqrt(max(self.chunk_mb * 1024**2 / row_nbytes, 1)))
+        return (min(n, num_angles), min(n, num_rows), num_cols)
+
+    def dask_chunks(self, shape, dtype, target_mb=128):
+        """
+        Chunks for the dask array being written, so that each dask chunk covers
+        whole HDF5 chunks (no partially written chunks, which would have to be
+        read back and recompressed) and is about target_mb.
+        """
+        chunks = self.chunks(shape, dtype)
+        if chunks is None:
+            return None
+        chunks = list(chunks)
+        itemsize = np.dtype(dtype).itemsize
+        for axis in range(3):
+            while (
+                chunks[axis] < shape[axis]
+                and 2 * np.prod(chunks) * itemsize <= target_mb * 1024**2
+            ):
+                chunks[axis] = min(2 * chunks[axis], shape[axis])
+        return tuple(chunks)
+
+    def dataset_kwargs(self, shape, dtype):
+        """
+        Keyword arguments for h5py's create_dataset for a 3D dataset.
+        """
+        kwargs = {}
+        chunks = self.chunks(shape, dtype)
+        if chunks is not None:
+            kwargs["chunks"] = chunks
+        if self.compression is None:
+            return kwargs
+        if self.compression == "blosc":
+            clevel = 5 if self.compression_opts is None else self.compression_opts
+            shuffle = hdf5plugin.Blosc.SHUFFLE if self.shuffle else 0
+            kwargs.update(
+                hdf5plugin.Blosc(cname="zstd", clevel=clevel, shuffle=shuffle)
+            )
+        elif self.compression == "zstd":
+            clevel = 3 if self.compression_opts is None else self.compression_opts
+            kwargs.update(hdf5plugin.Zstd(clevel=clevel))
+            kwargs["shuffle"] = self.shuffle
+        else:
+            kwargs["compression"] = self.compression
+            if self.compression == "gzip":
+                kwargs["compression_opts"] = (
+                    4 if self.compression_opts is None else self.compression_opts
+                )
+            kwargs["shuffle"] = self.shuffle
+        if "chunks" not in kwargs:
+            # compressed datasets must be chunked
+            kwargs["chunks"] = True
+        return kwargs
+
+    def zarr_kwargs(self, shape, dtype):
+        """
+        Keyword arguments for `ZarrGroup.create_dataset` for a 3D dataset: the
+        same chunks, and the same compression as a zarr codec.
+        """
+        kwargs = {}
+        chunks = self.chunks(shape, dtype)
+        if chunks is not None:
+            kwargs["chunks"] = chunks
+        kwargs["compressors"] = zarr_compressors(
+            self.compression, self.compression_opts, self.shuffle
+        )
+        return kwargs
+
+    def store_kwargs(self, f, shape, dtype):
+        """
+        `dataset_kwargs` or `zarr_kwargs`, for the kind of file f is.
+        """
+        if isinstance(f, ZarrGroup):
+            return self.zarr_kwargs(shape, dtype)
+        return self.dataset_kwargs(shape, dtype)
+
+    def to_dict(self):
+        return {
+            "chunking": self.chunking,
+            "compression": self.compression,
+            "compression_opts": self.compression_opts,
+            "shuffle": self.shuffle,
+            "chunk_mb": self.chunk_mb,
+        }
+
+
+def to_hdf5(filepath, data_dict, layout=None):
+    """
+    Stores arrays in an HDF5 file, like `dask.array.to_hdf5`, but 3D arrays are
+    chunked and compressed according to layout. All arrays are computed
+    together, so shared dask graphs (e.g. data and its histogram) are only
+    computed once.
+
+    Parameters
+    ----------
+    filepath : pathlib.Path or str
+        HDF5 file or Zarr store (see `open_store`). Opened in append mode.
+    data_dict : dict
+        Dictionary like {"/path/to/data": dask array}.
+    layout : `HDF5Layout`, optional
+        Defaults to HDF5Layout().
+    """
+    if layout is None:
+        layout = HDF5Layout()
+    with open_store(filepath, mode="a") as f:
+        sources = []
+        dsets = []
+        for key, arr in data_dict.items():
+            if not isinstance(arr, da.Array):
+                arr = da.from_array(arr)
+            if arr.ndim == 3:
+                kwargs = layout.store_kwargs(f, arr.shape, arr.dtype)
+                dask_chunks = layout.dask_chunks(arr.shape, arr.dtype)
+                if dask_chunks is not None:
+                    arr = arr.rechunk(dask_chunks)
+            else:
+                kwargs = {}
+            if "chunks" not in kwargs or kwargs["chunks"] is True:
+                if arr.ndim > 0:
+                    kwargs["chunks"] = tuple(c[0] for c in arr.chunks)
+            dsets.append(
+                f.require_dataset(key, shape=arr.shape, dtype=arr.dtype, **kwargs)
+            )
+            sources.append(arr)
+        # zarr chunks are separate files, so they can be written concurrently
+        da.store(sources, dsets, lock=not isinstance(f, ZarrGroup))
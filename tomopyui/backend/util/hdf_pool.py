@@ -0,0 +1,290 @@
+"""
+Shared, persistent handles to HDF5 files.
+
+Opening a large HDF5 file on a parallel filesystem is slow, and closing it
+throws away h5py's chunk cache. `HDF5FilePool` keeps one h5py.File per path,
+shared by everyone who opens that path. Files open read-only stay open after the
+last user is done (up to max_idle files), so the next open is free and finds its
+chunks cached. Files open for writing are closed as soon as nobody uses them:
+HDF5 locks a file for as long as it is open for writing, so no other process
+(batch runs, multi-energy workers, external viewers) could even read it.
+`open_store` opens HDF5 files through the module-level hdf_pool.
+
+Callers get a `PooledFile`, which behaves like the h5py.File, except that
+closing it only gives it back to the pool. Datasets taken from it stay valid
+while they are held: the pool never closes or reopens a file that is in use.
+"""
+
+import pathlib
+import threading
+import h5py
+
+from collections import OrderedDict
+from h5py import h5f
+
+_writable_modes = ["r+", "a", "w", "w-", "x"]
+# datasets, groups, attributes, ... that hold the file open
+_object_types = h5f.OBJ_ALL & ~h5f.OBJ_FILE
+
+
+class _PoolEntry:
+    def __init__(self, file, writable, filepath):
+        self.file = file
+        self.writable = writable
+        self.filepath = filepath
+        self.refs = 0
+        # users that opened the file for writing
+        self.writers = 0
+
+    def in_use(self):
+        """
+        Whether the file is borrowed, or a dataset, group or attribute taken
+        from it is still held. Closing or reopening the file would invalidate
+        them.
+        """
+        if self.refs > 0:
+            return True
+        return bool(self.file) and h5f.get_obj_count(self.file.id, _object_types) > 0
+
+
+class PooledFile:
+    """
+    An h5py.File borrowed from a `HDF5FilePool`. Attribute access, indexing,
+    `in`, `del` and iteration go to the file. `close` (or leaving a with block)
+    gives it back to the pool; after that it evaluates to False, like a closed
+    h5py.File.
+    """
+
+    def __init__(self, pool, key, entry, writer=False):
+        self._pool = pool
+        self._key = key
+        self._entry = entry
+        self._writer = writer
+
+    @property
+    def file(self):
+        if self._entry is None:
+            raise ValueError("File is closed.")
+        return self._entry.file
+
+    def __bool__(self):
+        return self._entry is not None and bool(self._entry.file)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def __getitem__(self, key):
+        return self.file[key]
+
+    def __setitem__(self, key, value):
+        self.file[key] = value
+
+    def __delitem__(self, key):
+        del self.file[key]
+
+    def __contains__(self, key):
+        return key in self.file
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __len__(self):
+        return len(self.file)
+
+    def close(self):
+        if self._entry is not None:
+            self._pool._release(self._key, self._entry, self._writer)
+            self._entry = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class HDF5FilePool:
+    """
+    Thread-safe pool of open HDF5 files, one per path, with reference counting.
+
+    A file opened for reading is shared with later readers, and kept open when
+    the last of them is done. A file opened for writing ("r+", "a") is shared
+    with later readers and writers, and closed as soon as it is no longer in
+    use, because HDF5 keeps it locked for other processes as long as it is open
+    for writing.
+
+    The h5py.File of a path is never closed or reopened while it is in use:
+    while it is borrowed, or while a dataset (group, attribute) taken from it is
+    held, since that would invalidate them. So a file written and then read
+    stays open for writing until the readers are done, and a file open
+    read-only can only be opened for writing once nothing uses it (an OSError
+    is raised otherwise). "w" always truncates, so it closes the file for
+    everyone.
+
+    Parameters
+    ----------
+    rdcc_nbytes : int, optional
+        Size of h5py's raw data chunk cache of each file, in bytes.
+    rdcc_nslots : int, optional
+        Number of chunk slots of the cache. A prime about 100 times the number
+        of chunks that fit in the cache works best.
+    rdcc_w0 : float, optional
+        Chunk cache preemption policy (0 to 1).
+    swmr : bool, optional
+        Open files for reading in single-writer/multiple-reader mode, so they can
+        be read while another process appends to them. Only works on files
+        written with libver="latest"; other files are opened normally.
+    max_idle : int, optional
+        Number of read-only files that nobody uses that are kept open.
+    """
+
+    rdcc_nbytes = 256 * 1024**2
+    rdcc_nslots = 10007
+    rdcc_w0 = 0.75
+    swmr = False
+    max_idle = 16
+
+    def __init__(
+        self,
+        rdcc_nbytes=None,
+        rdcc_nslots=None,
+        rdcc_w0=None,
+        swmr=None,
+        max_idle=None,
+    ):
+        if rdcc_nbytes is not None:
+            self.rdcc_nbytes = rdcc_nbytes
+        if rdcc_nslots is not None:
+            self.rdcc_nslots = rdcc_nslots
+        if rdcc_w0 is not None:
+            self.rdcc_w0 = rdcc_w0
+        if swmr is not None:
+            self.swmr = swmr
+        if max_idle is not None:
+            self.max_idle = max_idle
+        self._entries = {}
+        self._idle = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _path_key(filepath):
+        return str(pathlib.Path(filepath).resolve())
+
+    def _h5py_open(self, filepath, mode):
+        kwargs = {
+            "rdcc_nbytes": self.rdcc_nbytes,
+            "rdcc_nslots": self.rdcc_nslots,
+            "rdcc_w0": self.rdcc_w0,
+        }
+        if mode == "r" and self.swmr:
+            try:
+                return h5py.File(filepath, mode, swmr=True, **kwargs)
+            except (OSError, ValueError):
+                pass
+        return h5py.File(filepath, mode, **kwargs)
+
+    def open(self, filepath, mode="r"):
+        """
+        Borrows the file at filepath, opening it if needed.
+
+        Parameters
+        ----------
+        filepath : pathlib.Path or str
+        mode : str, optional
+            "r", "r+", "a", "w", "w-" or "x", as for h5py.File.
+
+        Returns
+        -------
+        file : `PooledFile`
+            Close it to give it back.
+        """
+        writable = mode in _writable_modes
+        key = self._path_key(filepath)
+        with self._lock:
+            self._close_unused_writable()
+            entry = self._entries.get(key)
+            if entry is not None and not entry.file:
+                # closed behind the pool's back
+                self._drop(key)
+                entry = None
+            if entry is not None and mode in ("w", "x", "w-"):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                entry = _PoolEntry(self._h5py_open(filepath, mode), writable, filepath)
+                self._entries[key] = entry
+            elif writable and not entry.writable:
+                # the same file can not be open read-only and writable at once
+                if entry.in_use():
+                    raise OSError(
+                        f"{filepath} is open read-only and in use. Close it, and "
+                        "drop the datasets taken from it, before writing to it."
+                    )
+                entry.file.close()
+                entry.file = self._h5py_open(filepath, "a" if mode == "a" else "r+")
+                entry.writable = True
+            entry.refs += 1
+            entry.writers += writable
+            self._idle.pop(key, None)
+            return PooledFile(self, key, entry, writable)
+
+    def _release(self, key, entry, writer=False):
+        with self._lock:
+            entry.refs -= 1
+            entry.writers -= writer
+            self._close_unused_writable()
+            if self._entries.get(key) is not entry or entry.writable:
+                return
+            if entry.refs > 0:
+                return
+            self._idle[key] = entry
+            for old_key in list(self._idle):
+                if len(self._idle) <= self.max_idle:
+                    break
+                if not self._idle[old_key].in_use():
+                    self._drop(old_key)
+
+    def _close_unused_writable(self):
+        # Closing releases HDF5's write lock, so other processes can open the
+        # file. Datasets held after the last user was done keep it open until
+        # they are dropped, so this is checked again on every open and release.
+        for key, entry in list(self._entries.items()):
+            if entry.writable and not entry.in_use():
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        self._idle.pop(key, None)
+        if entry is not None and entry.file:
+            entry.file.close()
+
+    def close(self, filepath):
+        """
+        Closes the file at filepath for everyone, e.g. before it is deleted or
+        written by another library.
+        """
+        with self._lock:
+            self._drop(self._path_key(filepath))
+
+    def close_all(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def close_idle(self):
+        """
+        Closes the files that nobody uses.
+        """
+        with self._lock:
+            for key, entry in list(self._idle.items()):
+                if not entry.in_use():
+                    self._drop(key)
+
+
+hdf_pool = HDF5FilePool()
@@ -0,0 +1,366 @@
+"""
+Single-pass dark/flat normalization of raw projection frames.
+
+Raw frames are read once, a chunk of whole projections (all of their exposures)
+at a time. Each chunk is dark-subtracted, divided by its flat, averaged over
+exposures and -log'ed in place, in threads over image rows, and written to the
+output while the next chunk is read (see `run_pipeline`). Nothing is written to
+disk before normalization, and no intermediate stacks are built.
+"""
+
+import os
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from tomopyui.backend.util.pipeline import run_pipeline
+
+flat_modes = ["nearest", "interpolate"]
+
+
+def average_groups(frames, group_size, dtype=np.float32):
+    """
+    Averages consecutive groups of group_size frames, reading one group at a
+    time. A last, incomplete group is averaged over the frames it has.
+
+    Parameters
+    ----------
+    frames : array-like
+        (num_frames, rows, cols) frames. Anything that can be sliced along axis
+        0 (ndarray, h5py dataset).
+    group_size : int
+
+    Returns
+    -------
+    averages : ndarray
+        (ceil(num_frames / group_size), rows, cols)
+    """
+    group_size = max(int(group_size), 1)
+    num_frames = frames.shape[0]
+    num_groups = -(-num_frames // group_size)
+    averages = np.empty((num_groups,) + tuple(frames.shape[1:]), dtype=dtype)
+    for i in range(num_groups):
+        group = np.asarray(frames[i * group_size : (i + 1) * group_size])
+        averages[i] = np.mean(group, axis=0, dtype=np.float64)
+    return averages
+
+
+def nearest_flat_table(num_frames, flat_loc):
+    """
+    Index of the flat to use for each raw projection frame.
+
+    Each frame is divided by the flat collection closest to it; the boundaries
+    are halfway between two flat collections.
+
+    Parameters
+    ----------
+    num_frames : int
+        Number of raw projection frames.
+    flat_loc : list of int, optional
+        Frame index at which each flat collection was taken, in order. None or a
+        single location means one flat for all frames.
+
+    Returns
+    -------
+    table : ndarray
+        (num_frames,) int array of flat indexes.
+    """
+    if flat_loc is None or len(flat_loc) <= 1:
+        return np.zeros(num_frames, dtype=int)
+    flat_loc = np.asarray(flat_loc, dtype=float)
+    boundaries = np.ceil((flat_loc[:-1] + flat_loc[1:]) / 2)
+    return np.searchsorted(boundaries, np.arange(num_frames), side="right")
+
+
+def flat_index_table(
+    num_frames, flat_loc, mode="nearest", frame_positions=None, flat_positions=None
+):
+    """
+    Flats to divide each raw projection frame by. Frame i is divided by
+    (1 - weights[i]) * flat[lo[i]] + weights[i] * flat[hi[i]] (after dark
+    subtraction).
+
+    Parameters
+    ----------
+    num_frames : int
+        Number of raw projection frames.
+    flat_loc : list of int, optional
+        Frame index at which each flat collection was taken, in order.
+    mode : str, optional
+        One of flat_modes. "nearest" uses the closest flat collection (see
+        `nearest_flat_table`). "interpolate" interpolates linearly between the
+        two flat collections before and after each frame, and uses the first or
+        last one for frames outside of them.
+    frame_positions : array-like, optional
+        Acquisition time (or any other increasing position) of each frame, for
+        "interpolate". Defaults to the frame index.
+    flat_positions : array-like, optional
+        Acquisition time of each flat collection, in the units of
+        frame_positions. Defaults to flat_loc.
+
+    Returns
+    -------
+    lo, hi : ndarray
+        (num_frames,) int arrays of flat indexes.
+    weights : ndarray
+        (num_frames,) float32 weights of the hi flats.
+    """
+    if mode not in flat_modes:
+        raise ValueError(f"Unknown flat mode: '{mode}'. Choose one of {flat_modes}.")
+    weights = np.zeros(num_frames, dtype=np.float32)
+    if mode == "nearest" or flat_loc is None or len(flat_loc) <= 1:
+        lo = nearest_flat_table(num_frames, flat_loc)
+        return lo, lo, weights
+    if frame_positions is None:
+        frame_positions = np.arange(num_frames)
+    if flat_positions is None:
+        flat_positions = flat_loc
+    frame_positions = np.asarray(frame_positions, dtype=float)[:num_frames]
+    flat_positions = np.asarray(flat_positions, dtype=float)
+    if len(frame_positions) < num_frames:
+        raise ValueError(
+            f"Got {len(frame_positions)} frame positions for {num_frames} frames."
+        )
+    hi = np.searchsorted(flat_positions, frame_positions, side="right")
+    hi = np.clip(hi, 1, len(flat_positions) - 1)
+    lo = hi - 1
+    span = flat_positions[hi] - flat_positions[lo]
+    weights[:] = np.clip(
+        np.divide(
+            frame_positions - flat_positions[lo],
+            span,
+            out=np.zeros(num_frames),
+            where=span > 0,
+        ),
+        0,
+        1,
+    )
+    return lo, hi, weights
+
+
+class FlatFieldNormalizer:
+    """
+    Dark/flat normalization of raw projections, with averaging of the exposures
+    of each projection and -log.
+
+    Parameters
+    ----------
+    flats : array-like
+        Raw flat frames (num_flat_frames, rows, cols), in groups of
+        num_exposures_per_flat frames per flat collection.
+    darks : array-like, optional
+        Raw dark frames (num_dark_frames, rows, cols). Their median is used. No
+        dark subtraction if None.
+    flat_loc : list of int, optional
+        Raw projection frame index at which each flat collection was taken
+        (e.g. `RawProjectionsXRM_SSRL62C.flats_ind`). Only needed with more than
+        one flat collection.
+    num_exposures_per_proj : int, optional
+        Number of consecutive raw frames per projection.
+    num_exposures_per_flat : int, optional
+        Number of consecutive raw flat frames per flat collection.
+    flat_mode : str, optional
+        "nearest" or "interpolate", see `flat_index_table`.
+    frame_positions : array-like, optional
+        Acquisition time of each raw projection frame, for flat_mode
+        "interpolate". Defaults to the frame index.
+    flat_positions : array-like, optional
+        Acquisition time of each flat collection. Defaults to flat_loc.
+    workers : int, optional
+        Number of threads. Defaults to os.environ["num_cpu_cores"].
+    chunk_mb : float, optional
+        Size of the raw frames read at a time, as float32.
+
+    Notes
+    -----
+    Each normalized projection is -log(mean((raw - dark) / (flat - dark))) over
+    its exposures, as in `RawProjectionsBase.normalize_and_average`. With
+    flat_mode "interpolate", flat is interpolated between flat collections for
+    each frame, which follows beam drift during the scan more closely.
+    """
+
+    chunk_mb = 256
+
+    def __init__(
+        self,
+        flats,
+        darks=None,
+        flat_loc=None,
+        num_exposures_per_proj=1,
+        num_exposures_per_flat=1,
+        flat_mode="nearest",
+        frame_positions=None,
+        flat_positions=None,
+        workers=None,
+        chunk_mb=None,
+    ):
+        if flat_mode not in flat_modes:
+            raise ValueError(
+                f"Unknown flat mode: '{flat_mode}'. Choose one of {flat_modes}."
+            )
+        if workers is None:
+            workers = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+        self.workers = max(int(workers), 1)
+        if chunk_mb is not None:
+            self.chunk_mb = chunk_mb
+        self.num_exposures_per_proj = max(int(num_exposures_per_proj), 1)
+        self.flat_loc = flat_loc
+        self.flat_mode = flat_mode
+        self.frame_positions = frame_positions
+        self.flat_positions = flat_positions
+        self._table = None
+        flats = average_groups(flats, num_exposures_per_flat)
+        if darks is None:
+            self.dark = np.zeros(flats.shape[1:], dtype=np.float32)
+        else:
+            self.dark = np.median(np.asarray(darks), axis=0).astype(np.float32)
+        if flat_loc is not None and len(flat_loc) > flats.shape[0]:
+            raise ValueError(
+                f"Got {len(flat_loc)} flat locations for {flats.shape[0]} flat "
+                "collections."
+            )
+        self.flats = flats - self.dark
+        # divide once here, multiply per frame later
+        with np.errstate(divide="ignore"):
+            self.inv_flats = 1 / self.flats
+
+    def index_table(self, num_frames):
+        """
+        `flat_index_table` for num_frames raw projection frames, computed once.
+        """
+        if self._table is None or len(self._table[0]) < num_frames:
+            self._table = flat_index_table(
+                num_frames,
+                self.flat_loc,
+                mode=self.flat_mode,
+                frame_positions=self.frame_positions,
+                flat_positions=self.flat_positions,
+            )
+        return self._table
+
+    @staticmethod
+    def _runs(lo):
+        """
+        (flat index, first, last) for the runs of frames that use the same flat.
+        """
+        edges = np.flatnonzero(np.diff(lo)) + 1
+        firsts = np.concatenate([[0], edges])
+        lasts = np.concatenate([edges, [len(lo)]])
+        return [(lo[a], a, b) for a, b in zip(firsts, lasts)]
+
+    def _normalize_rows(self, raw, table, rows, out):
+        """
+        Normalizes the image rows in rows of raw frames into out.
+        """
+        nexp = self.num_exposures_per_proj
+        lo, hi, weights = table
+        frames = np.subtract(raw[:, rows], self.dark[rows], dtype=np.float32)
+        if not weights.any():
+            for flat, a, b in self._runs(lo):
+                frames[a:b] *= self.inv_flats[flat, rows]
+        else:
+            flats = self.flats[lo, rows]
+            flats *= (1 - weights)[:, np.newaxis, np.newaxis]
+            _flats = self.flats[hi, rows]
+            _flats *= weights[:, np.newaxis, np.newaxis]
+            flats += _flats
+            with np.errstate(divide="ignore", invalid="ignore"):
+                frames /= flats
+        starts = np.arange(0, frames.shape[0], nexp)
+        _out = out[:, rows]
+        np.add.reduceat(frames, starts, axis=0, out=_out)
+        counts = np.diff(np.append(starts, frames.shape[0]))
+        if (counts != 1).any():
+            _out /= counts[:, np.newaxis, np.newaxis]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.log(_out, out=_out)
+        np.negative(_out, out=_out)
+
+    def normalize_chunk(self, raw, start=0, out=None):
+        """
+        Normalizes a chunk of raw frames.
+
+        Parameters
+        ----------
+        raw : ndarray
+            (frames, rows, cols) raw frames, starting at a projection boundary.
+        start : int, optional
+            Index of the first frame of raw among all raw projection frames,
+            used to pick the flats.
+        out : ndarray, optional
+            (ceil(frames / num_exposures_per_proj), rows, cols) float32 output.
+
+        Returns
+        -------
+        out : ndarray
+        """
+        num_frames = raw.shape[0]
+        num_proj = -(-num_frames // self.num_exposures_per_proj)
+        if out is None:
+            out = np.empty((num_proj,) + raw.shape[1:], dtype=np.float32)
+        table = [
+            arr[start : start + num_frames]
+            for arr in self.index_table(start + num_frames)
+        ]
+        num_rows = raw.shape[1]
+        num_slabs = min(self.workers, num_rows)
+        bounds = np.linspace(0, num_rows, num_slabs + 1).astype(int)
+        slabs = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        if num_slabs <= 1:
+            self._normalize_rows(raw, table, slabs[0], out)
+            return out
+        with ThreadPoolExecutor(max_workers=num_slabs) as executor:
+            list(
+                executor.map(
+                    lambda rows: self._normalize_rows(raw, table, rows, out), slabs
+                )
+            )
+        return out
+
+    def normalize(self, projs, out=None, progress=None):
+        """
+        Normalizes all raw projection frames, reading each one once.
+
+        Parameters
+        ----------
+        projs : array-like
+            (num_frames, rows, cols) raw projection frames. Anything that can be
+            sliced along axis 0 (ndarray, h5py dataset).
+        out : array-like, optional
+            (num_projections, rows, cols) output that can be assigned to in
+            slices along axis 0 (ndarray, h5py dataset). Defaults to a new
+            float32 ndarray.
+        progress : ipywidgets.IntProgress, optional
+            Its max is set to the number of chunks, and it is incremented after
+            each chunk is written.
+
+        Returns
+        -------
+        out : array-like
+        """
+        nexp = self.num_exposures_per_proj
+        num_frames = projs.shape[0]
+        num_proj = -(-num_frames // nexp)
+        if out is None:
+            out = np.empty((num_proj,) + tuple(projs.shape[1:]), dtype=np.float32)
+        frame_mb = 4 * int(np.prod(projs.shape[1:])) / 1024**2
+        proj_per_chunk = max(int(self.chunk_mb // (frame_mb * nexp)), 1)
+        chunks = [
+            (p, min(p + proj_per_chunk, num_proj))
+            for p in range(0, num_proj, proj_per_chunk)
+        ]
+        self.index_table(num_frames)
+        if progress is not None:
+            progress.value = 0
+            progress.max = len(chunks)
+
+        def read(chunk):
+            return np.asarray(projs[chunk[0] * nexp : chunk[1] * nexp])
+
+        def process(chunk, raw):
+            return self.normalize_chunk(raw, start=chunk[0] * nexp)
+
+        def write(chunk, result):
+            out[chunk[0] : chunk[1]] = result
+
+        run_pipeline(chunks, read, process, write, progress=progress)
+        return out
@@ -9,6 +9,53 @@ def pad_projections(prj, pad):
     return prj
 
 
+def read_padded(dataset, px_range=None, pad=(0, 0), dtype=np.float32):
+    """
+    Reads a crop of a (num_proj, rows, cols) stack straight into the interior of
+    a zero-padded array, so the crop is neither copied nor padded afterwards.
+    Same result as pad_projections(dataset[:, y0:y1, x0:x1], pad).
+
+    Parameters
+    ----------
+    dataset : array-like
+        h5py dataset (read with read_direct, converting to dtype as it reads),
+        zarr array or ndarray.
+    px_range : tuple, optional
+        (px_range_x, px_range_y), each a two-element list. Defaults to the
+        whole frame.
+    pad : tuple, optional
+        (pad_x, pad_y), zeros added on both sides.
+    dtype : numpy dtype, optional
+        Output dtype. None keeps the dtype of dataset.
+
+    Returns
+    -------
+    prj : ndarray
+    """
+    num_proj, rows, cols = dataset.shape
+    if px_range is None:
+        px_range = ([0, cols], [0, rows])
+    # clipped like a slice would be
+    x = slice(*px_range[0]).indices(cols)[:2]
+    y = slice(*px_range[1]).indices(rows)[:2]
+    crop_x = max(x[1] - x[0], 0)
+    crop_y = max(y[1] - y[0], 0)
+    if dtype is None:
+        dtype = dataset.dtype
+    shape = (num_proj, crop_y + 2 * pad[1], crop_x + 2 * pad[0])
+    # np.zeros gets zeroed pages from the OS, so only the padding is written
+    prj = np.zeros(shape, dtype=dtype)
+    source_sel = np.s_[:, y[0] : y[0] + crop_y, x[0] : x[0] + crop_x]
+    dest_sel = np.s_[:, pad[1] : pad[1] + crop_y, pad[0] : pad[0] + crop_x]
+    if prj.size == 0 or crop_x == 0 or crop_y == 0:
+        return prj
+    if hasattr(dataset, "read_direct"):
+        dataset.read_direct(prj, source_sel, dest_sel)
+    else:
+        prj[dest_sel] = dataset[source_sel]
+    return prj
+
+
 def trim_padding(prj):
 
     xs, ys, zs = np.where(np.absolute(prj) > 1e-7)
@@ -25,7 +72,8 @@ def trim_padding(prj):
     # not sure why +1 here.
 
     return result
-    
+
+
 def trim_padding_wrt_shift(prj, sx, sy, init_padding):
 
     minxs = np.min(sx)
@@ -42,7 +90,7 @@ def trim_padding_wrt_shift(prj, sx, sy, init_padding):
     x_end_shift = int(np.ceil(x_end_init + maxys))
     y_end_init = y_total - init_padding[1] - 1
     y_end_shift = int(np.ceil(y_end_init + maxys))
-    result = prj[:, y_begin_shift : y_end_shift, x_begin_shift : x_end_shift]
+    result = prj[:, y_begin_shift:y_end_shift, x_begin_shift:x_end_shift]
 
     return result
 
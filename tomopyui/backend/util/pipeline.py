@@ -0,0 +1,97 @@
+"""
+Overlapped read -> compute -> write over chunks of a dataset that does not fit in
+memory.
+"""
+
+import queue
+import threading
+
+_done = object()
+
+
+def run_pipeline(chunks, read, process, write, queue_size=2, progress=None):
+    """
+    Runs read(chunk) in a reader thread, process(chunk, data) in the calling thread
+    and write(chunk, result) in a writer thread, for each chunk in chunks. The
+    threads are connected by bounded queues, so at most about 2 * queue_size + 2
+    chunks are held in memory at any time.
+
+    Parameters
+    ----------
+    chunks : list
+        Anything describing a chunk, e.g. (start, stop) row ranges. Passed to read,
+        process and write.
+    read : callable
+        read(chunk) -> data
+    process : callable
+        process(chunk, data) -> result
+    write : callable
+        write(chunk, result)
+    queue_size : int, optional
+        Maximum number of chunks waiting between two steps.
+    progress : ipywidgets.IntProgress, optional
+        Incremented after each chunk is written.
+
+    Raises
+    ------
+    Any exception raised by read or write is re-raised in the calling thread.
+    """
+    read_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    stop = threading.Event()
+
+    def _reader():
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                read_queue.put((chunk, read(chunk)))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            read_queue.put(_done)
+
+    def _writer():
+        try:
+            while True:
+                item = write_queue.get()
+                if item is _done:
+                    break
+                if errors:
+                    continue
+                write(*item)
+                if progress is not None:
+                    progress.value += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            # keep emptying the queue so the compute thread does not block
+            while write_queue.get() is not _done:
+                pass
+
+    reader = threading.Thread(target=_reader, daemon=True)
+    writer = threading.Thread(target=_writer, daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        while True:
+            item = read_queue.get()
+            if item is _done or stop.is_set():
+                break
+            chunk, data = item
+            write_queue.put((chunk, process(chunk, data)))
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        write_queue.put(_done)
+        # unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                read_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        writer.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,263 @@
+"""
+Sparse-matrix parallel-beam projector and CPU iterative solvers.
+
+The projector works on a stack of independent slices. For blocks of angles it
+builds a sparse matrix mapping the pixels of one slice to the detector rows
+(linear interpolation onto the detector), and applies it to all slices at once.
+Slices are split between threads, which all apply the same matrix; the sparse
+products release the GIL, so this scales with the number of cores. The matrices
+are kept if they fit in max_matrix_mb. Otherwise each is built once per call
+to forward or back, while the one before it is being applied.
+
+`sirt` and `cgls` solve each slice independently with this projector and its
+exact adjoint, so they give the CPU-only nodes the same iterative methods as
+astra's SIRT3D_CUDA and CGLS3D_CUDA.
+"""
+
+import os
+import numpy as np
+import scipy.sparse
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelBeamProjector:
+    """
+    Parallel-beam projector for a stack of square slices.
+
+    Parameters
+    ----------
+    num_cols : int
+        Number of detector columns. Slices are num_cols x num_cols.
+    angles : array-like
+        Projection angles (rad).
+    center : float, optional
+        Rotation axis position on the detector (px). Defaults to num_cols / 2.
+    workers : int, optional
+        Number of threads. Defaults to os.environ["num_cpu_cores"].
+    max_matrix_mb : float, optional
+        Memory to spend on keeping the projection matrices. Above this, they
+        are rebuilt, a block of angles at a time, on every forward or back
+        projection.
+
+    Notes
+    -----
+    Volumes are (slices, num_cols, num_cols) and sinograms are (slices, angles,
+    num_cols), the order tomopy uses with sinogram_order=True.
+    """
+
+    max_matrix_mb = 1024
+    # size of the matrix for one block of angles
+    block_mb = 64
+
+    def __init__(self, num_cols, angles, center=None, workers=None, max_matrix_mb=None):
+        self.num_cols = int(num_cols)
+        self.angles = np.asarray(angles, dtype=np.float64)
+        self.center = self.num_cols / 2 if center is None else float(center)
+        if workers is None:
+            workers = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+        self.workers = max(int(workers), 1)
+        if max_matrix_mb is not None:
+            self.max_matrix_mb = max_matrix_mb
+        # pixel centers, relative to the rotation axis
+        coords = np.arange(self.num_cols) + 0.5 - self.num_cols / 2
+        y, x = np.meshgrid(coords, coords, indexing="ij")
+        self._x = x.ravel()
+        self._y = y.ravel()
+        # two entries (float32 weight, int32 index) per pixel and angle
+        angle_mb = 2 * self.num_cols**2 * 8 / 1024**2
+        per_block = max(int(self.block_mb // angle_mb), 1)
+        bounds = list(range(0, len(self.angles), per_block)) + [len(self.angles)]
+        self.blocks = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        self._matrices = None
+        if angle_mb * len(self.angles) <= self.max_matrix_mb:
+            self._matrices = [self._matrix(block) for block in self.blocks]
+
+    def _matrix(self, block):
+        """
+        Sparse matrix projecting one flattened slice onto the detector rows of
+        the angles in block (CSC), and its transpose (CSR).
+        """
+        theta = self.angles[block]
+        num_px = self.num_cols**2
+        # detector coordinate of each pixel, in units of detector columns
+        u = (
+            np.outer(self._x, np.cos(theta))
+            + np.outer(self._y, np.sin(theta))
+            + self.center
+            - 0.5
+        )
+        k = np.floor(u)
+        w = (u - k).astype(np.float32)
+        k = k.astype(np.int32)
+        # each pixel row of the transpose has two entries per angle
+        offsets = np.arange(len(theta), dtype=np.int32) * self.num_cols
+        indices = np.stack([k, k + 1], axis=2)
+        data = np.stack([1 - w, w], axis=2)
+        outside = (indices < 0) | (indices >= self.num_cols)
+        data[outside] = 0
+        indices[outside] = 0
+        indices += offsets[None, :, None]
+        indptr = np.arange(0, 2 * len(theta) * num_px + 1, 2 * len(theta))
+        matrix_t = scipy.sparse.csr_matrix(
+            (data.ravel(), indices.ravel(), indptr),
+            shape=(num_px, len(theta) * self.num_cols),
+        )
+        return matrix_t.T, matrix_t
+
+    def _chunks(self, num_slices):
+        num_chunks = min(self.workers, num_slices)
+        bounds = np.linspace(0, num_slices, num_chunks + 1).astype(int)
+        return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def _block_matrices(self, executor):
+        """
+        (block, (matrix, matrix_t)) for each block of angles. Matrices that are
+        not kept are built once per call, the next one in executor while the
+        current one is applied to the slices.
+        """
+        if self._matrices is not None:
+            yield from zip(self.blocks, self._matrices)
+            return
+        next_matrices = executor.submit(self._matrix, self.blocks[0])
+        for i, block in enumerate(self.blocks):
+            matrices = next_matrices.result()
+            if i + 1 < len(self.blocks):
+                next_matrices = executor.submit(self._matrix, self.blocks[i + 1])
+            yield block, matrices
+
+    def forward(self, vol, out=None):
+        """
+        Projects vol (slices, num_cols, num_cols) into a sinogram (slices,
+        angles, num_cols).
+        """
+        num_slices = vol.shape[0]
+        vol = vol.reshape(num_slices, -1)
+        if out is None:
+            out = np.empty((num_slices, len(self.angles), self.num_cols), np.float32)
+        _out = out.reshape(num_slices, -1)
+        chunks = self._chunks(num_slices)
+        # (pixels, slices) of each chunk, the layout the matrices multiply
+        vols = [np.ascontiguousarray(vol[chunk].T) for chunk in chunks]
+        # one thread per chunk, and one to build the next matrix
+        with ThreadPoolExecutor(max_workers=len(chunks) + 1) as executor:
+            for block, (matrix, _) in self._block_matrices(executor):
+                cols = slice(block.start * self.num_cols, block.stop * self.num_cols)
+
+                def _forward(chunk, _vol):
+                    _out[chunk, cols] = (matrix @ _vol).T
+
+                list(executor.map(_forward, chunks, vols))
+        return out
+
+    def back(self, sino, out=None):
+        """
+        Adjoint of `forward`: back-projects sino (slices, angles, num_cols) into
+        a volume (slices, num_cols, num_cols).
+        """
+        num_slices = sino.shape[0]
+        sino = sino.reshape(num_slices, -1)
+        if out is None:
+            out = np.empty((num_slices, self.num_cols, self.num_cols), np.float32)
+        _out = out.reshape(num_slices, -1)
+        chunks = self._chunks(num_slices)
+        accs = [
+            np.zeros((self.num_cols**2, chunk.stop - chunk.start), np.float32)
+            for chunk in chunks
+        ]
+        with ThreadPoolExecutor(max_workers=len(chunks) + 1) as executor:
+            for block, (_, matrix_t) in self._block_matrices(executor):
+                cols = slice(block.start * self.num_cols, block.stop * self.num_cols)
+
+                def _back(chunk, acc):
+                    acc += matrix_t @ np.ascontiguousarray(sino[chunk, cols].T)
+
+                list(executor.map(_back, chunks, accs))
+        for chunk, acc in zip(chunks, accs):
+            _out[chunk] = acc.T
+        return out
+
+
+def sirt(projector, sino, vol, num_iter=1, min_constraint=None):
+    """
+    SIRT iterations on each slice, starting from (and updating) vol in place.
+
+    Parameters
+    ----------
+    projector : `ParallelBeamProjector`
+    sino : ndarray
+        (slices, angles, num_cols) sinograms.
+    vol : ndarray
+        (slices, num_cols, num_cols) float32 starting volume.
+    num_iter : int, optional
+    min_constraint : float, optional
+        Clip the volume to at least this value after every iteration.
+
+    Returns
+    -------
+    vol : ndarray
+    """
+    ones = np.ones((1,) + vol.shape[1:], dtype=np.float32)
+    row_sum = projector.forward(ones)
+    col_sum = projector.back(np.ones_like(row_sum))
+    inv_row = np.where(row_sum > 1e-6, 1 / np.maximum(row_sum, 1e-6), 0)
+    inv_col = np.where(col_sum > 1e-6, 1 / np.maximum(col_sum, 1e-6), 0)
+    for _ in range(num_iter):
+        residual = sino - projector.forward(vol)
+        residual *= inv_row
+        vol += inv_col * projector.back(residual)
+        if min_constraint is not None:
+            np.maximum(vol, min_constraint, out=vol)
+    return vol
+
+
+def cgls(projector, sino, vol, num_iter=1):
+    """
+    CGLS iterations on each slice, starting from (and updating) vol in place.
+    Each call restarts the conjugate gradients from vol.
+
+    Parameters
+    ----------
+    projector : `ParallelBeamProjector`
+    sino : ndarray
+        (slices, angles, num_cols) sinograms.
+    vol : ndarray
+        (slices, num_cols, num_cols) float32 starting volume.
+    num_iter : int, optional
+
+    Returns
+    -------
+    vol : ndarray
+    """
+
+    def _norm2(arr):
+        return np.einsum(
+            "ij,ij->i", arr.reshape(len(arr), -1), arr.reshape(len(arr), -1)
+        )
+
+    def _per_slice(values):
+        return values.reshape(-1, 1, 1)
+
+    residual = sino - projector.forward(vol)
+    s = projector.back(residual)
+    p = s.copy()
+    gamma = _norm2(s)
+    for _ in range(num_iter):
+        q = projector.forward(p)
+        q_norm2 = _norm2(q)
+        alpha = np.divide(gamma, q_norm2, out=np.zeros_like(gamma), where=q_norm2 > 0)
+        vol += _per_slice(alpha) * p
+        residual -= _per_slice(alpha) * q
+        s = projector.back(residual, out=s)
+        gamma_new = _norm2(s)
+        beta = np.divide(gamma_new, gamma, out=np.zeros_like(gamma), where=gamma > 0)
+        p *= _per_slice(beta)
+        p += s
+        gamma = gamma_new
+    return vol
+
+
+solvers = {
+    "SIRT_CPU": sirt,
+    "CGLS_CPU": cgls,
+}
@@ -0,0 +1,221 @@
+"""
+Single-pass construction of the downsampled pyramid of a projection stack.
+
+The stack is read once, a chunk of whole projections at a time. Every level is
+computed from the one above it while the chunk is in memory, and all levels of
+the chunk are written to their datasets while the next chunk is read (see
+`run_pipeline`). Downsampling only happens along rows and columns, so chunks
+need no overlap. Histograms and percentiles of each level are accumulated on
+the way (see `StackStatistics`).
+"""
+
+import os
+import numpy as np
+import scipy.ndimage as ndi
+
+from concurrent.futures import ThreadPoolExecutor
+from tomopyui.backend.util.pipeline import run_pipeline
+from tomopyui.backend.util.stack_stats import StackStatistics
+
+pyramid_methods = ["mean", "gaussian"]
+
+
+def reduce_2x(frames, method="mean", sigma=None, out=None):
+    """
+    Halves the rows and columns of each frame.
+
+    Parameters
+    ----------
+    frames : ndarray
+        (n, rows, cols) frames.
+    method : str, optional
+        "mean" : mean of each 2x2 block.
+        "gaussian" : Gaussian smoothing along rows and columns, then the mean of
+            each 2x2 block.
+    sigma : float, optional
+        Gaussian standard deviation for "gaussian". Defaults to 2 / 3, which
+        covers > 99% of the distribution over the 2x2 block, like
+        skimage.transform.pyramid_reduce.
+    out : ndarray, optional
+        (n, ceil(rows / 2), ceil(cols / 2)) float32 output.
+
+    Returns
+    -------
+    out : ndarray
+        Odd rows or columns are completed by repeating the last one.
+    """
+    if method not in pyramid_methods:
+        raise ValueError(
+            f"Unknown pyramid method: '{method}'. Choose one of {pyramid_methods}."
+        )
+    frames = np.asarray(frames, dtype=np.float32)
+    if method == "gaussian":
+        if sigma is None:
+            sigma = 2 * 2 / 6.0
+        frames = ndi.gaussian_filter1d(frames, sigma, axis=1, mode="reflect")
+        frames = ndi.gaussian_filter1d(frames, sigma, axis=2, mode="reflect")
+    n, rows, cols = frames.shape
+    pad = ((0, 0), (0, rows % 2), (0, cols % 2))
+    if any(p[1] for p in pad):
+        frames = np.pad(frames, pad, mode="edge")
+    blocks = frames.reshape(n, frames.shape[1] // 2, 2, frames.shape[2] // 2, 2)
+    if out is None:
+        out = np.empty((n, blocks.shape[1], blocks.shape[3]), dtype=np.float32)
+    # sum of the four corners, without a temporary the size of frames
+    np.add(blocks[:, :, 0, :, 0], blocks[:, :, 0, :, 1], out=out)
+    out += blocks[:, :, 1, :, 0]
+    out += blocks[:, :, 1, :, 1]
+    out *= 0.25
+    return out
+
+
+class PyramidBuilder:
+    """
+    Builds all downsampled levels of a projection stack in one read of it.
+
+    Level i is downsampled by 2 ** (i + 1) along rows and columns, and is
+    computed from level i - 1 (cascaded 2x2 reduction).
+
+    Parameters
+    ----------
+    levels : int, optional
+        Number of levels.
+    method : str, optional
+        One of pyramid_methods. See `reduce_2x`.
+    sigma : float, optional
+        See `reduce_2x`.
+    workers : int, optional
+        Threads used on each chunk. Defaults to the num_cpu_cores environment
+        variable, or all cores.
+    chunk_mb : float, optional
+        Size of the chunks of the full-resolution stack read at a time.
+    bins : int, optional
+        Number of histogram bins of each level.
+    """
+
+    chunk_mb = 256
+
+    def __init__(
+        self,
+        levels=3,
+        method="mean",
+        sigma=None,
+        workers=None,
+        chunk_mb=None,
+        bins=200,
+    ):
+        if method not in pyramid_methods:
+            raise ValueError(
+                f"Unknown pyramid method: '{method}'. "
+                f"Choose one of {pyramid_methods}."
+            )
+        self.levels = levels
+        self.method = method
+        self.sigma = sigma
+        if workers is None:
+            workers = int(os.environ.get("num_cpu_cores", os.cpu_count() or 1))
+        self.workers = max(int(workers), 1)
+        if chunk_mb is not None:
+            self.chunk_mb = chunk_mb
+        self.bins = bins
+
+    def level_shapes(self, shape):
+        """
+        Shapes of the levels of a (num_proj, rows, cols) stack.
+        """
+        shapes = []
+        num_proj, rows, cols = shape
+        for _ in range(self.levels):
+            rows, cols = -(-rows // 2), -(-cols // 2)
+            shapes.append((num_proj, rows, cols))
+        return shapes
+
+    def reduce_chunk(self, chunk):
+        """
+        All levels of a chunk of projections.
+
+        Parameters
+        ----------
+        chunk : ndarray
+            (n, rows, cols) projections.
+
+        Returns
+        -------
+        levels : list of ndarray
+            float32 levels, from 2x to 2 ** levels x downsampled.
+        """
+        shapes = self.level_shapes(chunk.shape)
+        results = [np.empty(shape, dtype=np.float32) for shape in shapes]
+
+        def reduce_slab(start, stop):
+            level = chunk[start:stop]
+            for result in results:
+                level = reduce_2x(level, self.method, self.sigma, result[start:stop])
+
+        num = chunk.shape[0]
+        workers = min(self.workers, num)
+        bounds = np.linspace(0, num, workers + 1).astype(int)
+        if workers == 1:
+            reduce_slab(0, num)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                list(ex.map(reduce_slab, bounds[:-1], bounds[1:]))
+        return results
+
+    def build(self, data, outs=None, progress=None):
+        """
+        Reads data once and writes every level.
+
+        Parameters
+        ----------
+        data : array-like
+            (num_proj, rows, cols) stack. Anything that can be sliced along axis
+            0 (ndarray, h5py dataset).
+        outs : list, optional
+            One output per level, shaped as in `level_shapes`, that can be
+            assigned to in slices along axis 0 (ndarray, h5py dataset). Defaults
+            to new float32 ndarrays.
+        progress : ipywidgets.IntProgress, optional
+            Its max is set to the number of chunks, and it is incremented after
+            each chunk is written.
+
+        Returns
+        -------
+        outs : list
+        stats : list of tuple
+            (hist, r, percentile, bin_centers) of each level, see
+            `StackStatistics.result`.
+        """
+        shapes = self.level_shapes(data.shape)
+        if outs is None:
+            outs = [np.empty(shape, dtype=np.float32) for shape in shapes]
+        num_proj = data.shape[0]
+        frame_mb = np.dtype(data.dtype).itemsize * np.prod(data.shape[1:]) / 1024**2
+        step = max(int(self.chunk_mb // max(frame_mb, 1e-9)), 1)
+        # Write whole dataset chunks, so they are not read back and recompressed,
+        # unless that means reading far more than chunk_mb at a time (e.g.
+        # sinogram chunks, which hold every projection).
+        out_chunks = [getattr(out, "chunks", None) for out in outs]
+        align = max([c[0] for c in out_chunks if c is not None] + [1])
+        if align * frame_mb <= 2 * self.chunk_mb:
+            step = -(-step // align) * align
+        chunks = [(p, min(p + step, num_proj)) for p in range(0, num_proj, step)]
+        stats = [StackStatistics() for _ in range(self.levels)]
+        if progress is not None:
+            progress.value = 0
+            progress.max = len(chunks)
+
+        def read(chunk):
+            return np.asarray(data[chunk[0] : chunk[1]])
+
+        def process(chunk, frames):
+            return self.reduce_chunk(frames)
+
+        def write(chunk, levels):
+            for out, level, level_stats in zip(outs, levels, stats):
+                out[chunk[0] : chunk[1]] = level
+                level_stats.update(level)
+
+        run_pipeline(chunks, read, process, write, progress=progress)
+        bins = [min(self.bins, max(int(np.prod(shape)), 1)) for shape in shapes]
+        return outs, [s.result(bins=b) for s, b in zip(stats, bins)]
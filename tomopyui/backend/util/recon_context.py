@@ -0,0 +1,255 @@
+"""
+Reconstruction state that lives across the iterations of `align_joint`.
+
+Every alignment iteration reconstructs the same set of projections, of which
+only the ones that were shifted change, and re-projects the result. A
+reconstruction context sets up geometry and buffers once, takes the shifted
+projections as they change, and keeps the reconstruction between iterations
+as the starting point of the next one.
+"""
+
+import numpy as np
+
+from abc import ABC, abstractmethod
+from scipy import ndimage as ndi
+from tomopy.recon import algorithm as tomopy_algorithm
+from tomopy.sim.project import project
+from tomopyui.backend.util.projector import ParallelBeamProjector, solvers
+
+
+class ReconContext(ABC):
+    """
+    Base class for reconstruction contexts. Use as a context manager, or call
+    `close` when done, to release the buffers.
+    """
+
+    @abstractmethod
+    def update_projections(self, prjs, indices=None):
+        """
+        Copies projections into the context.
+
+        Parameters
+        ----------
+        prjs : ndarray
+            All projections (N, rows, cols), as shaped when the context was
+            created.
+        indices : array-like, optional
+            Indices of the projections that changed. Defaults to all of them.
+        """
+        ...
+
+    @abstractmethod
+    def reconstruct(self, num_iter=1):
+        """
+        Runs num_iter iterations of the reconstruction algorithm, starting from
+        the current reconstruction.
+        """
+        ...
+
+    @abstractmethod
+    def forward_project(self, progress=None):
+        """
+        Simulated projections (N, rows, cols) of the current reconstruction, on
+        the host.
+        """
+        ...
+
+    @abstractmethod
+    def get_recon(self):
+        """
+        Current reconstruction (rows, cols, cols) on the host.
+        """
+        ...
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TomopyReconContext(ReconContext):
+    """
+    Reconstruction context using tomopy's multi-threaded CPU algorithms.
+
+    Projections are kept in sinogram order, so tomopy does not have to copy and
+    transpose them on every call, and the reconstruction buffer is reused as
+    init_recon of the next call.
+
+    Parameters
+    ----------
+    prjs : ndarray
+        Projections (N, rows, cols).
+    angles : array-like
+        Projection angles (rad).
+    center : float or array-like, optional
+        Center of rotation, or one per row.
+    algorithm : str, optional
+        tomopy algorithm name.
+    recon : ndarray, optional
+        Starting reconstruction (rows, cols, cols). Defaults to tomopy's own
+        starting point (1e-6 everywhere), which the multiplicative methods
+        (mlem, osem, pml, ...) need: they can never move away from zero.
+    ncore : int, optional
+        Number of threads for reconstruction and re-projection.
+    **kwargs
+        Passed to `tomopy.recon`.
+    """
+
+    def __init__(
+        self,
+        prjs,
+        angles,
+        center=None,
+        algorithm="sirt",
+        recon=None,
+        ncore=None,
+        **kwargs,
+    ):
+        num_prj, num_y, num_x = prjs.shape
+        self.angles = np.asarray(angles)
+        self.center = center
+        self.algorithm = algorithm
+        self.ncore = ncore
+        self.kwargs = kwargs
+        self.sino = np.empty((num_y, num_prj, num_x), dtype=np.float32)
+        self.update_projections(prjs)
+        self.recon = None
+        if recon is not None:
+            self.recon = np.ascontiguousarray(recon, dtype=np.float32)
+
+    def update_projections(self, prjs, indices=None):
+        if indices is None:
+            self.sino[:] = prjs.swapaxes(0, 1)
+        elif len(indices) > 0:
+            self.sino[:, indices, :] = prjs[indices].swapaxes(0, 1)
+
+    def reconstruct(self, num_iter=1):
+        kwargs = dict(self.kwargs)
+        if self.algorithm not in ("gridrec", "fbp"):
+            kwargs["num_iter"] = num_iter
+            if self.recon is not None:
+                kwargs["init_recon"] = self.recon
+        self.recon = tomopy_algorithm.recon(
+            self.sino,
+            self.angles,
+            center=self.center,
+            algorithm=self.algorithm,
+            sinogram_order=True,
+            ncore=self.ncore,
+            **kwargs,
+        )
+        self.recon[np.isnan(self.recon)] = 0
+        return self.recon
+
+    def forward_project(self, progress=None):
+        if self.recon is None:
+            raise ValueError("There is no reconstruction to project yet.")
+        sim = project(
+            self.recon, self.angles, center=self.center, pad=False, ncore=self.ncore
+        )
+        if progress is not None:
+            progress.value = progress.max
+        return sim
+
+    def get_recon(self):
+        return self.recon
+
+
+class ProjectorReconContext(ReconContext):
+    """
+    Reconstruction context for the CPU iterative solvers in
+    `tomopyui.backend.util.projector` (SIRT_CPU, CGLS_CPU).
+
+    The projector's matrices are built once, and the projections and the
+    reconstruction are kept in sinogram order between calls.
+
+    Parameters
+    ----------
+    prjs : ndarray
+        Projections (N, rows, cols).
+    angles : array-like
+        Projection angles (rad).
+    center : float or array-like, optional
+        Center of rotation, or one per row. Rows with a different center are
+        shifted onto the mean center before reconstruction.
+    algorithm : str, optional
+        One of the keys in `tomopyui.backend.util.projector.solvers`.
+    recon : ndarray, optional
+        Starting reconstruction (rows, cols, cols). Defaults to zeros.
+    ncore : int, optional
+        Number of threads.
+    min_constraint : float, optional
+        Lower bound for the reconstruction (SIRT_CPU only).
+    """
+
+    def __init__(
+        self,
+        prjs,
+        angles,
+        center=None,
+        algorithm="SIRT_CPU",
+        recon=None,
+        ncore=None,
+        min_constraint=None,
+    ):
+        if algorithm not in solvers:
+            raise ValueError(
+                f"Unknown CPU solver: '{algorithm}'. "
+                f"Choose one of {list(solvers.keys())}."
+            )
+        num_prj, num_y, num_x = prjs.shape
+        self.algorithm = algorithm
+        self.solver_kwargs = {}
+        if algorithm == "SIRT_CPU":
+            self.solver_kwargs["min_constraint"] = min_constraint
+        if center is None:
+            center = num_x / 2
+        center = np.broadcast_to(np.asarray(center, dtype=float), (num_y,))
+        self.center_offsets = center - center.mean()
+        self.projector = ParallelBeamProjector(
+            num_x, angles, center=center.mean(), workers=ncore
+        )
+        self.sino = np.empty((num_y, num_prj, num_x), dtype=np.float32)
+        self.update_projections(prjs)
+        if recon is None:
+            self.recon = np.zeros((num_y, num_x, num_x), dtype=np.float32)
+        else:
+            self.recon = np.array(recon, dtype=np.float32)
+
+    def _shift_rows(self, sino, sign):
+        # move each row's rotation axis to (sign=-1) or from (sign=1) the mean
+        for i in np.flatnonzero(self.center_offsets):
+            sino[i] = ndi.shift(sino[i], (0, sign * self.center_offsets[i]), order=1)
+        return sino
+
+    def update_projections(self, prjs, indices=None):
+        if indices is None:
+            self.sino[:] = prjs.swapaxes(0, 1)
+            self._shift_rows(self.sino, -1)
+        elif len(indices) > 0:
+            sino = np.ascontiguousarray(prjs[indices].swapaxes(0, 1))
+            self.sino[:, indices, :] = self._shift_rows(sino, -1)
+
+    def reconstruct(self, num_iter=1):
+        solvers[self.algorithm](
+            self.projector,
+            self.sino,
+            self.recon,
+            num_iter=num_iter,
+            **self.solver_kwargs,
+        )
+        self.recon[np.isnan(self.recon)] = 0
+        return self.recon
+
+    def forward_project(self, progress=None):
+        sim = self._shift_rows(self.projector.forward(self.recon), 1)
+        if progress is not None:
+            progress.value = progress.max
+        return np.ascontiguousarray(sim.swapaxes(0, 1))
+
+    def get_recon(self):
+        return self.recon
@@ -0,0 +1,184 @@
+"""
+Registry of the reconstruction methods that can be picked in the Align and Recon
+tabs.
+
+Each method is a `ReconEngine`, which knows how to make the `ReconContext` that
+runs it. `RunRecon`, both `align_joint` implementations and the method
+checkboxes in the UI all go through this registry, so a new method only has to
+be registered here.
+"""
+
+import importlib
+import os
+
+from tomopyui._sharedvars import tomopy_recon_algorithm_kwargs
+
+
+class ReconEngine:
+    """
+    A reconstruction method.
+
+    Parameters
+    ----------
+    name : str
+        Method name as stored in the metadata ("SIRT_CUDA", "sirt", ...).
+    context : str
+        "module:class" of the `ReconContext` that runs the method. It is only
+        imported when the method is used, so CUDA-only modules are never
+        imported on CPU-only nodes.
+    group : str, optional
+        Heading the method is listed under in the UI.
+    cuda : bool, optional
+        Whether the method needs CUDA.
+    iterative : bool, optional
+        Whether the method takes a number of iterations (and a starting
+        reconstruction).
+    **context_kwargs
+        Passed to the context on creation, e.g. algorithm.
+    """
+
+    def __init__(
+        self,
+        name,
+        context,
+        group="Tomopy",
+        cuda=False,
+        iterative=True,
+        **context_kwargs,
+    ):
+        self.name = name
+        self.context = context
+        self.group = group
+        self.cuda = cuda
+        self.iterative = iterative
+        self.context_kwargs = context_kwargs
+
+    @property
+    def label(self):
+        """
+        Name shown in the UI. Spaces become underscores in the metadata.
+        """
+        return self.name.replace("_", " ")
+
+    @property
+    def available(self):
+        return not self.cuda or os.environ.get("cuda_enabled") == "True"
+
+    def context_class(self):
+        module, cls = self.context.split(":")
+        return getattr(importlib.import_module(module), cls)
+
+    def create(self, prjs, angles, center=None, recon=None, **kwargs):
+        """
+        Prepares a reconstruction of prjs.
+
+        Parameters
+        ----------
+        prjs : ndarray
+            Projections (N, rows, cols).
+        angles : array-like
+            Projection angles (rad).
+        center : float or array-like, optional
+            Center of rotation, or one per row.
+        recon : ndarray, optional
+            Starting reconstruction (warm start). Ignored by non-iterative
+            methods.
+        **kwargs
+            Passed to the context, e.g. ncore.
+
+        Returns
+        -------
+        context : `ReconContext`
+        """
+        if not self.available:
+            raise ValueError(f"Reconstruction method '{self.name}' needs CUDA.")
+        kwargs = {**self.context_kwargs, **kwargs}
+        return self.context_class()(prjs, angles, center=center, recon=recon, **kwargs)
+
+
+recon_engines = {}
+
+
+def register_engine(engine):
+    """
+    Adds a `ReconEngine` to recon_engines, replacing any engine with its name.
+    """
+    recon_engines[engine.name] = engine
+    return engine
+
+
+def get_engine(name):
+    """
+    The registered `ReconEngine` for a method name. Spaces in name are read as
+    underscores, so UI labels work too.
+    """
+    name = name.replace(" ", "_")
+    if name not in recon_engines:
+        raise ValueError(
+            f"Unknown reconstruction method: '{name}'. "
+            f"Choose one of {list(recon_engines.keys())}."
+        )
+    return recon_engines[name]
+
+
+def engine_labels(group=None, iterative=None):
+    """
+    UI labels of the registered engines, in registration order.
+
+    Parameters
+    ----------
+    group : str, optional
+        Only engines in this group.
+    iterative : bool, optional
+        Only iterative (True) or non-iterative (False) engines.
+    """
+    return [
+        engine.label
+        for engine in recon_engines.values()
+        if (group is None or engine.group == group)
+        and (iterative is None or engine.iterative == iterative)
+    ]
+
+
+_tomopy_context = "tomopyui.backend.util.recon_context:TomopyReconContext"
+_projector_context = "tomopyui.backend.util.recon_context:ProjectorReconContext"
+_astra_context = "tomopyui.tomocupy.recon.context:AstraReconContext"
+_astra_host_context = "tomopyui.tomocupy.recon.context:AstraHostReconContext"
+
+for _name in tomopy_recon_algorithm_kwargs:
+    register_engine(
+        ReconEngine(
+            _name,
+            _tomopy_context,
+            iterative=_name not in ("gridrec", "fbp"),
+            algorithm=_name,
+        )
+    )
+for _name in ["SIRT_CPU", "CGLS_CPU"]:
+    register_engine(
+        ReconEngine(_name, _projector_context, group="CPU", algorithm=_name)
+    )
+for _name in ["FBP_CUDA", "SIRT_CUDA", "SART_CUDA", "CGLS_CUDA", "MLEM_CUDA"]:
+    register_engine(
+        ReconEngine(
+            _name,
+            _astra_host_context,
+            group="Astra",
+            cuda=True,
+            iterative=_name != "FBP_CUDA",
+            algorithm=_name,
+        )
+    )
+register_engine(
+    ReconEngine(
+        "SIRT_Plugin",
+        _astra_host_context,
+        group="Astra",
+        cuda=True,
+        algorithm="SIRT_Plugin",
+    )
+)
+for _name in ["SIRT_3D", "CGLS_3D"]:
+    register_engine(
+        ReconEngine(_name, _astra_context, group="Astra", cuda=True, algorithm=_name)
+    )
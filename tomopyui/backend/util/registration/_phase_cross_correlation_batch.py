@@ -0,0 +1,186 @@
+"""
+Stack-native version of Manuel Guizar's subpixel registration algorithm:
+http://www.mathworks.com/matlabcentral/fileexchange/18401-efficient-subpixel-image-registration-by-cross-correlation
+
+Unlike `_phase_cross_correlation_cupy.phase_cross_correlation`, every step is
+done for the whole stack at once: one batched FFT per stack, one argmax for the
+integer peaks and batched matrix multiplies for the upsampled DFT refinement.
+Works with any array backend in `tomopyui.backend.util.array_backend`.
+"""
+
+import numpy as np
+
+from tomopyui.backend.util.array_backend import get_backend
+
+
+def _upsampled_dft(data, upsampled_region_size, upsample_factor, axis_offsets, xp):
+    """
+    Batched upsampled DFT by matrix multiplication.
+
+    For each image n, this gives the same result as embedding data[n] in an
+    array ``upsample_factor`` times larger, taking its FFT and extracting an
+    ``upsampled_region_size`` region starting at ``axis_offsets[:, n] + 1``,
+    without zero-padding.
+
+    Parameters
+    ----------
+    data : array
+        3D stack of DFTs (N, rows, cols) to upsample.
+    upsampled_region_size : int
+        Size of the (square) region to be sampled.
+    upsample_factor : int
+        The upsampling factor.
+    axis_offsets : array
+        (2, N) array of row and column offsets of the region to be sampled.
+    xp : module
+        numpy or cupy.
+
+    Returns
+    -------
+    output : array
+        (N, upsampled_region_size, upsampled_region_size) upsampled DFTs.
+    """
+    im2pi = 1j * 2 * np.pi
+    num_images, num_rows, num_cols = data.shape
+    region = xp.arange(upsampled_region_size, dtype=xp.float64)
+    # kernels have shape (N, upsampled_region_size, axis size)
+    row_kernel = (region[None, :] - axis_offsets[0][:, None])[:, :, None] * (
+        xp.fft.fftfreq(num_rows, upsample_factor)[None, None, :]
+    )
+    col_kernel = (region[None, :] - axis_offsets[1][:, None])[:, :, None] * (
+        xp.fft.fftfreq(num_cols, upsample_factor)[None, None, :]
+    )
+    row_kernel = xp.exp(-im2pi * row_kernel).astype(data.dtype)
+    col_kernel = xp.exp(-im2pi * col_kernel).astype(data.dtype)
+    # Equivalent to row_kernel[n] @ data[n] @ col_kernel[n].T for each n
+    return xp.matmul(xp.matmul(row_kernel, data), col_kernel.transpose(0, 2, 1))
+
+
+def _argmax_2d(arr, xp):
+    """
+    Row and column indices of the maximum of each image in a 3D stack.
+    """
+    flat_index = xp.argmax(arr.reshape(arr.shape[0], -1), axis=1)
+    return xp.stack([flat_index // arr.shape[2], flat_index % arr.shape[2]])
+
+
+def phase_cross_correlation(
+    reference_images,
+    moving_images,
+    *,
+    upsample_factor=1,
+    space="real",
+    return_error=True,
+    backend=None,
+):
+    """
+    Subpixel translation registration of two image stacks by cross-correlation.
+
+    Parameters
+    ----------
+    reference_images : 3D array
+        Reference image stack (N, rows, cols).
+    moving_images : 3D array
+        Image stack to register. Must be the same shape as ``reference_images``.
+    upsample_factor : int, optional
+        Upsampling factor. Images will be registered to within
+        ``1 / upsample_factor`` of a pixel. Default is 1 (no upsampling).
+    space : string, one of "real" or "fourier", optional
+        Defines how the algorithm interprets input data. "real" means data will
+        be FFT'd to compute the correlation, while "fourier" data will bypass
+        FFT of input data. Case insensitive.
+    return_error : bool, optional
+        Returns error and phase difference if on, otherwise only shifts are
+        returned.
+    backend : `NumpyBackend` or `CupyBackend`, optional
+        Array backend to compute with. Defaults to `get_backend()`.
+
+    Returns
+    -------
+    shifts : array
+        (2, N) array of (y, x) shifts (in pixels) required to register each
+        moving image with its reference image. Lives on the backend's device.
+    error : array
+        Translation invariant normalized RMS error for each image pair.
+    phasediff : array
+        Global phase difference for each image pair.
+
+    References
+    ----------
+    .. [1] Manuel Guizar-Sicairos, Samuel T. Thurman, and James R. Fienup,
+           "Efficient subpixel image registration algorithms,"
+           Optics Letters 33, 156-158 (2008). :DOI:`10.1364/OL.33.000156`
+    """
+    if backend is None:
+        backend = get_backend()
+    xp = backend.xp
+
+    # images must be the same shape
+    if reference_images.shape != moving_images.shape:
+        raise ValueError("images must be same shape")
+
+    # assume complex data is already in Fourier space
+    if space.lower() == "fourier":
+        src_freqs = backend.asarray(reference_images, dtype=np.complex64)
+        target_freqs = backend.asarray(moving_images, dtype=np.complex64)
+    # real data needs to be fft'd.
+    elif space.lower() == "real":
+        src_freqs = backend.fftn(backend.asarray(reference_images), axes=(1, 2))
+        target_freqs = backend.fftn(backend.asarray(moving_images), axes=(1, 2))
+    else:
+        raise ValueError('space argument must be "real" of "fourier"')
+
+    # Whole-pixel shift - Compute cross-correlation by an IFFT
+    num_images = src_freqs.shape[0]
+    image_shape = xp.asarray(src_freqs.shape[1:], dtype=xp.float64)[:, None]
+    image_product = src_freqs * target_freqs.conj()
+    cross_correlation = backend.ifftn(image_product, axes=(1, 2))
+
+    # Locate maxima
+    maxima = _argmax_2d(xp.abs(cross_correlation), xp)
+    image_index = xp.arange(num_images)
+    CCmax = cross_correlation[image_index, maxima[0], maxima[1]]
+    midpoints = xp.fix(image_shape / 2)
+    shifts = maxima.astype(xp.float64)
+    shifts = xp.where(shifts > midpoints, shifts - image_shape, shifts)
+
+    if upsample_factor == 1:
+        if return_error:
+            src_amp = xp.sum(xp.real(src_freqs * src_freqs.conj()), axis=(1, 2))
+            src_amp /= src_freqs[0].size
+            target_amp = xp.sum(
+                xp.real(target_freqs * target_freqs.conj()), axis=(1, 2)
+            )
+            target_amp /= target_freqs[0].size
+    # If upsampling > 1, then refine estimate with matrix multiply DFT
+    else:
+        # Initial shift estimate in upsampled grid
+        shifts = xp.round(shifts * upsample_factor) / upsample_factor
+        upsampled_region_size = int(np.ceil(upsample_factor * 1.5))
+        # Center of output array at dftshift + 1
+        dftshift = np.fix(upsampled_region_size / 2.0)
+        # Matrix multiply DFT around the current shift estimate
+        sample_region_offset = dftshift - shifts * upsample_factor
+        cross_correlation = _upsampled_dft(
+            image_product.conj(),
+            upsampled_region_size,
+            upsample_factor,
+            sample_region_offset,
+            xp,
+        ).conj()
+        # Locate maxima and map back to original pixel grid
+        maxima = _argmax_2d(xp.abs(cross_correlation), xp)
+        CCmax = cross_correlation[image_index, maxima[0], maxima[1]]
+        shifts = shifts + (maxima.astype(xp.float64) - dftshift) / upsample_factor
+        if return_error:
+            src_amp = xp.sum(xp.real(src_freqs * src_freqs.conj()), axis=(1, 2))
+            target_amp = xp.sum(
+                xp.real(target_freqs * target_freqs.conj()), axis=(1, 2)
+            )
+
+    if return_error:
+        error = xp.sqrt(xp.abs(1.0 - CCmax * CCmax.conj() / (src_amp * target_amp)))
+        phasediff = xp.arctan2(CCmax.imag, CCmax.real)
+        return shifts, error, phasediff
+    else:
+        return shifts
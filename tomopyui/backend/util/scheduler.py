@@ -0,0 +1,89 @@
+"""
+Process pool for independent jobs whose results go to a single file.
+"""
+
+import multiprocessing
+import os
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+
+def run_jobs(
+    jobs,
+    work,
+    write,
+    num_workers=None,
+    max_in_flight=None,
+    mp_context="spawn",
+    progress=None,
+):
+    """
+    Runs work(job) for each job in a pool of worker processes, and write(job,
+    result) in the calling process as results come in. Only the calling process
+    writes, so the results can go to one HDF5 file without locking. At most
+    max_in_flight jobs are running or waiting to be written at any time, which
+    bounds memory use.
+
+    Parameters
+    ----------
+    jobs : list
+        Arguments for work. Must be picklable.
+    work : callable
+        work(job) -> result. Must be a module-level function, and result must be
+        picklable.
+    write : callable
+        write(job, result), called in the calling process in completion order.
+    num_workers : int, optional
+        Number of worker processes. Defaults to os.environ["num_cpu_cores"], or to
+        the number of CPUs if that is not set. With 1 worker, jobs are run in
+        the calling process.
+    max_in_flight : int, optional
+        Maximum number of submitted jobs whose results have not been written.
+        Defaults to num_workers.
+    mp_context : str, optional
+        Multiprocessing start method. "spawn" (default) is safe with CUDA and
+        with threads in the calling process.
+    progress : ipywidgets.IntProgress, optional
+        Incremented after each result is written.
+
+    Raises
+    ------
+    The first exception raised by work or write. Jobs that were not started are
+    cancelled.
+    """
+    jobs = list(jobs)
+    if num_workers is None:
+        num_workers = int(os.environ.get("num_cpu_cores", os.cpu_count()))
+    num_workers = max(min(int(num_workers), len(jobs)), 1)
+    if max_in_flight is None:
+        max_in_flight = num_workers
+    max_in_flight = max(int(max_in_flight), 1)
+    if num_workers == 1:
+        for job in jobs:
+            write(job, work(job))
+            if progress is not None:
+                progress.value += 1
+        return
+
+    context = multiprocessing.get_context(mp_context)
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as pool:
+        pending = {}
+        remaining = iter(jobs)
+        try:
+            while True:
+                for job in remaining:
+                    pending[pool.submit(work, job)] = job
+                    if len(pending) >= max_in_flight:
+                        break
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    write(job, future.result())
+                    if progress is not None:
+                        progress.value += 1
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
@@ -0,0 +1,113 @@
+"""
+Batched subpixel shifting of projection stacks.
+"""
+
+import numpy as np
+
+from tomopyui.backend.util.array_backend import get_backend
+
+
+def _fourier_shift(prj, sx, sy, backend):
+    """
+    Shifts every image in prj by (sy, sx) with a phase ramp in Fourier space.
+    Content shifted past an edge wraps around, so images should be padded by
+    at least the largest shift.
+    """
+    xp = backend.xp
+    num_rows, num_cols = prj.shape[1:]
+    sx = xp.asarray(sx, dtype=xp.float32)[:, None, None]
+    sy = xp.asarray(sy, dtype=xp.float32)[:, None, None]
+    ky = xp.fft.fftfreq(num_rows).astype(xp.float32)[None, :, None]
+    kx = xp.fft.rfftfreq(num_cols).astype(xp.float32)[None, None, :]
+    prj_freqs = backend.rfftn(prj, axes=(1, 2))
+    prj_freqs *= xp.exp(-2j * np.pi * (ky * sy + kx * sx))
+    return backend.irfftn(prj_freqs, s=(num_rows, num_cols), axes=(1, 2))
+
+
+def _spline_shift(prj, sx, sy, backend, order=5):
+    """
+    Shifts every image in prj by (sy, sx) with spline interpolation. The spline
+    prefilter is run over all images to be shifted at once, then the images are
+    shifted in parallel.
+    """
+    to_shift = np.flatnonzero(np.logical_or(sx != 0, sy != 0))
+    filtered = backend.ndi.spline_filter1d(prj[to_shift], order=order, axis=1)
+    filtered = backend.ndi.spline_filter1d(filtered, order=order, axis=2)
+
+    def _shift_image(i):
+        prj[to_shift[i]] = backend.ndi.shift(
+            filtered[i],
+            (sy[to_shift[i]], sx[to_shift[i]]),
+            order=order,
+            prefilter=False,
+        )
+
+    backend.map_indices(_shift_image, len(to_shift))
+    return prj
+
+
+shift_methods = {
+    "fourier": _fourier_shift,
+    "spline": _spline_shift,
+}
+
+
+def shift_stack(prj, sx, sy, method="spline", num_batches=1, backend=None, out=None):
+    """
+    Shifts each projection image by its own (sy, sx) shift.
+
+    Parameters
+    ----------
+    prj : ndarray
+        3D stack of projection images (N, rows, cols).
+    sx, sy : array-like
+        Shift in x and y (px) for each of the N images. Images with zero shift
+        are left as they are.
+    method : str, optional
+        "spline" (default) uses order-5 spline interpolation and fills the
+        edges with zeros, like `scipy.ndimage.shift`. "fourier" applies the
+        shifts as phase ramps to the whole chunk in a single batched FFT. It is
+        faster, but content shifted past an edge wraps around to the other one
+        and sharp edges ring, so only use it on images padded by more than the
+        largest shift.
+    num_batches : int, optional
+        Number of chunks to split the stack into along the projection axis.
+        Bounds the memory used on the backend's device.
+    backend : `NumpyBackend` or `CupyBackend`, optional
+        Defaults to `get_backend()`.
+    out : ndarray, optional
+        Host array to write the result into. Can be prj to shift in place.
+
+    Returns
+    -------
+    out : ndarray
+        Shifted float32 projections on the host.
+    """
+    if backend is None:
+        backend = get_backend()
+    if method not in shift_methods:
+        raise ValueError(
+            f"Unknown shift method: '{method}'. "
+            f"Choose one of {list(shift_methods.keys())}."
+        )
+    sx = np.asarray(sx, dtype=np.float32)
+    sy = np.asarray(sy, dtype=np.float32)
+    if out is None:
+        out = np.empty(prj.shape, dtype=np.float32)
+    bounds = np.linspace(0, prj.shape[0], max(int(num_batches), 1) + 1).astype(int)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop == start:
+            continue
+        _sx = sx[start:stop]
+        _sy = sy[start:stop]
+        if not (np.any(_sx) or np.any(_sy)):
+            out[start:stop] = prj[start:stop]
+            continue
+        _prj = backend.asarray(prj[start:stop])
+        if out is not prj and backend.xp is np and np.may_share_memory(_prj, prj):
+            # the spline shift works in place; leave the input as it was
+            _prj = _prj.copy()
+        _prj = shift_methods[method](_prj, _sx, _sy, backend)
+        out[start:stop] = backend.asnumpy(_prj)
+    backend.free_memory()
+    return out
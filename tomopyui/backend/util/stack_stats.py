@@ -0,0 +1,225 @@
+"""
+Single-pass range, histogram and percentile statistics for image stacks.
+
+Each chunk of the stack is reduced on its own to its range and a fine histogram
+over that range. The partial results are merged through their cumulative
+distributions, so the data is read once and never sorted. Histograms and
+percentiles are approximate to within one fine bin (range / fine_bins).
+"""
+
+import dask
+import dask.array as da
+import numpy as np
+
+
+def _chunk_partial(chunk, fine_bins):
+    """
+    Range and fine histogram of the finite values in chunk, or None if there are
+    none.
+
+    Returns
+    -------
+    partial : tuple
+        (min, max, counts), where counts is the histogram over
+        np.linspace(min, max, fine_bins + 1).
+    """
+    chunk = np.asarray(chunk)
+    finite = np.isfinite(chunk)
+    if not finite.all():
+        chunk = chunk[finite]
+    if chunk.size == 0:
+        return None
+    lo = float(chunk.min())
+    hi = float(chunk.max())
+    if hi == lo:
+        counts = np.zeros(fine_bins, dtype=np.int64)
+        counts[0] = chunk.size
+    else:
+        counts, _ = np.histogram(chunk, bins=fine_bins, range=(lo, hi))
+    return lo, hi, counts.astype(np.int64)
+
+
+def _partial_cdf(partial, x):
+    """
+    Number of values in partial that are smaller than each x.
+    """
+    lo, hi, counts = partial
+    if hi == lo:
+        return np.where(x > lo, counts.sum(), 0)
+    edges = np.linspace(lo, hi, len(counts) + 1)
+    cumulative = np.concatenate([[0], np.cumsum(counts)])
+    return np.interp(x, edges, cumulative)
+
+
+def _merge_partials(partials, fine_bins):
+    """
+    Merges partial results (see _chunk_partial) into one over their combined
+    range.
+    """
+    partials = [p for p in partials if p is not None]
+    if len(partials) == 0:
+        return None
+    if len(partials) == 1 and len(partials[0][2]) == fine_bins:
+        return partials[0]
+    lo = min(p[0] for p in partials)
+    hi = max(p[1] for p in partials)
+    total = sum(int(p[2].sum()) for p in partials)
+    counts = np.zeros(fine_bins, dtype=np.int64)
+    if hi == lo:
+        counts[0] = total
+        return lo, hi, counts
+    edges = np.linspace(lo, hi, fine_bins + 1)
+    cdf = sum(_partial_cdf(p, edges) for p in partials)
+    cdf = np.round(cdf).astype(np.int64)
+    cdf[0] = 0
+    cdf[-1] = total
+    return lo, hi, np.diff(cdf)
+
+
+def _finalize(partial, bins, q):
+    """
+    Histogram with bins bins over the full range, bin centers, range and
+    percentiles q from a merged partial result.
+    """
+    if partial is None:
+        edges = np.linspace(0, 1, bins + 1)
+        return (
+            np.zeros(bins, dtype=np.int64),
+            edges,
+            (edges[:-1] + edges[1:]) / 2,
+            np.array([np.nan, np.nan]),
+            np.full(len(q), np.nan),
+        )
+    lo, hi, fine_counts = partial
+    total = fine_counts.sum()
+    if hi == lo:
+        edges = np.linspace(lo - 0.5, lo + 0.5, bins + 1)
+        counts = np.zeros(bins, dtype=np.int64)
+        counts[bins // 2] = total
+        percentile = np.full(len(q), lo)
+    else:
+        edges = np.linspace(lo, hi, bins + 1)
+        cdf = np.round(_partial_cdf(partial, edges)).astype(np.int64)
+        cdf[-1] = total
+        counts = np.diff(cdf)
+        fine_edges = np.linspace(lo, hi, len(fine_counts) + 1)
+        fine_cdf = np.concatenate([[0], np.cumsum(fine_counts)])
+        percentile = np.interp(np.asarray(q) / 100 * total, fine_cdf, fine_edges)
+    return (
+        counts,
+        edges,
+        (edges[:-1] + edges[1:]) / 2,
+        np.array([lo, hi]),
+        percentile,
+    )
+
+
+class StackStatistics:
+    """
+    Accumulates range, histogram and percentiles of an image stack one chunk at a
+    time.
+
+    Parameters
+    ----------
+    fine_bins : int, optional
+        Number of bins of the internal histogram. Percentiles and histogram edges
+        are accurate to about (max - min) / fine_bins.
+
+    Examples
+    --------
+    >>> stats = StackStatistics()
+    >>> for i in range(0, len(data), 10):
+    ...     stats.update(data[i : i + 10])
+    >>> hist, r, percentile, bin_centers = stats.result(bins=200)
+    """
+
+    def __init__(self, fine_bins=4096):
+        self.fine_bins = fine_bins
+        self._partial = None
+
+    def update(self, chunk):
+        partial = _chunk_partial(chunk, self.fine_bins)
+        self._partial = _merge_partials([self._partial, partial], self.fine_bins)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the values accumulated by another StackStatistics.
+        """
+        self._partial = _merge_partials([self._partial, other._partial], self.fine_bins)
+        return self
+
+    def result(self, bins=200, q=(0.5, 99.5)):
+        """
+        Returns
+        -------
+        hist : tuple
+            (frequency, bin_edges), like np.histogram.
+        r : ndarray
+            [min, max] of the finite values.
+        percentile : ndarray
+            Approximate percentiles q.
+        bin_centers : ndarray
+            Centers of the histogram bins.
+        """
+        counts, edges, centers, r, percentile = _finalize(self._partial, bins, q)
+        return (counts, edges), r, percentile, centers
+
+
+def stack_statistics(data, bins=200, q=(0.5, 99.5), fine_bins=4096, chunk_mb=64):
+    """
+    Range, histogram and percentiles of an image stack in a single pass over the
+    data.
+
+    Parameters
+    ----------
+    data : dask.array, ndarray or h5py.Dataset
+        Image stack. For dask arrays, the results are dask arrays that share the
+        graph of data, so data and its statistics can be computed (or stored)
+        together while reading each chunk only once.
+    bins : int, optional
+        Number of histogram bins.
+    q : tuple, optional
+        Percentiles to compute, in [0, 100].
+    fine_bins : int, optional
+        See `StackStatistics`.
+    chunk_mb : float, optional
+        Size of the chunks read along axis 0 for non-dask data.
+
+    Returns
+    -------
+    hist : tuple
+        (frequency, bin_edges), like np.histogram.
+    r : array
+        [min, max] of the finite values.
+    percentile : array
+        Approximate percentiles q.
+    bin_centers : array
+        Centers of the histogram bins.
+    """
+    if isinstance(data, da.Array):
+        # keep the original graph keys, so they are shared with data
+        partials = [
+            dask.delayed(_chunk_partial)(block, fine_bins)
+            for block in data.to_delayed(optimize_graph=False).ravel()
+        ]
+        merged = dask.delayed(_merge_partials)(partials, fine_bins)
+        result = dask.delayed(_finalize, nout=5)(merged, bins, q)
+        counts, edges, centers, r, percentile = [
+            da.from_delayed(value, shape=shape, dtype=dtype)
+            for value, shape, dtype in zip(
+                result,
+                [(bins,), (bins + 1,), (bins,), (2,), (len(q),)],
+                [np.int64, np.float64, np.float64, np.float64, np.float64],
+            )
+        ]
+        return (counts, edges), r, percentile, centers
+
+    stats = StackStatistics(fine_bins)
+    if data.ndim == 0 or data.shape[0] == 0:
+        return stats.result(bins, q)
+    image_nbytes = data[0].size * np.dtype(data.dtype).itemsize
+    step = max(int(chunk_mb * 1024**2 // max(image_nbytes, 1)), 1)
+    for i in range(0, data.shape[0], step):
+        stats.update(data[i : i + step])
+    return stats.result(bins, q)
@@ -0,0 +1,234 @@
+"""
+Level-of-detail access to image stacks for the viewers.
+
+The browser only needs as many pixels as the figure has on screen. `TileServer`
+picks the coarsest pyramid level that still has at least one image pixel per
+screen pixel over the visible region, and returns only the tiles that cover
+that region. Tiles are cached as C-contiguous float32 arrays, which is what the
+image widgets send to the browser, so a cached tile is sent without another
+read, cast or copy.
+"""
+
+import threading
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TileServer:
+    """
+    Serves the visible part of a frame from the best pyramid level.
+
+    Parameters
+    ----------
+    levels : list
+        Stacks (frames, rows, cols) from finest to coarsest, e.g. the original
+        data followed by its downsampled levels. Anything indexable as
+        [frame, rows, cols] works (ndarray, h5py dataset, `LazyFrames`).
+    tile_size : int, optional
+        Tile edge length in pixels.
+    cache_mb : float, optional
+        Memory for cached tiles.
+    """
+
+    tile_size = 256
+    cache_mb = 256
+    # frames read ahead in the direction of travel
+    prefetch_count = 4
+    # image pixels per screen pixel required before a coarser level is used
+    oversample = 1.0
+
+    def __init__(self, levels, tile_size=None, cache_mb=None):
+        if len(levels) == 0:
+            raise ValueError("At least one level is needed.")
+        self.levels = list(levels)
+        if tile_size is not None:
+            self.tile_size = tile_size
+        if cache_mb is not None:
+            self.cache_mb = cache_mb
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+        self.last_view = None
+
+    def __len__(self):
+        return self.levels[0].shape[0]
+
+    def choose_level(self, x_range, y_range, screen_px):
+        """
+        Coarsest level that shows the visible region at screen resolution.
+
+        Parameters
+        ----------
+        x_range, y_range : tuple
+            Visible region as fractions (0 to 1) of the frame width and height.
+        screen_px : tuple
+            Figure size in screen pixels (width, height).
+
+        Returns
+        -------
+        level : int
+            Index into levels.
+        """
+        fx = max(x_range[1] - x_range[0], 0)
+        fy = max(y_range[1] - y_range[0], 0)
+        need_x = screen_px[0] * self.oversample
+        need_y = screen_px[1] * self.oversample
+        for level in range(len(self.levels) - 1, 0, -1):
+            _, rows, cols = self.levels[level].shape
+            if fx * cols >= need_x and fy * rows >= need_y:
+                return level
+        return 0
+
+    def _tile_box(self, level, x_range, y_range):
+        # tile-aligned (row, col) bounds covering the visible region
+        _, rows, cols = self.levels[level].shape
+        t = self.tile_size
+        r0 = int(np.clip(np.floor(y_range[0] * rows), 0, rows - 1)) // t
+        c0 = int(np.clip(np.floor(x_range[0] * cols), 0, cols - 1)) // t
+        r1 = int(np.clip(np.ceil(y_range[1] * rows), r0 * t + 1, rows) - 1) // t + 1
+        c1 = int(np.clip(np.ceil(x_range[1] * cols), c0 * t + 1, cols) - 1) // t + 1
+        return r0, r1, c0, c1
+
+    def _store(self, key, tile):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = tile
+            self._cache_bytes += tile.nbytes
+            while self._cache_bytes > self.cache_mb * 1024**2 and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self._cache_bytes -= old.nbytes
+
+    def _cached(self, key):
+        with self._lock:
+            tile = self._cache.get(key)
+            if tile is not None:
+                self._cache.move_to_end(key)
+            return tile
+
+    def _read_tiles(self, frame, level, box):
+        # Reads all tiles in box with one read, or from the whole frame when box
+        # covers it (so that frame caching and prefetching in the source apply).
+        source = self.levels[level]
+        _, rows, cols = source.shape
+        t = self.tile_size
+        r0, r1, c0, c1 = box
+        rows_slice = slice(r0 * t, min(r1 * t, rows))
+        cols_slice = slice(c0 * t, min(c1 * t, cols))
+        if rows_slice == slice(0, rows) and cols_slice == slice(0, cols):
+            region = np.asarray(source[frame])
+        else:
+            region = np.asarray(source[frame, rows_slice, cols_slice])
+        tiles = {}
+        for tr in range(r0, r1):
+            for tc in range(c0, c1):
+                tile = region[
+                    (tr - r0) * t : (tr - r0 + 1) * t,
+                    (tc - c0) * t : (tc - c0 + 1) * t,
+                ]
+                tile = np.ascontiguousarray(tile, dtype=np.float32)
+                tiles[(level, frame, tr, tc)] = tile
+                self._store((level, frame, tr, tc), tile)
+        return tiles
+
+    def tiles(self, frame, level, box):
+        """
+        Tiles (level, frame, tile_row, tile_col) -> array in box, read as needed.
+        """
+        r0, r1, c0, c1 = box
+        tiles = {}
+        for tr in range(r0, r1):
+            for tc in range(c0, c1):
+                tile = self._cached((level, frame, tr, tc))
+                if tile is None:
+                    return self._read_tiles(frame, level, box)
+                tiles[(level, frame, tr, tc)] = tile
+        return tiles
+
+    def view(self, frame, x_range=(0, 1), y_range=(0, 1), screen_px=(550, 550)):
+        """
+        Visible part of a frame at screen resolution.
+
+        Parameters
+        ----------
+        frame : int
+            Frame index.
+        x_range, y_range : tuple, optional
+            Visible region as fractions (0 to 1) of the frame width and height.
+        screen_px : tuple, optional
+            Figure size in screen pixels (width, height).
+
+        Returns
+        -------
+        image : ndarray
+            float32 image covering at least the visible region.
+        x_extent, y_extent : tuple
+            Part of the frame covered by image, as fractions of its width and
+            height.
+        level : int
+            Index of the level image was taken from.
+        """
+        frame = int(frame) % len(self)
+        x_range = tuple(np.clip(sorted(x_range), 0, 1))
+        y_range = tuple(np.clip(sorted(y_range), 0, 1))
+        level = self.choose_level(x_range, y_range, screen_px)
+        box = self._tile_box(level, x_range, y_range)
+        tiles = self.tiles(frame, level, box)
+        _, rows, cols = self.levels[level].shape
+        t = self.tile_size
+        r0, r1, c0, c1 = box
+        row_stop = min(r1 * t, rows)
+        col_stop = min(c1 * t, cols)
+        image = np.empty((row_stop - r0 * t, col_stop - c0 * t), dtype=np.float32)
+        for (_, _, tr, tc), tile in tiles.items():
+            y = (tr - r0) * t
+            x = (tc - c0) * t
+            image[y : y + tile.shape[0], x : x + tile.shape[1]] = tile
+        self.last_view = (level, box)
+        x_extent = (c0 * t / cols, col_stop / cols)
+        y_extent = (r0 * t / rows, row_stop / rows)
+        return image, x_extent, y_extent, level
+
+    def _prefetch_one(self, frame, level, box):
+        try:
+            self.tiles(frame, level, box)
+        finally:
+            with self._lock:
+                self._pending.discard((level, frame, box))
+
+    def prefetch(self, frame, step=1, count=None):
+        """
+        Reads the tiles of the last view for the count frames after frame (in
+        steps of step) into the cache in a background thread.
+        """
+        if self.last_view is None:
+            return
+        if count is None:
+            count = self.prefetch_count
+        level, box = self.last_view
+        step = int(np.sign(step)) or 1
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        for i in range(1, count + 1):
+            _frame = (int(frame) + i * step) % len(self)
+            key = (level, _frame, box)
+            with self._lock:
+                if key in self._pending:
+                    continue
+                self._pending.add(key)
+            self._executor.submit(self._prefetch_one, _frame, level, box)
+
+    def close(self):
+        """
+        Stops prefetching and empties the cache. The levels are not closed.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
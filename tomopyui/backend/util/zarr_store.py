@@ -0,0 +1,254 @@
+"""
+Zarr storage, used in place of HDF5 files for the normalized data, its
+downsampled pyramid and reconstructions.
+
+A Zarr store is a directory with one file per chunk, so many processes can write
+different chunks of the same array at once, and partial reads only touch the
+chunks they need. `ZarrFile` opens a store with the subset of the h5py.File
+interface the rest of tomopyui uses (keys like "/process/normalized/data",
+`in`, `del`, create_dataset, close, ...), and `open_store` opens either kind of
+file, so code that reads hdf5 files reads Zarr stores the same way.
+
+The pyramid is described with OME-Zarr (NGFF 0.5) multiscales metadata, so
+other tools can open it as a multi-resolution image.
+"""
+
+import pathlib
+import numpy as np
+
+from tomopyui.backend.util.hdf_pool import hdf_pool
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+storage_backends = ["hdf5", "zarr"]
+store_suffixes = {"hdf5": ".hdf5", "zarr": ".zarr"}
+
+
+def store_path(filepath, backend="hdf5"):
+    """
+    filepath with the suffix used by backend, e.g. normalized_projections.zarr.
+    """
+    if backend not in storage_backends:
+        raise ValueError(
+            f"Unknown storage backend: '{backend}'. Choose one of {storage_backends}."
+        )
+    return pathlib.Path(filepath).with_suffix(store_suffixes[backend])
+
+
+def find_store(filepath):
+    """
+    The existing store for filepath: filepath itself, or else the same file
+    name with the suffix of another backend. Returns filepath if neither
+    exists.
+    """
+    filepath = pathlib.Path(filepath)
+    if filepath.exists():
+        return filepath
+    for backend in storage_backends:
+        path = store_path(filepath, backend)
+        if path.exists():
+            return path
+    return filepath
+
+
+def store_exists(filepath):
+    return find_store(filepath).exists()
+
+
+def open_store(filepath, mode="r"):
+    """
+    Opens an hdf5 file or a Zarr store (`ZarrFile`), depending on the suffix of
+    the existing store for filepath (see `find_store`). hdf5 files are borrowed
+    from hdf_pool (see `HDF5FilePool`); closing them gives them back.
+
+    Parameters
+    ----------
+    filepath : pathlib.Path or str
+    mode : str, optional
+        "r", "r+", "a" or "w", as for h5py.File.
+    """
+    filepath = find_store(filepath)
+    if filepath.suffix == store_suffixes["zarr"]:
+        return ZarrFile(filepath, mode)
+    return hdf_pool.open(filepath, mode)
+
+
+def zarr_compressors(compression=None, compression_opts=None, shuffle=True):
+    """
+    Zarr codecs equivalent to the hdf5 compression options of `HDF5Layout`.
+    Each chunk is compressed on its own.
+    """
+    if compression is None:
+        return None
+    if zarr is None:
+        raise ImportError("Writing Zarr stores needs zarr>=3 (the zarr extra).")
+    codecs = zarr.codecs
+    shuffle = "shuffle" if shuffle else "noshuffle"
+    if compression == "gzip":
+        level = 4 if compression_opts is None else compression_opts
+        return (codecs.GzipCodec(level=level),)
+    if compression == "zstd":
+        level = 3 if compression_opts is None else compression_opts
+        return (codecs.ZstdCodec(level=level),)
+    if compression == "lzf":
+        # no lzf codec in zarr; lz4 is the closest (fast, light)
+        return (codecs.BloscCodec(cname="lz4", clevel=5, shuffle=shuffle),)
+    clevel = 5 if compression_opts is None else compression_opts
+    return (codecs.BloscCodec(cname="zstd", clevel=clevel, shuffle=shuffle),)
+
+
+class ZarrGroup:
+    """
+    h5py.Group-like access to a zarr group. Arrays are returned as zarr arrays,
+    which are sliced and assigned to like h5py datasets.
+    """
+
+    def __init__(self, group):
+        self._group = group
+
+    @staticmethod
+    def _key(key):
+        return str(key).strip("/")
+
+    def _require_group(self, key):
+        group = self._group
+        for part in self._key(key).split("/"):
+            if part:
+                group = group.require_group(part)
+        return group
+
+    def __getitem__(self, key):
+        key = self._key(key)
+        if key == "":
+            return self
+        node = self._group[key]
+        if isinstance(node, zarr.Group):
+            return ZarrGroup(node)
+        return node
+
+    def __contains__(self, key):
+        try:
+            self._group[self._key(key)]
+        except KeyError:
+            return False
+        return True
+
+    def __delitem__(self, key):
+        del self._group[self._key(key)]
+
+    def __iter__(self):
+        return iter(self._group.keys())
+
+    def keys(self):
+        return self._group.keys()
+
+    @property
+    def attrs(self):
+        return self._group.attrs
+
+    def require_group(self, key):
+        return ZarrGroup(self._require_group(key))
+
+    def create_dataset(
+        self, name, shape=None, dtype=None, data=None, chunks=None, **kwargs
+    ):
+        """
+        Creates an array, like h5py's create_dataset. Groups on the way are
+        created. h5py filter options (compression, shuffle, ...) are ignored;
+        pass compressors (see `zarr_compressors`) instead.
+        """
+        if data is not None:
+            data = np.asarray(data)
+            shape = data.shape
+            dtype = data.dtype if dtype is None else dtype
+        parent, _, leaf = self._key(name).rpartition("/")
+        group = self._require_group(parent)
+        array_kwargs = {"compressors": kwargs.get("compressors")}
+        if chunks is not None and chunks is not True and len(shape) > 0:
+            array_kwargs["chunks"] = tuple(chunks)
+        array = group.create_array(leaf, shape=shape, dtype=dtype, **array_kwargs)
+        if data is not None:
+            array[...] = data
+        return array
+
+    def require_dataset(self, name, shape, dtype, **kwargs):
+        if name in self:
+            array = self[name]
+            if tuple(array.shape) != tuple(shape):
+                raise TypeError(
+                    f"Shapes do not match (existing {array.shape} vs new {shape})."
+                )
+            return array
+        return self.create_dataset(name, shape=shape, dtype=dtype, **kwargs)
+
+
+class ZarrFile(ZarrGroup):
+    """
+    A Zarr store opened like an h5py.File. Evaluates to False once closed, like
+    h5py.File.
+
+    Parameters
+    ----------
+    filepath : pathlib.Path or str
+        Store directory (*.zarr).
+    mode : str, optional
+        "r", "r+", "a" or "w".
+    """
+
+    def __init__(self, filepath, mode="r"):
+        if zarr is None:
+            raise ImportError("Opening Zarr stores needs zarr>=3 (the zarr extra).")
+        self.filename = str(filepath)
+        self.mode = mode
+        super().__init__(zarr.open_group(str(filepath), mode=mode))
+
+    def __bool__(self):
+        return self._group is not None
+
+    def close(self):
+        self._group = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_multiscales(group, datasets, name=None):
+    """
+    Describes arrays of group as the levels of a multi-resolution image, with
+    OME-Zarr (NGFF 0.5) multiscales metadata.
+
+    Parameters
+    ----------
+    group : `ZarrGroup`
+        Group holding (under it) all levels.
+    datasets : list of tuple
+        (path, scale) of each level from finest to coarsest, path relative to
+        group and scale the (angle, y, x) pixel size of that level, e.g.
+        ("downsampled/0/data", (1, 2, 2)).
+    name : str, optional
+    """
+    multiscale = {
+        "axes": [
+            {"name": "angle"},
+            {"name": "y", "type": "space"},
+            {"name": "x", "type": "space"},
+        ],
+        "datasets": [
+            {
+                "path": path,
+                "coordinateTransformations": [
+                    {"type": "scale", "scale": [float(s) for s in scale]}
+                ],
+            }
+            for path, scale in datasets
+        ],
+    }
+    if name is not None:
+        multiscale["name"] = name
+    group.attrs["ome"] = {"version": "0.5", "multiscales": [multiscale]}
@@ -0,0 +1,274 @@
+import astra
+import cupy as cp
+import numpy as np
+import tomopyui.tomocupy.recon.algorithm as tomocupy_algorithm
+
+from tomopy.recon import algorithm as tomopy_algorithm
+from tomopy.recon import wrappers
+from tomopyui.backend.util.recon_context import ReconContext
+
+
+def _gpu_link(arr):
+    """
+    Links a C-contiguous (z, y, x) float32 cupy array to astra without copying.
+    """
+    z, y, x = arr.shape
+    return astra.pythonutils.GPULink(arr.data.ptr, x, y, z, arr.strides[1])
+
+
+class AstraReconContext(ReconContext):
+    """
+    Reconstruction context keeping the projections, the reconstruction and the
+    simulated projections on the GPU, linked to astra data objects.
+
+    Geometry, data objects and the forward projector are created once.
+    Between iterations only the shifted projections are uploaded, the
+    reconstruction never leaves the GPU, and simulated projections are
+    downloaded once per iteration.
+
+    Parameters
+    ----------
+    prjs : ndarray
+        Projections (N, rows, cols).
+    angles : array-like
+        Projection angles (rad).
+    center : float, optional
+        Center of rotation.
+    algorithm : str, optional
+        One of the keys in algorithms.
+    recon : ndarray, optional
+        Starting reconstruction (rows, cols, cols). Defaults to zeros.
+    ncore : int, optional
+        Not used, for compatibility with the CPU contexts.
+    extra_options : dict, optional
+        astra options for the algorithm, e.g. {"MinConstraint": 0}.
+    num_batches : int, optional
+        Not used, the whole dataset is re-projected at once.
+    """
+
+    algorithms = {"SIRT_3D": "SIRT3D_CUDA", "CGLS_3D": "CGLS3D_CUDA"}
+
+    def __init__(
+        self,
+        prjs,
+        angles,
+        center=None,
+        algorithm="SIRT_3D",
+        recon=None,
+        ncore=None,
+        extra_options=None,
+        num_batches=None,
+    ):
+        if algorithm not in self.algorithms:
+            raise ValueError(
+                f"Unknown reconstruction algorithm: '{algorithm}'. "
+                f"Choose one of {list(self.algorithms.keys())}."
+            )
+        self.algorithm = algorithm
+        self.extra_options = extra_options
+        num_prj, num_y, num_x = prjs.shape
+        self.proj_geom = astra.create_proj_geom(
+            "parallel3d", 1, 1, num_y, num_x, angles
+        )
+        if center is not None:
+            center_shift = -(center - num_x / 2)
+            self.proj_geom = astra.geom_postalignment(self.proj_geom, (center_shift,))
+        self.vol_geom = astra.create_vol_geom(num_x, num_x, num_y)
+
+        # astra's projection data order is (rows, angles, cols)
+        self.sino = cp.empty((num_y, num_prj, num_x), dtype=cp.float32)
+        self.sim = cp.zeros_like(self.sino)
+        if recon is None:
+            self.vol = cp.zeros((num_y, num_x, num_x), dtype=cp.float32)
+        else:
+            self.vol = cp.ascontiguousarray(cp.asarray(recon, dtype=cp.float32))
+        self.update_projections(prjs)
+
+        self.sino_id = astra.data3d.link("-sino", self.proj_geom, _gpu_link(self.sino))
+        self.sim_id = astra.data3d.link("-sino", self.proj_geom, _gpu_link(self.sim))
+        self.vol_id = astra.data3d.link("-vol", self.vol_geom, _gpu_link(self.vol))
+        cfg = astra.astra_dict("FP3D_CUDA")
+        cfg["VolumeDataId"] = self.vol_id
+        cfg["ProjectionDataId"] = self.sim_id
+        self.fp_id = astra.algorithm.create(cfg)
+
+    def update_projections(self, prjs, indices=None):
+        if indices is None:
+            self.sino[:] = cp.asarray(prjs, dtype=cp.float32).swapaxes(0, 1)
+        elif len(indices) > 0:
+            _prjs = cp.asarray(prjs[indices], dtype=cp.float32)
+            self.sino[:, cp.asarray(indices), :] = _prjs.swapaxes(0, 1)
+
+    def reconstruct(self, num_iter=1):
+        # The algorithm object is cheap to make, and a new one makes sure it
+        # picks up the updated projections. The data stays where it is.
+        cfg = astra.astra_dict(self.algorithms[self.algorithm])
+        cfg["ProjectionDataId"] = self.sino_id
+        cfg["ReconstructionDataId"] = self.vol_id
+        if self.extra_options:
+            cfg["option"] = dict(self.extra_options)
+        alg_id = astra.algorithm.create(cfg)
+        astra.algorithm.run(alg_id, num_iter)
+        astra.algorithm.delete(alg_id)
+        self.vol[cp.isnan(self.vol)] = 0
+
+    def forward_project(self, progress=None):
+        astra.algorithm.run(self.fp_id)
+        sim = cp.asnumpy(cp.ascontiguousarray(self.sim.swapaxes(0, 1)))
+        if progress is not None:
+            progress.value = progress.max
+        return sim
+
+    def get_recon(self):
+        return cp.asnumpy(self.vol)
+
+    def close(self):
+        if self.fp_id is None:
+            return
+        astra.algorithm.delete(self.fp_id)
+        astra.data3d.delete([self.sino_id, self.sim_id, self.vol_id])
+        self.fp_id = None
+        self.sino = self.sim = self.vol = None
+        cp.get_default_memory_pool().free_all_blocks()
+
+
+class AstraHostReconContext(ReconContext):
+    """
+    Reconstruction context for the astra methods that work from host memory:
+    the 2D CUDA algorithms through tomopy's astra wrapper, and the SIRT
+    plugin. Projections and reconstruction stay on the host between calls, and
+    re-projection goes through `simulate_projections` in num_batches slabs.
+
+    Parameters
+    ----------
+    prjs : ndarray
+        Projections (N, rows, cols).
+    angles : array-like
+        Projection angles (rad).
+    center : float, optional
+        Center of rotation.
+    algorithm : str, optional
+        One of algorithms.
+    recon : ndarray, optional
+        Starting reconstruction (rows, cols, cols).
+    ncore : int, optional
+        Not used, astra runs on one thread.
+    extra_options : dict, optional
+        astra options for the algorithm, e.g. {"MinConstraint": 0}.
+    num_batches : int, optional
+        Number of slabs to re-project at a time.
+    """
+
+    algorithms = [
+        "FBP_CUDA",
+        "SIRT_CUDA",
+        "SART_CUDA",
+        "CGLS_CUDA",
+        "MLEM_CUDA",
+        "SIRT_Plugin",
+    ]
+
+    def __init__(
+        self,
+        prjs,
+        angles,
+        center=None,
+        algorithm="SIRT_CUDA",
+        recon=None,
+        ncore=None,
+        extra_options=None,
+        num_batches=1,
+    ):
+        if algorithm not in self.algorithms:
+            raise ValueError(
+                f"Unknown reconstruction algorithm: '{algorithm}'. "
+                f"Choose one of {self.algorithms}."
+            )
+        self.prjs = np.array(prjs, dtype=np.float32)
+        self.angles = angles
+        self.center = center
+        self.algorithm = algorithm
+        self.extra_options = extra_options
+        self.num_batches = num_batches
+        self.recon = None if recon is None else np.array(recon, dtype=np.float32)
+
+    def update_projections(self, prjs, indices=None):
+        if indices is None:
+            self.prjs[:] = prjs
+        elif len(indices) > 0:
+            self.prjs[indices] = prjs[indices]
+
+    def reconstruct(self, num_iter=1):
+        if self.algorithm == "SIRT_Plugin":
+            self.recon = tomocupy_algorithm.recon_sirt_plugin(
+                self.prjs,
+                self.angles,
+                num_iter=num_iter,
+                rec=self.recon,
+                center=self.center,
+            )
+        else:
+            method = "EM_CUDA" if self.algorithm == "MLEM_CUDA" else self.algorithm
+            options = {"proj_type": "cuda", "method": method, "num_iter": int(num_iter)}
+            if self.extra_options:
+                options["extra_options"] = self.extra_options
+            kwargs = {"options": options}
+            if self.recon is not None and self.algorithm != "FBP_CUDA":
+                kwargs["init_recon"] = self.recon
+            self.recon = tomopy_algorithm.recon(
+                self.prjs,
+                self.angles,
+                algorithm=wrappers.astra,
+                center=self.center,
+                ncore=1,
+                **kwargs,
+            )
+        self.recon[np.isnan(self.recon)] = 0
+        return self.recon
+
+    def forward_project(self, progress=None):
+        sim = []
+        simulate_projections(
+            np.array_split(self.recon, self.num_batches, axis=0),
+            sim,
+            self.center,
+            self.angles,
+            progress=progress,
+        )
+        sim = np.concatenate(sim, axis=1)
+        # tomopy's astra wrapper reconstructs flipped with respect to astra's
+        # 3D projector
+        if self.algorithm != "SIRT_Plugin":
+            sim = np.flip(sim, axis=0)
+        return sim
+
+    def get_recon(self):
+        return self.recon
+
+
+def simulate_projections(rec, sim, center, theta, progress=None):
+    for batch in range(len(rec)):
+        # for batch in tnrange(len(rec), desc="Re-projection", leave=True):
+        _rec = rec[batch]
+        vol_geom = astra.create_vol_geom(_rec.shape[1], _rec.shape[1], _rec.shape[0])
+        phantom_id = astra.data3d.create("-vol", vol_geom, data=_rec)
+        proj_geom = astra.create_proj_geom(
+            "parallel3d",
+            1,
+            1,
+            _rec.shape[0],
+            _rec.shape[1],
+            theta,
+        )
+        if center is not None:
+            center_shift = -(center - _rec.shape[1] / 2)
+            proj_geom = astra.geom_postalignment(proj_geom, (center_shift,))
+        projections_id, _sim = astra.creators.create_sino3d_gpu(
+            phantom_id, proj_geom, vol_geom
+        )
+        _sim = _sim.swapaxes(0, 1)
+        sim.append(_sim)
+        astra.data3d.delete(projections_id)
+        astra.data3d.delete(phantom_id)
+        if progress is not None:
+            progress.value += 1
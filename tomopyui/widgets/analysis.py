@@ -11,6 +11,7 @@ from tomopyui.widgets.view import (
     BqImViewer_Projections_Child,
 )
 from tomopyui.backend.runanalysis import RunAlign, RunRecon
+from tomopyui.backend.util.recon_engines import engine_labels
 from tomopyui.backend.io import (
     Projections_Child,
     Metadata_Align,
@@ -54,12 +55,9 @@ class AnalysisBase(ABC):
         self.padding_y = 20
         self.use_subset_correlation = False
         self.pre_alignment_iters = 1
-        self.tomopy_methods_list = [key for key in tomopy_recon_algorithm_kwargs]
-        self.tomopy_methods_list.remove("gridrec")
-        self.tomopy_methods_list.remove("fbp")
-        self.astra_cuda_methods_list = [
-            key for key in astra_cuda_recon_algorithm_kwargs
-        ]
+        self.tomopy_methods_list = engine_labels("Tomopy", iterative=True)
+        self.cpu_methods_list = engine_labels("CPU")
+        self.astra_cuda_methods_list = engine_labels("Astra")
         self.run_list = []
         self.header_font_style = {
             "font_size": "22px",
@@ -149,11 +147,16 @@ class AnalysisBase(ABC):
         # -- Method Options -------------------------------------------------------
         self.methods_opts = {
             key: False
-            for key in self.tomopy_methods_list + self.astra_cuda_methods_list
+            for key in self.tomopy_methods_list
+            + self.cpu_methods_list
+            + self.astra_cuda_methods_list
         }
         self.tomopy_methods_checkboxes = self.create_checkboxes_from_opt_list(
             self.tomopy_methods_list, self.methods_opts
         )
+        self.cpu_methods_checkboxes = self.create_checkboxes_from_opt_list(
+            self.cpu_methods_list, self.methods_opts
+        )
         self.astra_cuda_methods_checkboxes = self.create_checkboxes_from_opt_list(
             self.astra_cuda_methods_list, self.methods_opts
         )
@@ -468,6 +471,17 @@ class AnalysisBase(ABC):
             layout=Layout(align_items="center"),
         )
 
+        self.cpu_methods_hbox = VBox(
+            [
+                Label("CPU", style=self.header_font_style),
+                VBox(
+                    self.cpu_methods_checkboxes,
+                    layout=Layout(flex_flow="column wrap"),
+                ),
+            ],
+            layout=Layout(align_items="center"),
+        )
+
         self.astra_methods_hbox = VBox(
             [
                 Label("Astra", style=self.header_font_style),
@@ -480,7 +494,7 @@ class AnalysisBase(ABC):
         )
 
         recon_method_box = HBox(
-            [self.tomopy_methods_hbox, self.astra_methods_hbox],
+            [self.tomopy_methods_hbox, self.cpu_methods_hbox, self.astra_methods_hbox],
             layout=Layout(width="auto"),
         )
         self.methods_accordion = Accordion(
@@ -525,6 +539,11 @@ class Align(AnalysisBase):
         self.metadata = Metadata_Align()
         self.subset_x = None
         self.subset_y = None
+        self.multiresolution = False
+        self.refine_iters = 2
+        self.multires_finest_level = -1
+        # 0 turns a stopping criterion off, see ConvergencePolicy
+        self.convergence_opts = {"tol": 0, "plateau_window": 0, "freeze_tol": 0}
         self.save_opts_list = [
             "Projections Before Alignment",
             "Projections After Alignment",
@@ -565,6 +584,32 @@ class Align(AnalysisBase):
             style=extend_description_style,
             value=self.upsample_factor,
         )
+        # -- Coarse-to-fine alignment ------------------------------------------
+        self.multiresolution_checkbox = Checkbox(
+            description="Coarse-to-fine",
+            value=self.multiresolution,
+        )
+        self.refine_iters_textbox = IntText(
+            description="Refinement iterations: ",
+            style=extend_description_style,
+            value=self.refine_iters,
+        )
+        # -- Early stopping -----------------------------------------------------
+        self.conv_tol_textbox = FloatText(
+            description="Stop below shift (px): ",
+            style=extend_description_style,
+            value=self.convergence_opts["tol"],
+        )
+        self.plateau_window_textbox = IntText(
+            description="Stop on plateau (iterations): ",
+            style=extend_description_style,
+            value=self.convergence_opts["plateau_window"],
+        )
+        self.freeze_tol_textbox = FloatText(
+            description="Freeze below shift (px): ",
+            style=extend_description_style,
+            value=self.convergence_opts["freeze_tol"],
+        )
         # Copy parent histograms?
         self.copy_parent_hists_checkbox = Checkbox(
             description="Copy parent histograms", value=True
@@ -597,6 +642,23 @@ class Align(AnalysisBase):
         # Shift dataset after
         self.shift_data_after_checkbox.observe(self.update_shift_data, names="value")
 
+        # Coarse-to-fine
+        self.multiresolution_checkbox.observe(
+            self.update_multiresolution, names="value"
+        )
+        self.refine_iters_textbox.observe(self.update_refine_iters, names="value")
+
+        # Early stopping
+        self.conv_tol_textbox.observe(
+            self.update_convergence_opts("tol"), names="value"
+        )
+        self.plateau_window_textbox.observe(
+            self.update_convergence_opts("plateau_window"), names="value"
+        )
+        self.freeze_tol_textbox.observe(
+            self.update_convergence_opts("freeze_tol"), names="value"
+        )
+
     def use_this_alignment(self):
         if self.analysis.saved_as_hdf:
             pass
@@ -617,6 +679,18 @@ class Align(AnalysisBase):
     def update_upsample_factor(self, change):
         self.upsample_factor = change.new
 
+    def update_multiresolution(self, change):
+        self.multiresolution = change.new
+
+    def update_refine_iters(self, change):
+        self.refine_iters = change.new
+
+    def update_convergence_opts(self, key):
+        def update(change):
+            self.convergence_opts[key] = change.new
+
+        return update
+
     def update_num_batches(self, change):
         self.num_batches = change.new
         self.progress_phase_cross_corr.max = change.new
@@ -668,6 +742,19 @@ class Align(AnalysisBase):
                         ),
                         HBox([self.padding_x_textbox, self.padding_y_textbox]),
                         HBox([self.downsample_checkbox, self.ds_factor_dropdown]),
+                        HBox(
+                            [
+                                self.multiresolution_checkbox,
+                                self.refine_iters_textbox,
+                            ]
+                        ),
+                        HBox(
+                            [
+                                self.conv_tol_textbox,
+                                self.plateau_window_textbox,
+                                self.freeze_tol_textbox,
+                            ]
+                        ),
                         self.use_subset_correlation_checkbox,
                         self.num_batches_textbox,
                         self.upsample_factor_textbox,
@@ -717,6 +804,8 @@ class Recon(AnalysisBase):
         super().init_attributes(Import, Center)
         self.metadata = Metadata_Recon()
         self.save_opts_list = ["Reconstruction"]
+        self.streaming = False
+        self.streaming_format = "hdf5"
         self.Import.Recon = self
         self.init_widgets()
         self.set_observes()
@@ -729,6 +818,19 @@ class Recon(AnalysisBase):
     def init_widgets(self):
         super().init_widgets()
         self.plot_output2 = Output()
+        self.progress_total = IntProgress(description="Slabs: ", value=0, min=0, max=1)
+
+        # Streaming reconstruction (for data that does not fit in memory)
+        self.streaming_checkbox = Checkbox(
+            description="Stream from disk?", value=self.streaming
+        )
+        self.streaming_format_dropdown = Dropdown(
+            options=[("HDF5", "hdf5"), ("Zarr", "zarr"), ("TIFF", "tiff")],
+            value=self.streaming_format,
+            description="Output format: ",
+            disabled=not self.streaming,
+            style=extend_description_style,
+        )
 
         # -- Button to start alignment ----------------------------------------
         self.start_button = Button(
@@ -743,6 +845,10 @@ class Recon(AnalysisBase):
     def set_observes(self):
         super().set_observes()
         self.num_iterations_textbox.observe(self.update_num_iter, names="value")
+        self.streaming_checkbox.observe(self.update_streaming, names="value")
+        self.streaming_format_dropdown.observe(
+            self.update_streaming_format, names="value"
+        )
 
     # TODO: implement load metadata
     # def load_metadata(self):
@@ -764,6 +870,14 @@ class Recon(AnalysisBase):
     def update_num_iter(self, change):
         self.num_iter = change.new
 
+    # Streaming reconstruction
+    def update_streaming(self, change):
+        self.streaming = change.new
+        self.streaming_format_dropdown.disabled = not change.new
+
+    def update_streaming_format(self, change):
+        self.streaming_format = change.new
+
     def run(self):
         self.metadata = Metadata_Recon()
         self.analysis = RunRecon(self)
@@ -788,6 +902,9 @@ class Recon(AnalysisBase):
                         HBox([self.padding_x_textbox, self.padding_y_textbox]),
                         HBox([self.downsample_checkbox, self.ds_factor_dropdown]),
                         self.extra_options_textbox,
+                        HBox(
+                            [self.streaming_checkbox, self.streaming_format_dropdown]
+                        ),
                     ],
                 ),
             ],
@@ -809,6 +926,7 @@ class Recon(AnalysisBase):
                     ]
                 ),
                 self.start_button_hb,
+                self.progress_total,
                 self.plot_output1,
             ]
         )
@@ -7,7 +7,11 @@ from tomopyui._sharedvars import *
 from ipywidgets import *
 from tomopy.recon.rotation import find_center_vo, find_center, find_center_pc
 from tomopyui.widgets.view import BqImViewer_Center, BqImViewer_Center_Recon
-from tomopyui.backend.util.center import write_center
+from tomopyui.backend.util.center import (
+    CenterSweep,
+    find_centers_multislice,
+    sharpness_metrics,
+)
 from tomopyui.widgets.helpers import ReactiveTextButton, ReactiveIconButton
 from scipy.stats import linregress
 
@@ -41,6 +45,11 @@ class Center:
     filter : str
         Filter to be used. Only works with fbp and gridrec. If you choose
         another algorith, this will be ignored.
+    num_auto_slices : int
+        Number of slices to find the center of automatically.
+    metric : str
+        Image quality metric for finding centers automatically (see
+        `tomopyui.backend.util.center.score_reconstructions`).
 
     """
 
@@ -61,12 +70,15 @@ class Center:
         self.num_iter = int(1)
         self.algorithm = "gridrec"
         self.filter = "parzen"
+        self.num_auto_slices = 5
+        self.metric = "entropy"
         self.metadata = {}
         self.viewer = BqImViewer_Center()
         self.viewer.create_app()
         self.rec_viewer = BqImViewer_Center_Recon()
         self.rec_viewer.create_app()
         self.reg = None
+        self.center_sweep = CenterSweep()
         self.header_font_style = {
             "font_size": "22px",
             "font_weight": "bold",
@@ -91,6 +103,8 @@ class Center:
         self.metadata["num_iter"] = self.num_iter
         self.metadata["algorithm"] = self.algorithm
         self.metadata["filter"] = self.filter
+        self.metadata["num_auto_slices"] = self.num_auto_slices
+        self.metadata["metric"] = self.metric
 
     def _init_widgets(self):
 
@@ -134,6 +148,24 @@ class Center:
             "Now search for the center using the reconstruction slider. Add more values if your sample has multiple centers of rotation.",
             warning="Your projections do not have associated theta values.",
         )
+        self.find_centers_multislice_button = ReactiveTextButton(
+            self.find_centers_multislice_on_click,
+            "Click to find centers on multiple slices.",
+            "Finding centers from coarse to fine.",
+            "Found centers.",
+            warning="Your projections do not have associated theta values.",
+        )
+        self.num_auto_slices_textbox = IntText(
+            description="Number of slices: ",
+            disabled=False,
+            style=extend_description_style,
+            value=self.num_auto_slices,
+        )
+        self.metric_dropdown = Dropdown(
+            options=[key for key in sharpness_metrics],
+            value=self.metric,
+            description="Metric:",
+        )
         self.index_to_try_textbox = IntText(
             description="Slice to use: ",
             disabled=False,
@@ -274,6 +306,14 @@ class Center:
         self.filter = change.new
         self.set_metadata()
 
+    def _num_auto_slices_update(self, change):
+        self.num_auto_slices = change.new
+        self.set_metadata()
+
+    def _update_metric(self, change):
+        self.metric = change.new
+        self.set_metadata()
+
     def _slice_slider_update(self, change):
         slider_ind = change.new
         line_display = self.viewer.pxY - slider_ind
@@ -351,6 +391,10 @@ class Center:
         self.search_step_textbox.observe(self._search_step_update, names="value")
         self.algorithms_dropdown.observe(self._update_algorithm, names="value")
         self.filters_dropdown.observe(self._update_filters, names="value")
+        self.num_auto_slices_textbox.observe(
+            self._num_auto_slices_update, names="value"
+        )
+        self.metric_dropdown.observe(self._update_metric, names="value")
         # Callback for index going to center
         self.rec_viewer.image_index_slider.observe(
             self._center_textbox_slider_update, names="value"
@@ -417,12 +461,14 @@ class Center:
             _search_step,
         ]
         # reconstruct, but also pull the centers used out to map to center
-        # textbox
-        self.rec, cen_range = write_center(
+        # textbox. Only centers that were not reconstructed for this slice
+        # before are reconstructed.
+        self.rec, cen_range = self.center_sweep.sweep(
             prj_imgs,
             angles_rad,
             cen_range=cen_range,
             ind=_index_to_try,
+            key=(str(self.projections.filepath), ds_value, self.use_ds),
             mask=True,
             algorithm=self.algorithm,
             filter_name=self.filter,
@@ -435,6 +481,50 @@ class Center:
         self.rec_viewer.plot(self.rec)
         self.add_center_button.button.disabled = False
 
+    def find_centers_multislice_on_click(self, *args):
+        """
+        Finds the center of num_auto_slices evenly spaced slices automatically,
+        searching center_guess +/- search_range on the coarsest pyramid level
+        and refining on each finer level, and fits the tilt of the rotation
+        axis through them. The results replace the centers in
+        center_slice_list.
+        """
+        angles_rad = self.projections.angles_rad
+        if angles_rad is None:
+            self.find_centers_multislice_button.warning()
+            return
+        # only the sinograms of the slices are read from the pyramid levels
+        levels = []
+        for pyramid_level in (2, 1, 0):
+            try:
+                frames = self.projections._lazy_frames(pyramid_level)
+            except KeyError:
+                continue
+            levels.append((frames, np.power(2, int(pyramid_level + 1))))
+        levels.append((self.projections.data, 1))
+        pxY = self.projections.pxY
+        slices = np.linspace(0, pxY, self.num_auto_slices + 2)[1:-1]
+        center_slice_list, _ = find_centers_multislice(
+            levels,
+            angles_rad,
+            [int(x) for x in slices],
+            self.center_guess,
+            search_range=self.search_range,
+            metric=self.metric,
+            algorithm=self.algorithm,
+            filter_name=self.filter,
+            num_iter=self.num_iter,
+            sweep=self.center_sweep,
+            key=str(self.projections.filepath),
+        )
+        self.center_slice_list = [
+            (float(center), int(_slice)) for center, _slice in center_slice_list
+        ]
+        self.update_center_select()
+        self.center_textbox.value = float(
+            np.mean([center for center, _ in self.center_slice_list])
+        )
+
     def get_ds_projections(self):
         ds_value = self.viewer.ds_dropdown.value
         if self.use_ds:
@@ -453,10 +543,12 @@ class Center:
     def refresh_plots(self):
         self.viewer.plot(self.projections, no_check=True)
         self.reg = None
+        self.center_sweep.clear()
         self._load_rough_center_onclick(None)
         self.find_center_button.enable()
         self.find_center_manual_button.enable()
         self.find_center_vo_button.enable()
+        self.find_centers_multislice_button.enable()
 
     def make_tab(self):
         """
@@ -470,6 +562,14 @@ class Center:
                     [self.find_center_button.button, self.find_center_vo_button.button],
                     layout=Layout(justify_content="center"),
                 ),
+                HBox(
+                    [
+                        self.find_centers_multislice_button.button,
+                        self.num_auto_slices_textbox,
+                        self.metric_dropdown,
+                    ],
+                    layout=Layout(justify_content="center"),
+                ),
                 HBox(
                     [
                         self.center_guess_textbox,
@@ -78,7 +78,7 @@ class BqImViewer_HDF5(BqImViewerBase):
             self.images = self.projections.data
             self.hist.precomputed_hist = self.projections.hist
 
-        self.plotted_image.image = self.images[self.image_index_slider.value]
+        self.show_image(self.image_index_slider.value)
         self.change_aspect_ratio()
 
 
@@ -8,7 +8,6 @@ import os
 import json
 import tifffile as tf
 import copy
-import h5py
 
 from ipyfilechooser import FileChooser
 from ipyfilechooser.errors import InvalidPathError, InvalidFileNameError
@@ -30,6 +29,7 @@ from tomopyui.backend.io import (
     Metadata_General_Prenorm,
     RawProjectionsTiff_SSRL62B,
 )
+from tomopyui.backend.util.zarr_store import open_store
 from tomopyui.widgets import helpers
 from tomopyui.widgets.helpers import (
     ReactiveTextButton,
@@ -766,7 +766,7 @@ class PrenormUploader(UploaderBase):
             elif image.suffix == ".hdf5" or image.suffix == ".h5":
                 self.projections.filepath = self.filedir / str(image)
                 try:
-                    with h5py.File(self.projections.filepath) as f:
+                    with open_store(self.projections.filepath) as f:
                         size = f[self.projections.hdf_key_norm_proj].shape
                         sizeZ = size[0]
                         sizeY = size[1]
@@ -1391,6 +1391,12 @@ class RawUploader_SSRL62C(UploaderBase):
             disabled=True,
         )
         self.energy_overwrite_textbox.observe(self.energy_overwrite, names="value")
+        self.interpolate_flats_checkbox = Checkbox(
+            description="Interpolate between references.",
+            value=False,
+            style=extend_description_style,
+            disabled=False,
+        )
 
         self.already_uploaded_energies_select = Select(
             options=["7700.00", "7800.00", "7900.00"],
@@ -1503,6 +1509,7 @@ class RawUploader_SSRL62C(UploaderBase):
                         self.energy_select_label,
                         self.energy_select_multiple,
                         self.energy_overwrite_textbox,
+                        self.interpolate_flats_checkbox,
                         self.save_tiff_on_import_checkbox,
                         VBox(
                             [
@@ -15,6 +15,8 @@ from tomopyui.widgets.view import (
     BqImViewer_Projections_Child,
 )
 from tomopyui.backend.util.padding import *
+from tomopyui.backend.util.alignment import shift_projections as shift_projections_padded
+from tomopyui.backend.util.shift import shift_stack
 from tomopyui.backend.io import Metadata_Prep
 
 
@@ -500,7 +502,7 @@ class Prep(ABC):
                 self.prep_list_select.index = num
             self.altered_projections.data = self.prepped_data
             self.altered_viewer.images = self.altered_projections.data
-            self.altered_viewer.plotted_image.image = self.altered_projections.data[0]
+            self.altered_viewer.show_image(0)
             if self.save_on:
                 self.make_prep_dir()
                 self.metadata.set_metadata(self)
@@ -618,34 +620,12 @@ class PrepMethod:
 
 
 def shift_projections(projections, sx, sy):
-    new_prj_imgs = copy.deepcopy(projections)
-    pad_x = int(np.ceil(np.max(np.abs(sx))))
-    pad_y = int(np.ceil(np.max(np.abs(sy))))
-    pad = (pad_x, pad_y)
-    new_prj_imgs = pad_projections(new_prj_imgs, pad)
-    new_prj_imgs = shift_prj_cp(
-        new_prj_imgs,
-        sx,
-        sy,
-        5,
-        pad,
-        use_corr_prj_gpu=False,
-    )
-    return new_prj_imgs
+    return shift_projections_padded(projections, sx, sy)
 
-def shift_projections_nopad(projections, sx, sy):
-    new_prj_imgs = copy.deepcopy(projections)
-    new_prj_imgs = shift_prj_cp(
-        new_prj_imgs,
-        sx,
-        sy,
-        5,
-        (0,0),
-        use_corr_prj_gpu=False,
-        use_pad_cond=False,
-    )
-    return new_prj_imgs
 
+def shift_projections_nopad(projections, sx, sy):
+    # not padded, so edges are zero-filled rather than wrapped around
+    return shift_stack(projections, sx, sy, method="spline", num_batches=5)
 
 
 def renormalize_by_roi(projections, px_range_x, px_range_y):
@@ -11,6 +11,8 @@ from bqplot_image_gl import ImageGL
 from ipywidgets import *
 from skimage.transform import rescale  # look for better option
 from tomopyui._sharedvars import *
+from tomopyui.backend.util.frames import LazyFrames
+from tomopyui.backend.util.tiles import TileServer
 from bqplot_image_gl.interacts import MouseInteraction, keyboard_events, mouse_events
 from bqplot import PanZoom
 
@@ -64,6 +66,10 @@ class BqImViewerBase(ABC):
         self.current_interval = 300
         self.from_hdf = False
         self.from_npy = False
+        # level-of-detail server, used while self.images is self.lod_images
+        self.lod = None
+        self.lod_images = None
+        self._lazy_opened = []
         self._init_fig()
         self._init_widgets()
         self._init_hist()
@@ -249,6 +255,10 @@ class BqImViewerBase(ABC):
         # Zoom/intensity
         self.msg_interaction.on_msg(self.on_mouse_msg_intensity)
 
+        # Pan/zoom: send the visible region at screen resolution
+        self.scale_x.observe(self.update_view, names=["min", "max"])
+        self.scale_y.observe(self.update_view, names=["min", "max"])
+
         # Rectangle selector
         self.rectangle_selector.observe(self.rectangle_to_px_range, "selected")
 
@@ -266,8 +276,12 @@ class BqImViewerBase(ABC):
 
     # Image index
     def change_image(self, change):
-        self.plotted_image.image = self.images[change.new]
+        self.show_image(change.new)
         self.current_image_ind = change.new
+        if self._lod_active():
+            self.lod.prefetch(change.new, step=change.new - change.old)
+        elif isinstance(self.images, LazyFrames):
+            self.images.prefetch(change.new, step=change.new - change.old)
 
     # Scheme
     def update_scheme(self, *args):
@@ -275,11 +289,14 @@ class BqImViewerBase(ABC):
 
     # Swap axes
     def swap_axes(self, *args):
+        lod_active = self._lod_active()
         self.images = np.swapaxes(self.images, 0, 1)
+        if lod_active:
+            self.set_lod([np.swapaxes(level, 0, 1) for level in self.lod.levels])
         self.change_aspect_ratio()
         self.image_index_slider.max = self.images.shape[0] - 1
         self.image_index_slider.value = 0
-        self.plotted_image.image = self.images[self.image_index_slider.value]
+        self.show_image(self.image_index_slider.value)
         if self.current_plot_axis == 0:
             self.current_plot_axis = 1
         else:
@@ -288,19 +305,10 @@ class BqImViewerBase(ABC):
     # Downsample the plot view
     def downsample_viewer(self, *args):
         self.ds_factor = self.ds_dropdown.value
-        if self.from_hdf and self.ds_factor != -1:
-            self.projections._load_hdf_ds_data_into_memory(pyramid_level=self.ds_factor)
-            self.original_images = self.projections.data
-            self.images = self.projections.data_ds
-            self.hist.precomputed_hist = self.projections.hist
-        elif self.from_hdf and self.ds_factor == -1:
-            self.projections._load_hdf_normalized_data_into_memory()
-            self.original_images = self.projections.data
-            self.images = self.projections.data
-            self.hist.precomputed_hist = self.projections.hist
+        if self.from_hdf:
+            self.set_lazy_images(self.ds_factor)
         else:
             if self.ds_factor == -1:
-                self.plotted_image.image = self.original_images[0]
                 self.images = self.original_images
                 self.change_aspect_ratio()
             else:
@@ -312,7 +320,7 @@ class BqImViewerBase(ABC):
                     (1, ds_num, ds_num),
                     anti_aliasing=False,
                 )
-        self.plotted_image.image = self.images[self.image_index_slider.value]
+        self.show_image(self.image_index_slider.value)
         self.change_aspect_ratio()
 
     # Reset
@@ -321,7 +329,7 @@ class BqImViewerBase(ABC):
             self.swap_axes()
         self.current_image_ind = 0
         self.change_aspect_ratio()
-        self.plotted_image.image = self.images[0]
+        self.show_image(0)
         self.hist.reset_state()
         self.image_scale["image"].min = self.hist.vmin
         self.image_scale["image"].max = self.hist.vmax
@@ -345,22 +353,18 @@ class BqImViewerBase(ABC):
         fig, ax = plt.subplots(figsize=(10, 5))
         _ = ax.set_axis_off()
         _ = fig.patch.set_facecolor("black")
-        ims = []
         vmin = self.image_scale["image"].min
         vmax = self.image_scale["image"].max
-        if self.from_hdf:
-            self.projections._load_hdf_ds_data_into_memory(self.ds_dropdown.value)
-            self.images = self.projections.data_ds
-        for image in self.images:
-            im = ax.imshow(image, animated=True, vmin=vmin, vmax=vmax)
-            ims.append([im])
-        ani = animation.ArtistAnimation(
-            fig, ims, interval=300, blit=True, repeat_delay=1000
-        )
         writer = animation.FFMpegWriter(
             fps=20, codec=None, bitrate=1000, extra_args=None, metadata=None
         )
-        _ = ani.save(str(pathlib.Path(self.filedir / "movie.mp4")), writer=writer)
+        # frames are read and encoded one at a time
+        im = ax.imshow(self.images[0], vmin=vmin, vmax=vmax)
+        with writer.saving(fig, str(pathlib.Path(self.filedir / "movie.mp4")), 100):
+            for i in range(self.images.shape[0]):
+                im.set_data(self.images[i])
+                writer.grab_frame()
+        plt.close(fig)
         self.save_movie_button.icon = "file-video"
         self.save_movie_button.button_style = "success"
 
@@ -475,13 +479,120 @@ class BqImViewerBase(ABC):
         self.px_range_x = [0, self.pxX - 1]
         self.px_range_y = [0, self.pxY - 1]
         self.px_range = [self.px_range_x, self.px_range_y]
-        self.plotted_image.image = self.images[0]
+        self.show_image(0)
         self.image_index_slider.max = self.pxZ - 1
         self.image_index_slider.value = 0
         self.current_image_ind = 0
         self.change_aspect_ratio()
         self.hist.refresh_histogram()
 
+    def set_lazy_images(self, pyramid_level):
+        """
+        Shows frames of self.projections read on demand from its hdf5 file,
+        instead of loading the whole stack (see `LazyFrames`).
+
+        Parameters
+        ----------
+        pyramid_level : int
+            -1 for the original data, otherwise the downsampled level.
+        """
+        self.close_lazy_images()
+        levels = [self.projections._lazy_frames(pyramid_level)]
+        # coarser levels, for the level-of-detail server
+        for _, level in self.ds_dropdown.options:
+            if level > pyramid_level:
+                try:
+                    levels.append(self.projections._lazy_frames(level))
+                except KeyError:
+                    break
+        self.original_images = levels[0]
+        if pyramid_level != -1:
+            self.original_images = self.projections._lazy_frames(-1)
+            self._lazy_opened.append(self.original_images)
+        self._lazy_opened += levels
+        if self.current_plot_axis == 1:
+            levels = [np.swapaxes(level, 0, 1) for level in levels]
+        self.images = levels[0]
+        self.set_lod(levels)
+        self.projections._load_hdf_hist(pyramid_level)
+        self.hist.precomputed_hist = self.projections.hist
+
+    def close_lazy_images(self):
+        """
+        Closes the files opened by `set_lazy_images` and the level-of-detail
+        server.
+        """
+        if self.lod is not None:
+            self.lod.close()
+            for level in self.lod.levels:
+                if isinstance(level, LazyFrames):
+                    level.close()
+        self.lod = None
+        self.lod_images = None
+        for images in self._lazy_opened:
+            images.close()
+        self._lazy_opened = []
+
+    # -- Level of detail ---------------------------------------------------------------
+    def set_lod(self, levels):
+        """
+        Serves self.images through a `TileServer` over levels (finest first,
+        levels[0] being self.images), so that only the visible region is sent to
+        the browser, at the coarsest level that still fills the figure.
+        """
+        if self.lod is not None:
+            self.lod.close()
+            # swapped views made for the old server (files stay open)
+            for level in self.lod.levels:
+                if isinstance(level, LazyFrames) and level not in self._lazy_opened:
+                    level.close()
+        self.lod = TileServer(levels)
+        self.lod_images = self.images
+
+    def _lod_active(self):
+        # images set anywhere else (e.g. cropped, processed) are shown as they are
+        return self.lod is not None and self.images is self.lod_images
+
+    def _fig_px(self):
+        px = []
+        for size, default in zip(
+            (self.fig.layout.width, self.fig.layout.height), self.dimensions
+        ):
+            if size is None or not str(size).endswith("px"):
+                size = default
+            px.append(float(str(size)[:-2]))
+        return tuple(px)
+
+    def _visible_range(self):
+        x_range = (self.scale_x.min, self.scale_x.max)
+        y_range = (self.scale_y.min, self.scale_y.max)
+        if None in x_range or None in y_range:
+            return (0, 1), (0, 1)
+        return tuple(sorted(x_range)), tuple(sorted(y_range))
+
+    def show_image(self, ind):
+        """
+        Shows image ind of self.images: the visible region at screen resolution
+        if a level-of-detail server is set up for them, otherwise the whole image.
+        """
+        if self._lod_active():
+            x_range, y_range = self._visible_range()
+            image, x_extent, y_extent, _ = self.lod.view(
+                ind, x_range, y_range, self._fig_px()
+            )
+        else:
+            image, x_extent, y_extent = self.images[ind], (0, 1), (0, 1)
+        with self.plotted_image.hold_sync():
+            self.plotted_image.image = image
+            if tuple(self.plotted_image.x) != x_extent:
+                self.plotted_image.x = x_extent
+            if tuple(self.plotted_image.y) != y_extent:
+                self.plotted_image.y = y_extent
+
+    def update_view(self, *args):
+        if self._lod_active():
+            self.show_image(self.image_index_slider.value)
+
     def get_ds_factor_from_dropdown(self):
         ds_factor = self.ds_dropdown.value
         if ds_factor == -1:
@@ -586,6 +697,9 @@ class BqImViewer_Projections_Parent(BqImViewerBase):
             self.original_images = self.projections.data
             self.images = self.original_images
         self.check_npy_or_hdf(projections)
+        if self.from_hdf:
+            # hdf5 file or Zarr store
+            self.set_lazy_images(self.ds_dropdown.value)
         self.set_state_on_plot()
 
 
@@ -703,7 +817,7 @@ class BqImViewer_Projections_Child(BqImViewer_Projections_Parent):
             upperX = int(self.viewer_parent.px_range_x[1] * ds_factor)
             self.images = copy.deepcopy(imtemp[:, lowerY:upperY, lowerX:upperX])
             self.change_aspect_ratio()
-            self.plotted_image.image = self.images[self.viewer_parent.current_image_ind]
+            self.show_image(self.viewer_parent.current_image_ind)
             # This is confusing - decide on better names. The actual dimensions are
             # stored in self.projections.px_range_x, but this will eventually set the
             # Analysis attributes for px_range_x, px_range_y to input into
@@ -900,7 +1014,7 @@ class BqImViewer_Center_Recon(BqImViewer_Projections_Parent):
         self.change_aspect_ratio()
         self.image_index_slider.max = self.images.shape[0] - 1
         self.image_index_slider.value = int(self.images.shape[0] / 2)
-        self.plotted_image.image = self.images[self.image_index_slider.value]
+        self.show_image(self.image_index_slider.value)
         self.hist.refresh_histogram()
         self.hist.rm_high_low_int(None)
 
@@ -1065,7 +1179,7 @@ class BqImViewer_TwoEnergy_Low(BqImViewer_TwoEnergy_High):
             self._images = self.images
             self.diff_images = self.viewer_parent.images - self.images
             self.images = self.diff_images
-            self.plotted_image.image = self.images[self.image_index_slider.value]
+            self.show_image(self.image_index_slider.value)
             self.diff_on = True
             self._disable_diff_callback = True
             self.diff_button.button_style = "success"
@@ -1073,7 +1187,7 @@ class BqImViewer_TwoEnergy_Low(BqImViewer_TwoEnergy_High):
         else:
             del self.diff_images
             self.images = self._images
-            self.plotted_image.image = self.images[self.image_index_slider.value]
+            self.show_image(self.image_index_slider.value)
             self.diff_on = False
             self._disable_diff_callback = True
             self.diff_button.button_style = ""
@@ -1089,7 +1203,7 @@ class BqImViewer_TwoEnergy_Low(BqImViewer_TwoEnergy_High):
         self.current_image_ind = 0
         self.change_aspect_ratio()
         self.image_index_slider.max = self.images.shape[0] - 1
-        self.plotted_image.image = self.images[self.image_index_slider.value]
+        self.show_image(self.image_index_slider.value)
 
         # self.hist.refresh_histogram()
         # self.hist.rm_high_low_int(None)